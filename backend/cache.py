@@ -0,0 +1,106 @@
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+# Lets callers cache None (e.g. "no match above threshold") and still tell it from a miss
+MISSING = object()
+
+
+def normalize_query(query):
+    # "Monday  Mood" and "monday mood" should share a cache entry
+    return " ".join(query.lower().split())
+
+
+class LRUCache:
+    """
+    Thread-safe bounded LRU cache with an optional per-entry TTL.
+
+    Hits, misses, evictions and expirations are counted so the cache can be
+    sized from `stats()`. `save()` / `load()` pickle the live entries so a
+    restarted process can begin warm.
+    """
+
+    def __init__(self, name, maxsize=1024, ttl=None):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at is None or expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+                self.expirations += 1
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl=None):
+        ttl = ttl if ttl is not None else self.ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+    def save(self, path):
+        # Monotonic deadlines don't survive a restart, so store remaining TTLs
+        now = time.monotonic()
+        with self._lock:
+            entries = [
+                (key, value, None if expires_at is None else expires_at - now)
+                for key, (value, expires_at) in self._data.items()
+                if expires_at is None or expires_at > now
+            ]
+        # Every gunicorn worker saves at shutdown; each writes its own temp file and the
+        # last complete one wins the rename
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(entries, f)
+        os.replace(tmp_path, path)
+        return len(entries)
+
+    def load(self, path):
+        if not os.path.exists(path):
+            return 0
+        with open(path, 'rb') as f:
+            entries = pickle.load(f)
+        now = time.monotonic()
+        with self._lock:
+            for key, value, remaining in entries[-self.maxsize:]:
+                self._data[key] = (value, None if remaining is None else now + remaining)
+        return len(entries)
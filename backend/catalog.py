@@ -0,0 +1,54 @@
+import gzip
+import hashlib
+import json
+from cache import LRUCache
+
+
+class MemeCatalog:
+    """
+    Serialized /get-all-memes responses built from the in-memory metadata.
+
+    Each (page, field projection) is rendered once per search snapshot and
+    vote-store version: the JSON body, its gzip encoding and a strong ETag
+    are cached together, so repeat requests cost a dictionary lookup and
+    conditional requests can be answered with 304.
+    """
+
+    def __init__(self, search_engine, vote_store, maxsize=64):
+        self.search_engine = search_engine
+        self.vote_store = vote_store
+        self._responses = LRUCache('catalog_responses', maxsize=maxsize)
+
+    def render(self, offset=0, limit=None, fields=None):
+        fields = tuple(sorted(set(fields) | {'image_name'})) if fields else None
+        snapshot = self.search_engine.snapshot
+        key = (snapshot.version, self.vote_store.version(), offset, limit, fields)
+        cached = self._responses.get(key)
+        if cached is not None:
+            return cached
+
+        memes = snapshot.metadata
+        page = memes[offset:offset + limit] if limit is not None else memes[offset:]
+        counts = self.vote_store.all_counts()
+
+        items = []
+        for meme in page:
+            item = {
+                **meme,
+                **counts.get(meme['image_name'], {}),
+                **snapshot.image_urls(meme['image_name'])
+            }
+            if fields:
+                item = {f: item[f] for f in fields if f in item}
+            items.append(item)
+
+        body = json.dumps({
+            "memes": items,
+            "total": len(memes),
+            "offset": offset,
+            "limit": limit
+        }, separators=(',', ':')).encode('utf-8')
+        etag = f'"{hashlib.sha1(body).hexdigest()}"'
+        rendered = (body, gzip.compress(body, compresslevel=6), etag)
+        self._responses.set(key, rendered)
+        return rendered
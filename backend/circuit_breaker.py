@@ -0,0 +1,74 @@
+import time
+
+BREAKER_STATES = ('closed', 'open', 'half_open')
+
+
+class CircuitBreaker:
+    """
+    Per-upstream circuit breaker with exponential backoff.
+
+    After `failure_threshold` consecutive failures the circuit opens and
+    callers skip the upstream for `base_backoff` seconds. Then one probe
+    request is let through (half-open): success closes the circuit, failure
+    opens it again for twice as long, up to `max_backoff`.
+
+    Used from the event loop only, so there is no locking.
+    """
+
+    def __init__(self, name, failure_threshold=3, base_backoff=5.0, max_backoff=300.0, clock=time.monotonic):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.clock = clock
+        self.failures = 0  # consecutive, reset by any success
+        self.trips = 0  # consecutive openings, sets the backoff
+        self.opened_until = 0.0
+        self.probing = False
+        self.skipped = 0
+
+    @property
+    def state(self):
+        if self.trips == 0:
+            return 'closed'
+        if self.probing or self.clock() >= self.opened_until:
+            return 'half_open'
+        return 'open'
+
+    def allow(self):
+        # True if the caller may try the upstream now; a half-open circuit admits one probe at a time
+        state = self.state
+        if state == 'closed':
+            return True
+        if state == 'half_open' and not self.probing:
+            self.probing = True
+            return True
+        self.skipped += 1
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.trips = 0
+        self.probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.probing or self.failures >= self.failure_threshold:
+            self.trips += 1
+            backoff = min(self.max_backoff, self.base_backoff * 2 ** (self.trips - 1))
+            self.opened_until = self.clock() + backoff
+            self.probing = False
+            self.failures = 0
+            print(f"Circuit for {self.name} opened for {backoff:.0f}s")
+
+    def retry_in(self):
+        return max(0.0, self.opened_until - self.clock()) if self.state == 'open' else 0.0
+
+    def stats(self):
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "trips": self.trips,
+            "retry_in_s": round(self.retry_in(), 1),
+            "skipped": self.skipped
+        }
@@ -0,0 +1,193 @@
+import json
+import os
+import numpy as np
+from PIL import Image, ImageOps
+
+HASHES_FILENAME = 'image_hashes.json'
+
+# Defaults: dHash bits that may differ for "same picture" (re-encodes, resizes,
+# small crops), and cosine above which two memes say the same thing
+HASH_DISTANCE = 6
+TEXT_SIMILARITY = 0.97
+
+
+def dhash(image, hash_size=8):
+    """
+    64-bit difference hash of an image (path or PIL image).
+
+    The image is shrunk to (hash_size + 1) x hash_size grey pixels and each bit
+    records whether a pixel is brighter than its right neighbour, so the hash
+    survives re-encoding, resizing and colour tweaks.
+    """
+    if isinstance(image, str):
+        with Image.open(image) as im:
+            return dhash(im, hash_size)
+    image.seek(0)
+    grey = ImageOps.exif_transpose(image).convert('L').resize((hash_size + 1, hash_size), Image.LANCZOS)
+    pixels = np.asarray(grey, dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return int(np.packbits(bits).view('>u8')[0])
+
+
+def hamming(hashes, other):
+    # Bit distance between uint64 hashes (arrays broadcast against each other)
+    return np.bitwise_count(np.bitwise_xor(hashes, other))
+
+
+def hash_pairs(hashes, max_distance=HASH_DISTANCE, block_size=2048):
+    """
+    All (i, j, distance) with i < j whose hashes differ in at most `max_distance` bits.
+
+    Compared block against block so memory stays at block_size^2 while every
+    comparison is a vectorized XOR + popcount.
+    """
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    found = []
+    for start in range(0, len(hashes), block_size):
+        block = hashes[start:start + block_size]
+        for other_start in range(start, len(hashes), block_size):
+            distances = hamming(block[:, None], hashes[None, other_start:other_start + block_size])
+            rows, cols = np.nonzero(distances <= max_distance)
+            keep = cols + other_start > rows + start
+            rows, cols = rows[keep], cols[keep]
+            found.append((rows + start, cols + other_start, distances[rows, cols]))
+    return _concat_pairs(found)
+
+
+def similarity_pairs(matrix, threshold=TEXT_SIMILARITY, block_size=2048):
+    """
+    All (i, j, cosine) with i < j and cosine >= threshold over unit-length rows.
+
+    Computed as blocked matrix-matrix products over the upper triangle, so a
+    million-row (memory-mapped) store never needs an N x N matrix.
+    """
+    n = matrix.shape[0]
+    found = []
+    for start in range(0, n, block_size):
+        block = np.asarray(matrix[start:start + block_size], dtype=np.float32)
+        for other_start in range(start, n, block_size):
+            other = block if other_start == start else np.asarray(matrix[other_start:other_start + block_size], dtype=np.float32)
+            similarities = block @ other.T
+            rows, cols = np.nonzero(similarities >= threshold)
+            keep = cols + other_start > rows + start
+            rows, cols = rows[keep], cols[keep]
+            found.append((rows + start, cols + other_start, similarities[rows, cols]))
+    return _concat_pairs(found)
+
+
+def _concat_pairs(found):
+    if not found:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0)
+    return tuple(np.concatenate(parts) for parts in zip(*found))
+
+
+def clusters(n, rows, cols):
+    # Connected components (union-find) of the pair graph; only groups of two or more
+    parent = np.arange(n)
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i, j in zip(rows.tolist(), cols.tolist()):
+        root_i, root_j = find(i), find(j)
+        if root_i != root_j:
+            parent[max(root_i, root_j)] = min(root_i, root_j)
+
+    groups = {}
+    for i in range(n):
+        groups.setdefault(find(i), []).append(i)
+    return [members for members in groups.values() if len(members) > 1]
+
+
+def load_hashes(metadata_dir):
+    path = os.path.join(metadata_dir, HASHES_FILENAME)
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def save_hashes(metadata_dir, hashes):
+    path = os.path.join(metadata_dir, HASHES_FILENAME)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(hashes, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def hash_images(images_dir, image_names, known=None):
+    """
+    {image_name: {"dhash", "size", "mtime"}} for the images that exist on disk.
+
+    Entries in `known` (a previous image_hashes.json) are reused while the
+    file's size and mtime are unchanged.
+    """
+    known = known or {}
+    hashes = {}
+    for name in image_names:
+        path = os.path.join(images_dir, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        entry = known.get(name)
+        if entry and entry.get('size') == stat.st_size and entry.get('mtime') == int(stat.st_mtime):
+            hashes[name] = entry
+            continue
+        try:
+            hashes[name] = {"dhash": f"{dhash(path):016x}", "size": stat.st_size, "mtime": int(stat.st_mtime)}
+        except OSError as e:
+            print(f"Could not hash {name}: {e}")
+    return hashes
+
+
+class DuplicateChecker:
+    """
+    Near-duplicate lookups for one incoming meme against the vault.
+
+    Image hashes come from metadata/image_hashes.json (written by
+    scripts/deduplicate_metadata.py) and are filled in for any vault image
+    missing from it on first use (and again after every snapshot reload).
+    Text similarity is a top-k lookup in the current snapshot's vector index.
+    """
+
+    def __init__(self, search_engine, images_dir, max_distance=HASH_DISTANCE, threshold=TEXT_SIMILARITY):
+        self.search_engine = search_engine
+        self.images_dir = images_dir
+        self.max_distance = max_distance
+        self.threshold = threshold
+        self._entries = {}
+        self._names = None
+        self._hashes = None
+        self._version = None
+
+    def _vault_hashes(self):
+        snapshot = self.search_engine.snapshot
+        if self._version != snapshot.version:
+            known = {**load_hashes(snapshot.metadata_dir), **self._entries}
+            entries = hash_images(self.images_dir, [m['image_name'] for m in snapshot.metadata], known=known)
+            self._entries = entries
+            self._names = list(entries)
+            self._hashes = np.array([int(e['dhash'], 16) for e in entries.values()], dtype=np.uint64)
+            self._version = snapshot.version
+        return self._names, self._hashes
+
+    def check(self, image_hash=None, embedding=None):
+        # Vault memes this one duplicates, closest first
+        matches = {}
+        if image_hash is not None:
+            names, hashes = self._vault_hashes()
+            distances = hamming(hashes, np.uint64(image_hash))
+            for i in np.flatnonzero(distances <= self.max_distance):
+                matches[names[i]] = {"image_name": names[i], "hash_distance": int(distances[i])}
+        if embedding is not None:
+            snapshot = self.search_engine.snapshot
+            ids, scores = snapshot.index.search(np.asarray(embedding, dtype=np.float32), 5)
+            for i, score in zip(ids, scores):
+                if score >= self.threshold:
+                    name = snapshot.image_names[i]
+                    matches.setdefault(name, {"image_name": name})["similarity"] = round(float(score), 4)
+        return sorted(matches.values(), key=lambda m: (m.get('hash_distance', 64), -m.get('similarity', 0)))
@@ -0,0 +1,132 @@
+import hashlib
+import json
+import os
+import numpy as np
+
+VECTORS_FILENAME = 'meme_embeddings.npy'
+NAMES_FILENAME = 'meme_embeddings_names.json'
+JSON_FILENAME = 'meme_embeddings.json'
+
+SUPPORTED_DTYPES = ('float32', 'float16')
+FORMAT_VERSION = 1
+
+
+def meme_text(meme):
+    # Construct text for embedding: tags + prompt + captions
+    tags_text = " ".join(meme.get('tags', []))
+    prompt_text = meme.get('prompt', "")
+    captions_text = " ".join(meme.get('captions', []))
+    return f"{tags_text} {prompt_text} {captions_text}".strip()
+
+
+def text_hash(text, model_name):
+    # Changes when either the embedded text or the model does
+    return hashlib.sha256(f"{model_name}\n{text}".encode('utf-8')).hexdigest()[:16]
+
+
+class EmbeddingStore:
+    """
+    Binary embedding index stored next to the metadata.
+
+    Vectors live in a plain .npy matrix (float32 or float16, one row per meme)
+    that is opened with mmap, so loading it costs no parsing and no copy.
+    Image names live in a small JSON sidecar in the same row order.
+    The old meme_embeddings.json is only used as an import/export format.
+    """
+
+    def __init__(self, metadata_dir):
+        self.metadata_dir = metadata_dir
+        self.vectors_path = os.path.join(metadata_dir, VECTORS_FILENAME)
+        self.names_path = os.path.join(metadata_dir, NAMES_FILENAME)
+        self.json_path = os.path.join(metadata_dir, JSON_FILENAME)
+
+    def exists(self):
+        return os.path.exists(self.vectors_path) and os.path.exists(self.names_path)
+
+    def read_sidecar(self):
+        with open(self.names_path, 'r') as f:
+            return json.load(f)
+
+    def load(self, mmap=True):
+        sidecar = self.read_sidecar()
+
+        matrix = np.load(self.vectors_path, mmap_mode='r' if mmap else None)
+        image_names = sidecar['image_names']
+
+        if matrix.ndim != 2 or matrix.shape[0] != len(image_names):
+            raise ValueError(
+                f"Embedding store is inconsistent: {matrix.shape} vectors for {len(image_names)} names"
+            )
+        return image_names, matrix
+
+    def save(self, image_names, matrix, dtype='float32', text_hashes=None):
+        if dtype not in SUPPORTED_DTYPES:
+            raise ValueError(f"Unsupported dtype '{dtype}', expected one of {SUPPORTED_DTYPES}")
+
+        matrix = np.ascontiguousarray(matrix, dtype=dtype)
+        if matrix.ndim != 2 or matrix.shape[0] != len(image_names):
+            raise ValueError(f"Got {matrix.shape} vectors for {len(image_names)} names")
+
+        os.makedirs(self.metadata_dir, exist_ok=True)
+        sidecar = {
+            "format_version": FORMAT_VERSION,
+            "dtype": dtype,
+            "dim": int(matrix.shape[1]),
+            "count": len(image_names),
+            "image_names": list(image_names),
+        }
+        if text_hashes is not None:
+            # Lets generate_embeddings.py re-embed only memes whose text changed
+            sidecar["text_hashes"] = list(text_hashes)
+
+        # Write to temp files and swap them in so a reader never sees half a file
+        tmp_vectors = self.vectors_path + '.tmp'
+        tmp_names = self.names_path + '.tmp'
+        with open(tmp_vectors, 'wb') as f:
+            np.save(f, matrix)
+        with open(tmp_names, 'w') as f:
+            json.dump(sidecar, f, indent=2)
+        os.replace(tmp_vectors, self.vectors_path)
+        os.replace(tmp_names, self.names_path)
+
+    def read_json(self, json_path=None, dtype='float32'):
+        json_path = json_path or self.json_path
+        with open(json_path, 'r') as f:
+            embeddings_data = json.load(f)
+
+        image_names = [item['image_name'] for item in embeddings_data]
+        matrix = np.array([item['embedding'] for item in embeddings_data], dtype=dtype)
+        return image_names, matrix
+
+    def import_json(self, json_path=None, dtype='float32'):
+        image_names, matrix = self.read_json(json_path, dtype=dtype)
+        self.save(image_names, matrix, dtype=dtype)
+        return image_names, matrix
+
+    def export_json(self, json_path=None):
+        json_path = json_path or self.json_path
+        image_names, matrix = self.load(mmap=True)
+        embeddings_data = [
+            {"image_name": name, "embedding": matrix[i].astype(np.float32).tolist()}
+            for i, name in enumerate(image_names)
+        ]
+        with open(json_path, 'w') as f:
+            json.dump(embeddings_data, f, indent=2)
+        return len(embeddings_data)
+
+    def load_or_import(self):
+        if self.exists():
+            return self.load(mmap=True)
+
+        if not os.path.exists(self.json_path):
+            raise FileNotFoundError(f"No embeddings found in {self.metadata_dir}")
+
+        print(f"Binary embedding store not found, importing {self.json_path}...")
+        image_names, matrix = self.read_json()
+        try:
+            self.save(image_names, matrix)
+        except OSError as e:
+            # Read-only deploys can still serve the imported matrix from memory
+            print(f"Could not write binary embedding store: {e}")
+            return image_names, matrix
+        return self.load(mmap=True)
@@ -0,0 +1,247 @@
+import asyncio
+import os
+import threading
+import time
+import numpy as np
+from cache import LRUCache, normalize_query
+from metrics import ENCODE_BATCH_SIZE, ENCODE_SECONDS, MODEL_LOAD_SECONDS
+
+MODEL_NAME = 'all-MiniLM-L6-v2'
+
+# torch: SentenceTransformer in fp32. onnx: the int8 export from scripts/export_onnx.py (no torch needed)
+ENCODER_BACKENDS = ('torch', 'onnx')
+
+
+class Encoder:
+    """
+    The one embedding model shared by SearchEngine and ExternalMemeFetcher.
+
+    The model is loaded once per process, either eagerly at startup or from a
+    background thread, so a user request never pays for model initialization
+    unless it arrives while the load is still running.
+
+    `backend` and `threads` default to MEMEDOCK_ENCODER_BACKEND and
+    MEMEDOCK_ENCODER_THREADS. The backend's library is only imported on load,
+    so the onnx backend never imports torch.
+    """
+
+    def __init__(self, model_name=MODEL_NAME, backend=None, threads=None, onnx_model_dir=None):
+        self.model_name = model_name
+        self.backend = backend or os.getenv('MEMEDOCK_ENCODER_BACKEND', 'torch')
+        if self.backend not in ENCODER_BACKENDS:
+            raise ValueError(f"Unknown encoder backend '{self.backend}', expected one of {ENCODER_BACKENDS}")
+        self.threads = threads or int(os.getenv('MEMEDOCK_ENCODER_THREADS', '0')) or None
+        self.onnx_model_dir = onnx_model_dir or os.getenv('MEMEDOCK_ONNX_MODEL_DIR')
+        self.model = None
+        self.load_seconds = None
+        self.load_error = None
+        self._lock = threading.Lock()
+
+        # Normalized query -> embedding, shared by every caller
+        self.query_cache = LRUCache('query_embeddings', maxsize=int(os.getenv('MEMEDOCK_QUERY_CACHE_SIZE', '4096')))
+
+    @property
+    def ready(self):
+        return self.model is not None
+
+    def load(self):
+        if self.model is None:
+            with self._lock:
+                if self.model is None:
+                    print(f"Loading {self.backend} model ({self.model_name})...")
+                    start = time.perf_counter()
+                    try:
+                        model = self._load_model()
+                    except Exception as e:
+                        self.load_error = str(e)
+                        raise
+                    self.load_seconds = time.perf_counter() - start
+                    MODEL_LOAD_SECONDS.observe(self.load_seconds, backend=self.backend)
+                    self.load_error = None
+                    self.model = model
+                    print(f"Model loaded in {self.load_seconds:.2f}s.")
+        return self.model
+
+    def _load_model(self):
+        if self.backend == 'onnx':
+            from onnx_encoder import OnnxEncoder, DEFAULT_MODEL_DIR
+            return OnnxEncoder(self.onnx_model_dir or DEFAULT_MODEL_DIR, threads=self.threads)
+
+        from sentence_transformers import SentenceTransformer
+        if self.threads:
+            import torch
+            torch.set_num_threads(self.threads)
+        return SentenceTransformer(self.model_name)
+
+    def preload(self):
+        # Load the weights in a process that is about to fork workers (gunicorn --preload),
+        # so they share one copy. Nothing is encoded here: thread pools started before
+        # a fork don't exist in the children, so the first encode has to happen there.
+        if self.backend == 'onnx':
+            # An InferenceSession starts its thread pool on creation, so it can't be forked
+            print("onnx sessions can't be shared across fork, each worker loads its own.")
+            return False
+        self.load()
+        return True
+
+    def warmup(self):
+        # One throwaway encode so lazy kernels/allocations happen before real traffic
+        self.load().encode("warmup")
+
+    def start_background_load(self):
+        def run():
+            try:
+                self.warmup()
+            except Exception as e:
+                print(f"Background model load failed: {e}")
+
+        thread = threading.Thread(target=run, name='encoder-load', daemon=True)
+        thread.start()
+        return thread
+
+    def encode(self, texts, **kwargs):
+        model = self.load()
+        start = time.perf_counter()
+        embeddings = model.encode(texts, **kwargs)
+        ENCODE_SECONDS.observe(time.perf_counter() - start, backend=self.backend)
+        ENCODE_BATCH_SIZE.observe(1 if isinstance(texts, str) else len(texts))
+        return embeddings
+
+    def encode_query(self, query):
+        key = normalize_query(query)
+        query_embedding = self.query_cache.get(key)
+        if query_embedding is None:
+            query_embedding = self.encode(query)
+            self.query_cache.set(key, query_embedding)
+        return query_embedding
+
+    def encode_queries(self, queries):
+        # Embeddings for many queries as one (len(queries), dim) matrix: cached ones are
+        # reused and all the others go through the model in a single batch
+        keys = [normalize_query(query) for query in queries]
+        embeddings = {key: self.query_cache.get(key) for key in keys}
+        missing = {key: query for key, query in zip(keys, queries) if embeddings[key] is None}
+        if missing:
+            for key, embedding in zip(missing, self.encode(list(missing.values()))):
+                self.query_cache.set(key, embedding)
+                embeddings[key] = embedding
+        return np.asarray([embeddings[key] for key in keys], dtype=np.float32)
+
+    def status(self):
+        return {
+            "model": self.model_name,
+            "backend": self.backend,
+            "threads": self.threads,
+            "ready": self.ready,
+            "load_seconds": round(self.load_seconds, 3) if self.load_seconds is not None else None,
+            "error": self.load_error
+        }
+
+
+class EncodeBatcher:
+    """
+    Async micro-batching front end for an Encoder.
+
+    Concurrent requests put their query on a queue; a single worker collects
+    whatever arrives within `max_wait_ms` (up to `max_batch_size` items), runs
+    one batched encode in a worker thread and resolves each caller's future.
+    The event loop never blocks on the model.
+    """
+
+    def __init__(self, encoder, max_batch_size=32, max_wait_ms=5):
+        self.encoder = encoder
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.batches = 0
+        self.batched_items = 0
+        self._queue = None
+        self._worker = None
+
+    def start(self):
+        if self._worker is None:
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    async def encode_query(self, query):
+        key = normalize_query(query)
+        query_embedding = self.encoder.query_cache.get(key)
+        if query_embedding is not None:
+            return query_embedding
+
+        if self._worker is None:
+            # Not started (e.g. scripts): encode directly, still off the event loop
+            return await asyncio.to_thread(self.encoder.encode_query, query)
+
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((key, query, future))
+        return await future
+
+    async def _collect(self):
+        batch = [await self._queue.get()]
+        deadline = asyncio.get_running_loop().time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - asyncio.get_running_loop().time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+
+            # Identical queries in the same window are encoded once
+            texts = {}
+            for key, query, _ in batch:
+                texts.setdefault(key, query)
+            keys = list(texts)
+
+            try:
+                embeddings = await asyncio.to_thread(self.encoder.encode, [texts[k] for k in keys])
+            except Exception as e:
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            self.batches += 1
+            self.batched_items += len(batch)
+            by_key = dict(zip(keys, embeddings))
+            for key, embedding in by_key.items():
+                self.encoder.query_cache.set(key, embedding)
+            for key, _, future in batch:
+                if not future.done():
+                    future.set_result(by_key[key])
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "batched_items": self.batched_items,
+            "avg_batch_size": round(self.batched_items / self.batches, 2) if self.batches else 0.0,
+            "queued": self._queue.qsize() if self._queue is not None else 0
+        }
+
+
+_shared_encoder = None
+_shared_lock = threading.Lock()
+
+
+def get_encoder():
+    # Process-wide default so components built without an explicit encoder still share one model
+    global _shared_encoder
+    with _shared_lock:
+        if _shared_encoder is None:
+            _shared_encoder = Encoder()
+        return _shared_encoder
@@ -1,14 +1,76 @@
 import os
-import requests
+import asyncio
+import functools
+import hashlib
+import time
+import httpx
 import praw
-import random
-from sentence_transformers import SentenceTransformer
 import numpy as np
+from cache import LRUCache, normalize_query
+from circuit_breaker import CircuitBreaker
+from encoder import get_encoder
+from imgflip_catalog import ImgflipCatalog
+from metrics import FALLBACK_SECONDS, FALLBACK_SOURCE_SECONDS, FALLBACK_SOURCES_SKIPPED
 
 class ExternalMemeFetcher:
-    def __init__(self):
+    def __init__(self, encoder=None, data_dir=None):
         self.reddit = None
-        self.model = None
+        self.encoder = encoder or get_encoder()
+        
+        # External results go stale, so they only live for a few minutes
+        self.result_cache = LRUCache(
+            'external_results',
+            maxsize=int(os.getenv('MEMEDOCK_EXTERNAL_CACHE_SIZE', '1024')),
+            ttl=int(os.getenv('MEMEDOCK_EXTERNAL_CACHE_TTL', '600'))
+        )
+        
+        # Queries that no source could match are not retried for a while either.
+        # Only set when every source answered, so an outage never gets cached as "no match".
+        self.miss_cache = LRUCache(
+            'external_misses',
+            maxsize=int(os.getenv('MEMEDOCK_EXTERNAL_MISS_CACHE_SIZE', '4096')),
+            ttl=int(os.getenv('MEMEDOCK_EXTERNAL_MISS_TTL', '300'))
+        )
+        
+        # Hot Reddit posts come back across many queries; their captions are embedded once
+        self.caption_cache = LRUCache(
+            'caption_embeddings',
+            maxsize=int(os.getenv('MEMEDOCK_CAPTION_CACHE_SIZE', '8192'))
+        )
+        
+        # Upstream endpoints are configurable so a local stub server can stand in for them
+        self.reddit_base_url = os.getenv('REDDIT_BASE_URL', 'https://www.reddit.com')
+        self.imgflip_url = os.getenv('IMGFLIP_API_URL', 'https://api.imgflip.com/get_memes')
+        self.subreddits = ['memes', 'dankmemes']
+        
+        # Each source gets its own deadline; the whole fallback has an overall budget.
+        # Whatever arrived by the deadline is used, slow sources are dropped.
+        self.source_timeout = float(os.getenv('MEMEDOCK_EXTERNAL_SOURCE_TIMEOUT', '2.5'))
+        self.total_budget = float(os.getenv('MEMEDOCK_EXTERNAL_BUDGET', '4'))
+        self._client = None
+        
+        # A source that keeps failing or timing out is skipped (with exponential backoff)
+        # instead of costing every fallback its full deadline
+        self.breakers = {
+            name: CircuitBreaker(
+                name,
+                failure_threshold=int(os.getenv('MEMEDOCK_BREAKER_FAILURES', '3')),
+                base_backoff=float(os.getenv('MEMEDOCK_BREAKER_BACKOFF', '5')),
+                max_backoff=float(os.getenv('MEMEDOCK_BREAKER_MAX_BACKOFF', '300'))
+            )
+            for name in [f"reddit/{sub}" for sub in self.subreddits] + ["imgflip"]
+        }
+        
+        # Imgflip templates are matched against a locally cached, pre-embedded catalogue
+        self.imgflip_catalog = None
+        if data_dir:
+            self.imgflip_catalog = ImgflipCatalog(
+                data_dir,
+                self.encoder,
+                self.imgflip_url,
+                self._get_client,
+                refresh_interval=float(os.getenv('MEMEDOCK_IMGFLIP_REFRESH_HOURS', '24')) * 3600
+            )
         
         # Initialize Reddit if credentials exist
         client_id = os.getenv('REDDIT_CLIENT_ID')
@@ -28,107 +90,230 @@ class ExternalMemeFetcher:
         else:
             print("Reddit credentials not found. Using JSON fallback.")
 
-    def _get_model(self):
-        if self.model is None:
-            print("Loading SentenceTransformer model (Fallback)...")
-            self.model = SentenceTransformer('all-MiniLM-L6-v2')
-        return self.model
+    def _get_client(self):
+        # One pooled client per process, created lazily inside the running event loop
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                headers={'User-Agent': 'MemeVault/1.0'},
+                timeout=httpx.Timeout(self.source_timeout),
+                limits=httpx.Limits(max_connections=50, max_keepalive_connections=20),
+                follow_redirects=True
+            )
+        return self._client
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def search_external(self, query):
+        cache_key = normalize_query(query)
+        cached = self.result_cache.get(cache_key)
+        if cached is not None:
+            print(f"External result cache hit for: {query}")
+            return cached
+        if self.miss_cache.get(cache_key):
+            print(f"External miss cache hit for: {query}")
+            return None
+
+        start = time.perf_counter()
+        try:
+            result, complete = await self._search_external(query)
+        except Exception:
+            FALLBACK_SECONDS.observe(time.perf_counter() - start, outcome='error')
+            raise
+        if result is not None and complete:
+            outcome = 'found'
+            self.result_cache.set(cache_key, result)
+        elif result is not None:
+            # Best of the sources that answered in time; a missing one might have had a better
+            # match, so it is flagged and not cached
+            outcome = 'found'
+            result = {**result, "degraded": True}
+        elif complete:
+            outcome = 'not_found'
+            self.miss_cache.set(cache_key, True)
+        else:
+            outcome = 'degraded'
+        FALLBACK_SECONDS.observe(time.perf_counter() - start, outcome=outcome)
+        return result
+
+    def unavailable_sources(self):
+        # Sources currently skipped because their circuit is open
+        return [name for name, breaker in self.breakers.items() if breaker.state == 'open']
+
+    async def _search_external(self, query):
+        # (best match or None, whether every source answered)
+        # 1. Fetch from Reddit and Imgflip concurrently, skipping sources whose circuit is open
+        fetchers = {f"reddit/{sub}": functools.partial(self.fetch_reddit, sub, query) for sub in self.subreddits}
+        fetchers["imgflip"] = functools.partial(self.fetch_imgflip, query)
+        sources = {}
+        for name, fetch in fetchers.items():
+            if self.breakers[name].allow():
+                sources[name] = fetch()
+            else:
+                FALLBACK_SOURCES_SKIPPED.inc(source=name)
+        if not sources:
+            print(f"All external sources are unavailable, skipping the fallback for: {query}")
+            return None, False
 
-    def search_external(self, query):
         print(f"Searching external sources for: {query}")
-        candidates = []
-        
-        # 1. Fetch from Reddit
-        candidates.extend(self.fetch_reddit(query))
-        
-        # 2. Fetch from Imgflip
-        candidates.extend(self.fetch_imgflip(query))
-        
+        candidates, complete = await self._gather_sources(sources)
+        complete = complete and len(sources) == len(fetchers)
+
         if not candidates:
-            return None
-            
-        # 3. Semantic Filter
-        best_match = self.filter_and_sort(candidates, query)
-        return best_match
+            return None, complete
 
-    def fetch_reddit(self, query):
-        memes = []
-        subreddits = ['memes', 'dankmemes']
-        
+        # 2. Semantic Filter (CPU bound, keep it off the event loop)
+        best_match = await asyncio.to_thread(self.filter_and_sort, candidates, query)
+        return best_match, complete
+
+    async def _gather_sources(self, sources):
+        # (candidates, whether every source answered in time)
+        tasks = {
+            asyncio.create_task(self._timed_fetch(name, fetch)): name
+            for name, fetch in sources.items()
+        }
+        done, pending = await asyncio.wait(tasks, timeout=self.total_budget)
+
+        for task in pending:
+            task.cancel()
+            print(f"{tasks[task]} exceeded the {self.total_budget}s fallback budget, skipping")
+
+        candidates = []
+        complete = not pending
+        for task in done:
+            try:
+                candidates.extend(task.result())
+            except asyncio.TimeoutError:
+                complete = False
+                print(f"{tasks[task]} timed out after {self.source_timeout}s, skipping")
+            except Exception as e:
+                complete = False
+                print(f"Error fetching from {tasks[task]}: {e}")
+        return candidates, complete
+
+    async def _timed_fetch(self, name, fetch):
+        # One source under its own deadline, timed per source and outcome.
+        # Anything but an answer (error, timeout, over budget) counts against its circuit.
+        start = time.perf_counter()
+        outcome = 'error'
+        try:
+            result = await asyncio.wait_for(fetch, self.source_timeout)
+            outcome = 'ok'
+            return result
+        except asyncio.TimeoutError:
+            outcome = 'timeout'
+            raise
+        except asyncio.CancelledError:
+            outcome = 'over_budget'
+            raise
+        finally:
+            FALLBACK_SOURCE_SECONDS.observe(time.perf_counter() - start, source=name, outcome=outcome)
+            if outcome == 'ok':
+                self.breakers[name].record_success()
+            else:
+                self.breakers[name].record_failure()
+
+    async def fetch_reddit(self, sub, query):
         if self.reddit:
-            # PRAW implementation
-            for sub in subreddits:
-                try:
-                    subreddit = self.reddit.subreddit(sub)
-                    # Search for the query
-                    results = subreddit.search(query, limit=10, sort='relevance')
-                    for post in results:
-                        if not post.over_18 and post.url.endswith(('.jpg', '.png', '.gif')):
-                            memes.append({
-                                "image_url": post.url,
-                                "caption": post.title,
-                                "source": f"reddit/{sub}",
-                                "score": post.score
-                            })
-                except Exception as e:
-                    print(f"Error fetching from r/{sub}: {e}")
-        else:
-            # JSON fallback (public API)
-            headers = {'User-Agent': 'MemeVault/1.0'}
-            for sub in subreddits:
-                try:
-                    url = f"https://www.reddit.com/r/{sub}/search.json?q={query}&restrict_sr=1&limit=10&sort=relevance"
-                    resp = requests.get(url, headers=headers)
-                    if resp.status_code == 200:
-                        data = resp.json()
-                        for child in data['data']['children']:
-                            post = child['data']
-                            if not post.get('over_18') and post.get('url', '').endswith(('.jpg', '.png', '.gif')):
-                                memes.append({
-                                    "image_url": post['url'],
-                                    "caption": post['title'],
-                                    "source": f"reddit/{sub}",
-                                    "score": post.get('score', 0)
-                                })
-                except Exception as e:
-                    print(f"Error fetching from r/{sub} (JSON): {e}")
-                    
+            # PRAW is synchronous, run it in a worker thread
+            return await asyncio.to_thread(self._fetch_reddit_praw, sub, query)
+
+        # JSON fallback (public API)
+        memes = []
+        resp = await self._get_client().get(
+            f"{self.reddit_base_url}/r/{sub}/search.json",
+            params={'q': query, 'restrict_sr': 1, 'limit': 10, 'sort': 'relevance'}
+        )
+        # Rate limits and outages are failures for the circuit breaker, not empty answers
+        resp.raise_for_status()
+        if resp.status_code == 200:
+            data = resp.json()
+            for child in data['data']['children']:
+                post = child['data']
+                if not post.get('over_18') and post.get('url', '').endswith(('.jpg', '.png', '.gif')):
+                    memes.append({
+                        "image_url": post['url'],
+                        "caption": post['title'],
+                        "source": f"reddit/{sub}",
+                        "score": post.get('score', 0)
+                    })
         return memes
 
-    def fetch_imgflip(self, query):
+    def _fetch_reddit_praw(self, sub, query):
         memes = []
-        try:
-            resp = requests.get("https://api.imgflip.com/get_memes")
-            if resp.status_code == 200:
-                data = resp.json()
-                if data['success']:
-                    for meme in data['data']['memes']:
-                        # Imgflip returns templates, not finished memes usually, but we can match names
-                        # Or we can treat the name as the caption for semantic matching
-                        memes.append({
-                            "image_url": meme['url'],
-                            "caption": meme['name'],
-                            "source": "imgflip",
-                            "score": 0 # Imgflip API doesn't give score/popularity in this endpoint easily
-                        })
-        except Exception as e:
-            print(f"Error fetching from Imgflip: {e}")
+        subreddit = self.reddit.subreddit(sub)
+        # Search for the query
+        results = subreddit.search(query, limit=10, sort='relevance')
+        for post in results:
+            if not post.over_18 and post.url.endswith(('.jpg', '.png', '.gif')):
+                memes.append({
+                    "image_url": post.url,
+                    "caption": post.title,
+                    "source": f"reddit/{sub}",
+                    "score": post.score
+                })
         return memes
 
+    async def fetch_imgflip(self, query):
+        if self.imgflip_catalog and self.imgflip_catalog.ready:
+            query_embedding = await asyncio.to_thread(self.encoder.encode_query, query)
+            return self.imgflip_catalog.match(query_embedding)
+
+        # No catalogue yet (first boot): download and let filter_and_sort encode the names
+        memes = []
+        resp = await self._get_client().get(self.imgflip_url)
+        resp.raise_for_status()
+        if resp.status_code == 200:
+            data = resp.json()
+            if data['success']:
+                for meme in data['data']['memes']:
+                    # Imgflip returns templates, not finished memes usually, but we can match names
+                    # Or we can treat the name as the caption for semantic matching
+                    memes.append({
+                        "image_url": meme['url'],
+                        "caption": meme['name'],
+                        "source": "imgflip",
+                        "score": 0 # Imgflip API doesn't give score/popularity in this endpoint easily
+                    })
+        return memes
+
+    def _embed_captions(self, captions):
+        # Content-keyed: the same caption text always maps to the same vector
+        keys = [hashlib.sha1(caption.encode('utf-8')).hexdigest() for caption in captions]
+        embeddings = [self.caption_cache.get(key) for key in keys]
+        
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
+            encoded = self.encoder.encode([captions[i] for i in missing])
+            for i, embedding in zip(missing, encoded):
+                self.caption_cache.set(keys[i], embedding)
+                embeddings[i] = embedding
+        
+        return np.vstack(embeddings)
+
     def filter_and_sort(self, candidates, query):
         if not candidates:
             return None
             
         # Encode query
-        model = self._get_model()
-        query_embedding = model.encode(query)
+        query_embedding = self.encoder.encode_query(query)
         
-        # Encode candidates
-        captions = [c['caption'] for c in candidates]
-        candidate_embeddings = model.encode(captions)
+        # Encode candidates (catalogue matches arrive already scored)
+        similarities = np.empty(len(candidates), dtype=np.float32)
+        unscored = []
+        for i, c in enumerate(candidates):
+            if 'similarity_score' in c:
+                similarities[i] = c['similarity_score']
+            else:
+                unscored.append(i)
         
-        # Calculate similarities
-        similarities = np.dot(candidate_embeddings, query_embedding)
+        if unscored:
+            candidate_embeddings = self._embed_captions([candidates[i]['caption'] for i in unscored])
+            
+            # Calculate similarities
+            similarities[unscored] = np.dot(candidate_embeddings, query_embedding)
         
         # Find best match
         best_idx = np.argmax(similarities)
@@ -0,0 +1,40 @@
+# Multi-worker deployment that shares the index and model weights between workers:
+#
+#   gunicorn -c gunicorn.conf.py main:app
+#
+# With preload_app the master imports main.py once. It loads the search snapshot
+# (memory-mapped embeddings, metadata, BM25 index) and the encoder weights, then
+# forks the workers. They share those pages copy-on-write instead of each building
+# its own copy. See "Multiple workers" in the README for the measured effect.
+import gc
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+workers = int(os.getenv('WEB_CONCURRENCY', '2'))
+worker_class = 'uvicorn.workers.UvicornWorker'
+preload_app = os.getenv('MEMEDOCK_PRELOAD', '1') == '1'
+# The model may be loading in the first seconds of a worker's life
+timeout = 120
+graceful_timeout = 30
+
+if workers > 1:
+    # A reload (/admin/reload, an approved submission) runs in the one worker that got
+    # the request. The others pick it up by watching the metadata files, so polling
+    # must be on; MEMEDOCK_RELOAD_INTERVAL=0 in the environment still wins.
+    os.environ.setdefault('MEMEDOCK_RELOAD_INTERVAL', '5')
+
+if preload_app:
+    # main.py loads the weights at import time (no encode, see Encoder.preload)
+    os.environ.setdefault('MEMEDOCK_PRELOAD_MODEL', '1')
+    # Rust tokenizers refuse to run in parallel after a fork; don't start their pool at all
+    os.environ.setdefault('TOKENIZERS_PARALLELISM', 'false')
+
+
+def when_ready(server):
+    # Everything loaded so far is long-lived. Freezing it keeps the garbage
+    # collector from writing to those objects in the workers, which would
+    # copy the shared pages one by one.
+    if preload_app:
+        gc.collect()
+        gc.freeze()
+        server.log.info(f"Preloaded app, {gc.get_freeze_count()} objects frozen before forking")
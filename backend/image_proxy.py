@@ -0,0 +1,209 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+import httpx
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
+from metrics import PROXY_BYTES, PROXY_UPSTREAM_SECONDS
+
+CACHE_CONTROL = "public, max-age=86400"
+CHUNK_SIZE = 64 * 1024
+
+
+class DiskLRUCache:
+    """
+    Size-bounded LRU cache of image bodies on local disk, keyed by URL.
+
+    Each entry is a body file plus a small JSON sidecar with its content type.
+    The LRU order is rebuilt from file mtimes on startup and touched on hits.
+    """
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # key -> size, oldest first
+        self._lock = threading.Lock()
+
+        os.makedirs(cache_dir, exist_ok=True)
+        existing = []
+        for name in os.listdir(cache_dir):
+            path = os.path.join(cache_dir, name)
+            if name.endswith('.tmp'):
+                os.remove(path)  # left over from an interrupted download
+            elif not name.endswith('.json') and os.path.exists(path + '.json'):
+                stat = os.stat(path)
+                existing.append((stat.st_mtime, name, stat.st_size))
+        for _, key, size in sorted(existing):
+            self._entries[key] = size
+            self.total_bytes += size
+
+    def key(self, url):
+        return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def get(self, url):
+        # (body path, content type) or None
+        key = self.key(url)
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        path = self._path(key)
+        try:
+            with open(path + '.json', 'r') as f:
+                meta = json.load(f)
+            os.utime(path)
+        except OSError:
+            self._forget(key)
+            return None
+        return path, meta['content_type']
+
+    def temp_path(self):
+        return os.path.join(self.cache_dir, f"{uuid.uuid4().hex}.tmp")
+
+    def put(self, url, temp_path, content_type, size):
+        key = self.key(url)
+        path = self._path(key)
+        with open(path + '.json', 'w') as f:
+            json.dump({"url": url, "content_type": content_type}, f)
+        os.replace(temp_path, path)
+        with self._lock:
+            self.total_bytes += size - self._entries.pop(key, 0)
+            self._entries[key] = size
+            while self.total_bytes > self.max_bytes and len(self._entries) > 1:
+                old_key, old_size = self._entries.popitem(last=False)
+                self.total_bytes -= old_size
+                self.evictions += 1
+                self._remove_files(old_key)
+
+    def _forget(self, key):
+        with self._lock:
+            self.total_bytes -= self._entries.pop(key, 0)
+        self._remove_files(key)
+
+    def _remove_files(self, key):
+        for path in (self._path(key), self._path(key) + '.json'):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+
+class ImageProxy:
+    """
+    Streaming image proxy for external fallback results.
+
+    Bodies are streamed from a pooled async client straight to the caller in
+    fixed-size chunks (never held in memory whole), capped at `max_bytes`,
+    and written to the disk cache on the way through so repeat requests are
+    served from local disk. All disk cache work (lookups, chunk writes,
+    eviction) runs in worker threads, off the event loop.
+    """
+
+    def __init__(self, cache, max_bytes=10 * 1024 * 1024, timeout=10.0):
+        self.cache = cache
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self._client = None
+
+    def _get_client(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                headers={'User-Agent': 'MemeVault/1.0'},
+                timeout=httpx.Timeout(self.timeout),
+                limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+                follow_redirects=True
+            )
+        return self._client
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def fetch(self, url):
+        cached = await asyncio.to_thread(self.cache.get, url)
+        if cached:
+            path, content_type = cached
+            PROXY_BYTES.inc(await asyncio.to_thread(os.path.getsize, path), cache='hit')
+            return FileResponse(path, media_type=content_type, headers={"Cache-Control": CACHE_CONTROL})
+
+        client = self._get_client()
+        response = await client.send(client.build_request("GET", url), stream=True)
+        try:
+            response.raise_for_status()
+            content_type = response.headers.get("content-type", "image/jpeg")
+            if not content_type.startswith(("image/", "application/octet-stream")):
+                raise ValueError(f"Upstream returned {content_type}, not an image")
+            length = response.headers.get("content-length")
+            if length is not None and int(length) > self.max_bytes:
+                await response.aclose()
+                return JSONResponse(content={"error": "Image too large"}, status_code=413)
+        except Exception:
+            await response.aclose()
+            raise
+
+        return StreamingResponse(
+            self._stream(url, response, content_type),
+            media_type=content_type,
+            headers={"Cache-Control": CACHE_CONTROL}
+        )
+
+    async def _stream(self, url, response, content_type):
+        temp_path = self.cache.temp_path()
+        size = 0
+        complete = False
+        outcome = 'error'
+        start = time.perf_counter()
+        f = None
+        try:
+            f = await asyncio.to_thread(open, temp_path, 'wb')
+            async for chunk in response.aiter_bytes(CHUNK_SIZE):
+                size += len(chunk)
+                if size > self.max_bytes:
+                    # Headers are already sent; stop here and don't cache the partial body
+                    print(f"Proxy body for {url} exceeded {self.max_bytes} bytes, truncating")
+                    outcome = 'truncated'
+                    return
+                await asyncio.to_thread(f.write, chunk)
+                PROXY_BYTES.inc(len(chunk), cache='miss')
+                yield chunk
+            complete = True
+            outcome = 'complete'
+        finally:
+            PROXY_UPSTREAM_SECONDS.observe(time.perf_counter() - start, outcome=outcome)
+            await response.aclose()
+            await asyncio.to_thread(self._finish, f, url, temp_path, content_type, size, complete)
+
+    def _finish(self, f, url, temp_path, content_type, size, complete):
+        # Close the temp file and either cache it (evicting as needed) or drop it
+        if f is not None:
+            f.close()
+        if complete:
+            self.cache.put(url, temp_path, content_type, size)
+        elif os.path.exists(temp_path):
+            os.remove(temp_path)
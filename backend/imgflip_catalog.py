@@ -0,0 +1,151 @@
+import asyncio
+import fcntl
+import json
+import os
+import time
+import numpy as np
+from vector_index import top_k
+
+CATALOG_FILENAME = 'imgflip_catalog.json'
+EMBEDDINGS_FILENAME = 'imgflip_catalog.npy'
+LOCK_FILENAME = '.imgflip_catalog.lock'
+
+
+class ImgflipCatalog:
+    """
+    Local copy of the Imgflip template catalogue with precomputed name embeddings.
+
+    The catalogue barely changes, so it is refreshed in the background every
+    `refresh_interval` seconds and persisted next to the metadata. Matching a
+    query is then one small matrix-vector product instead of a download plus
+    ~100 encodes per fallback.
+
+    Workers sharing `data_dir` refresh under a file lock: the first one past a
+    stale catalogue downloads it, the others then load its copy from disk.
+    """
+
+    def __init__(self, data_dir, encoder, url, get_client, refresh_interval=24 * 3600):
+        self.catalog_path = os.path.join(data_dir, CATALOG_FILENAME)
+        self.embeddings_path = os.path.join(data_dir, EMBEDDINGS_FILENAME)
+        self.lock_path = os.path.join(data_dir, LOCK_FILENAME)
+        self.encoder = encoder
+        self.url = url
+        self.get_client = get_client
+        self.refresh_interval = refresh_interval
+        self.fetched_at = 0
+        self._snapshot = None  # (templates, embeddings), swapped as a whole
+        self._task = None
+
+    @property
+    def ready(self):
+        return self._snapshot is not None
+
+    @property
+    def stale(self):
+        return time.time() - self.fetched_at > self.refresh_interval
+
+    def load(self):
+        if not (os.path.exists(self.catalog_path) and os.path.exists(self.embeddings_path)):
+            return False
+        try:
+            with open(self.catalog_path, 'r') as f:
+                catalog = json.load(f)
+            embeddings = np.load(self.embeddings_path)
+            if embeddings.shape[0] != len(catalog['templates']):
+                raise ValueError("template count does not match embeddings")
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Ignoring unreadable Imgflip catalogue: {e}")
+            return False
+        self._snapshot = (catalog['templates'], embeddings)
+        self.fetched_at = catalog.get('fetched_at', 0)
+        print(f"Loaded {len(catalog['templates'])} Imgflip templates from disk.")
+        return True
+
+    async def refresh(self):
+        resp = await self.get_client().get(self.url)
+        resp.raise_for_status()
+        data = resp.json()
+        if not data.get('success'):
+            raise ValueError("Imgflip API returned success=false")
+
+        templates = [
+            {"id": meme.get('id'), "name": meme['name'], "url": meme['url']}
+            for meme in data['data']['memes']
+        ]
+        embeddings = await asyncio.to_thread(
+            self.encoder.encode, [t['name'] for t in templates]
+        )
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+
+        self.fetched_at = time.time()
+        self._snapshot = (templates, embeddings)
+        try:
+            self._save(templates, embeddings)
+        except OSError as e:
+            print(f"Could not persist Imgflip catalogue: {e}")
+        print(f"Refreshed Imgflip catalogue: {len(templates)} templates.")
+
+    async def refresh_shared(self):
+        # refresh(), unless another process sharing the directory has just done it
+        os.makedirs(os.path.dirname(self.lock_path), exist_ok=True)
+        with open(self.lock_path, 'w') as lock_file:
+            await asyncio.to_thread(fcntl.flock, lock_file, fcntl.LOCK_EX)
+            try:
+                if self.load() and not self.stale:
+                    return
+                await self.refresh()
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _save(self, templates, embeddings):
+        os.makedirs(os.path.dirname(self.catalog_path), exist_ok=True)
+        # Per-process temp names, so two writers never rename each other's partial files
+        tmp_embeddings = f"{self.embeddings_path}.{os.getpid()}.tmp"
+        tmp_catalog = f"{self.catalog_path}.{os.getpid()}.tmp"
+        with open(tmp_embeddings, 'wb') as f:
+            np.save(f, embeddings)
+        with open(tmp_catalog, 'w') as f:
+            json.dump({"fetched_at": self.fetched_at, "templates": templates}, f)
+        os.replace(tmp_embeddings, self.embeddings_path)
+        os.replace(tmp_catalog, self.catalog_path)
+
+    def match(self, query_embedding, k=10):
+        # Best k templates for the query, already scored
+        templates, embeddings = self._snapshot
+        similarities = np.dot(embeddings, query_embedding)
+        return [
+            {
+                "image_url": templates[i]['url'],
+                "caption": templates[i]['name'],
+                "source": "imgflip",
+                "score": 0, # Imgflip API doesn't give score/popularity in this endpoint easily
+                "similarity_score": float(similarities[i])
+            }
+            for i in top_k(similarities, k)
+        ]
+
+    def start(self):
+        if self._task is None:
+            self.load()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            if self.stale:
+                try:
+                    await self.refresh_shared()
+                except Exception as e:
+                    print(f"Imgflip catalogue refresh failed: {e}")
+                    # Retry sooner than the full interval after a failure
+                    await asyncio.sleep(min(self.refresh_interval, 300))
+                    continue
+            await asyncio.sleep(max(1, self.fetched_at + self.refresh_interval - time.time()))
@@ -0,0 +1,555 @@
+import asyncio
+import datetime
+import fcntl
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+import numpy as np
+from PIL import Image, ImageOps, UnidentifiedImageError
+from dedup import dhash, hamming
+from embedding_store import EmbeddingStore, meme_text, text_hash
+from vector_index import IVF_INDEX_FILENAME, IVFIndex
+
+SUBMISSION_STATUSES = ('queued', 'processing', 'pending', 'duplicate', 'failed', 'approved', 'rejected')
+
+# Submissions waiting for a reviewer
+REVIEW_STATUSES = ('pending', 'duplicate')
+
+# Shown to the submitter when something other than validation fails (details go to the log)
+PROCESSING_ERROR = "The submission could not be processed"
+
+# Pillow format -> extension of the normalized file
+IMAGE_FORMATS = {'JPEG': '.jpg', 'PNG': '.png', 'GIF': '.gif', 'WEBP': '.webp'}
+
+
+class SubmissionTooLarge(ValueError):
+    pass
+
+
+class SubmissionStore:
+    """
+    Community submissions in an embedded SQLite database (WAL mode).
+
+    Replaces the read-modify-write of pending_submissions.json: every status
+    change is a single-row UPDATE, so concurrent uploads, the ingestion worker
+    and several uvicorn workers never overwrite each other's records.
+    The embedding computed at ingestion time is stored with the record.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = self._connect()
+        self._closed = False
+        # Forked workers (gunicorn --preload) open their own connection
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS submissions ("
+            " id TEXT PRIMARY KEY,"
+            " status TEXT NOT NULL,"
+            " record TEXT NOT NULL,"
+            " embedding BLOB,"
+            " error TEXT,"
+            " created_at REAL NOT NULL,"
+            " updated_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS submissions_status ON submissions (status)")
+        return conn
+
+    def _after_fork(self):
+        if not self._closed:
+            self._lock = threading.Lock()
+            self._conn = self._connect()
+
+    def import_json(self, path):
+        # Submissions left in the old pending_submissions.json; existing rows win
+        if not os.path.exists(path):
+            return 0
+        with open(path, 'r') as f:
+            submissions = json.load(f).get('submissions', [])
+        now = time.time()
+        rows = [
+            (s['id'], s.get('status', 'pending'), json.dumps(s), now, now)
+            for s in submissions if s.get('id')
+        ]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO submissions (id, status, record, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+                rows
+            )
+        return len(rows)
+
+    def create(self, submission_id, record, status='queued'):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO submissions (id, status, record, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (submission_id, status, json.dumps(record), now, now)
+            )
+
+    def update(self, submission_id, status=None, record=None, embedding=None, error=None, expected=None):
+        """
+        Change one submission in a single statement. With `expected`, the row is
+        only changed while its status is one of those values; returns whether
+        a row was changed, so two approvals of the same submission can't both win.
+        """
+        if status is not None and status not in SUBMISSION_STATUSES:
+            raise ValueError(f"Unknown submission status '{status}'")
+        sets, params = ["updated_at = ?"], [time.time()]
+        if status is not None:
+            sets.append("status = ?")
+            params.append(status)
+        if record is not None:
+            sets.append("record = ?")
+            params.append(json.dumps(record))
+        if embedding is not None:
+            sets.append("embedding = ?")
+            params.append(np.asarray(embedding, dtype=np.float32).tobytes())
+        if error is not None:
+            sets.append("error = ?")
+            params.append(error)
+        where = "id = ?"
+        params.append(submission_id)
+        if expected:
+            where += f" AND status IN ({', '.join('?' * len(expected))})"
+            params.extend(expected)
+        with self._lock:
+            cursor = self._conn.execute(f"UPDATE submissions SET {', '.join(sets)} WHERE {where}", params)
+        return cursor.rowcount > 0
+
+    def _row_to_dict(self, row):
+        submission_id, status, record, embedding, error, created_at, updated_at = row
+        return {
+            **json.loads(record),
+            "id": submission_id,
+            "status": status,
+            "error": error,
+            "has_embedding": embedding is not None,
+            "created_at": created_at,
+            "updated_at": updated_at
+        }
+
+    def get(self, submission_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, status, record, embedding, error, created_at, updated_at FROM submissions WHERE id = ?",
+                (submission_id,)
+            ).fetchone()
+        return self._row_to_dict(row) if row else None
+
+    def record(self, submission_id):
+        # The submission fields alone, without the bookkeeping columns
+        with self._lock:
+            row = self._conn.execute("SELECT record FROM submissions WHERE id = ?", (submission_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def embedding(self, submission_id):
+        with self._lock:
+            row = self._conn.execute("SELECT embedding FROM submissions WHERE id = ?", (submission_id,)).fetchone()
+        if not row or row[0] is None:
+            return None
+        return np.frombuffer(row[0], dtype=np.float32)
+
+    def list(self, status=None, limit=100):
+        query = "SELECT id, status, record, embedding, error, created_at, updated_at FROM submissions"
+        params = []
+        if status:
+            query += " WHERE status = ?"
+            params.append(status)
+        query += " ORDER BY created_at LIMIT ?"
+        params.append(limit)
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return [self._row_to_dict(row) for row in rows]
+
+    def review_vectors(self):
+        # (ids, dhashes, embeddings) of submissions awaiting review that have both
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT id, record, embedding FROM submissions WHERE status IN ({', '.join('?' * len(REVIEW_STATUSES))})"
+                " AND embedding IS NOT NULL",
+                list(REVIEW_STATUSES)
+            ).fetchall()
+        rows = [(i, json.loads(record).get('dhash'), embedding) for i, record, embedding in rows]
+        rows = [row for row in rows if row[1]]
+        if not rows:
+            return [], np.empty(0, dtype=np.uint64), None
+        return (
+            [i for i, _, _ in rows],
+            np.array([int(h, 16) for _, h, _ in rows], dtype=np.uint64),
+            np.stack([np.frombuffer(e, dtype=np.float32) for _, _, e in rows])
+        )
+
+    def requeue_stale(self, older_than):
+        # Jobs left `processing` for more than `older_than` seconds (their worker died)
+        # go back to `queued`. One UPDATE, so each row is recovered by one process only.
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE submissions SET status = 'queued', updated_at = ? WHERE status = 'processing' AND updated_at < ?",
+                (time.time(), time.time() - older_than)
+            )
+        return cursor.rowcount
+
+    def ids_with_status(self, statuses):
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT id FROM submissions WHERE status IN ({', '.join('?' * len(statuses))}) ORDER BY created_at",
+                list(statuses)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            self._conn.close()
+
+
+class IngestionPipeline:
+    """
+    Background ingestion of community submissions.
+
+    The upload endpoint only spools the file to disk, records a `queued` job
+    and returns its id. A worker task then validates and normalizes the image
+    (format check, decompression-bomb guard, EXIF rotation, size cap) and
+    embeds the submission text, encoding every job waiting in the queue in
+    one batch. Processed submissions wait as `pending` for review, or as
+    `duplicate` when the optional DuplicateChecker (perceptual hash + text
+    similarity) matches them to a vault meme or another submission.
+
+    Approving a submission publishes it incrementally: the image is moved into
+    the vault, the meme is appended to the metadata and its stored vector to
+    the embedding store (and IVF index), then the search snapshot is reloaded.
+    Nothing is re-embedded.
+    """
+
+    def __init__(self, store, encoder, search_engine, pending_dir, images_dir, duplicate_checker=None,
+                 max_batch_size=16, max_bytes=10 * 1024 * 1024, max_side=2048, max_pixels=40_000_000,
+                 processing_lease=600):
+        self.store = store
+        self.encoder = encoder
+        self.search_engine = search_engine
+        self.pending_dir = pending_dir
+        self.images_dir = images_dir
+        self.duplicate_checker = duplicate_checker
+        self.max_batch_size = max_batch_size
+        self.max_bytes = max_bytes
+        self.max_side = max_side
+        self.max_pixels = max_pixels
+        self.processing_lease = processing_lease
+        self.processed = 0
+        self.failed = 0
+        self.batches = 0
+        self.duplicates = 0
+        self._queue = None
+        self._task = None
+        self._publish_lock = threading.Lock()
+        os.makedirs(pending_dir, exist_ok=True)
+
+    def _upload_path(self, submission_id):
+        return os.path.join(self.pending_dir, f"{submission_id}.upload")
+
+    def _spool(self, source, path):
+        # Copy the upload to disk, refusing anything over max_bytes
+        size = 0
+        with open(path, 'wb') as out:
+            for chunk in iter(lambda: source.read(1024 * 1024), b''):
+                size += len(chunk)
+                if size > self.max_bytes:
+                    break
+                out.write(chunk)
+        if size > self.max_bytes:
+            os.remove(path)
+            raise SubmissionTooLarge(f"Upload exceeds {self.max_bytes // (1024 * 1024)} MB")
+
+    async def submit(self, upload, name, description, utility):
+        submission_id = str(uuid.uuid4())
+        await asyncio.to_thread(self._spool, upload.file, self._upload_path(submission_id))
+
+        record = {
+            "original_filename": upload.filename,
+            "category": "community_submission",
+            "tags": [name],
+            "prompt": description,
+            "captions": [utility],
+            "submitted_on": datetime.date.today().isoformat()
+        }
+        self.store.create(submission_id, record)
+        self._queue.put_nowait(submission_id)
+        return self.store.get(submission_id)
+
+    def start(self):
+        if self._task is None:
+            self._queue = asyncio.Queue()
+            self._recover()
+            self._task = asyncio.create_task(self._run())
+
+    def _recover(self):
+        # Queued jobs are picked up again (after a restart, or when another worker died
+        # before claiming them) and stale `processing` ones once their lease ran out.
+        # Several workers may queue the same id: only the one whose claim succeeds runs it.
+        recovered = self.store.requeue_stale(self.processing_lease)
+        if recovered:
+            print(f"Re-queued {recovered} submissions whose processing lease expired.")
+        for submission_id in self.store.ids_with_status(('queued',)):
+            self._queue.put_nowait(submission_id)
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                batch = [await asyncio.wait_for(self._queue.get(), timeout=self.processing_lease)]
+            except asyncio.TimeoutError:
+                self._recover()
+                continue
+            while len(batch) < self.max_batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            try:
+                await asyncio.to_thread(self._process_batch, batch)
+            except Exception as e:
+                print(f"Ingestion batch failed: {e}")
+
+    def _process_batch(self, submission_ids):
+        ready = []
+        for submission_id in submission_ids:
+            # Claim the job; another worker (or an earlier copy in this queue) may have it already
+            if not self.store.update(submission_id, status='processing', expected=('queued',)):
+                continue
+            try:
+                image_name = self._normalize_image(submission_id)
+            except Exception as e:
+                print(f"Submission {submission_id} failed validation: {e}")
+                self._fail(submission_id, self._public_error(e))
+                if os.path.exists(self._upload_path(submission_id)):
+                    os.remove(self._upload_path(submission_id))
+                continue
+            try:
+                record = {
+                    **self.store.record(submission_id),
+                    "image_name": image_name,
+                    "dhash": f"{dhash(os.path.join(self.pending_dir, image_name)):016x}"
+                }
+            except Exception as e:
+                print(f"Submission {submission_id} could not be processed: {e}")
+                self._fail(submission_id, PROCESSING_ERROR)
+                continue
+            ready.append((submission_id, record))
+
+        if not ready:
+            return
+        # One encode call for the whole batch
+        try:
+            embeddings = self.encoder.encode([meme_text(record) for _, record in ready])
+        except Exception as e:
+            print(f"Could not embed {len(ready)} submissions: {e}")
+            for submission_id, record in ready:
+                # Still reviewable; the embedding is computed on approval instead
+                self.store.update(submission_id, status='pending', record=record, error=f"embedding failed: {e}")
+            return
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        try:
+            duplicates = self._find_duplicates(ready, embeddings) if self.duplicate_checker else [[]] * len(ready)
+        except Exception as e:
+            duplicates = [e] * len(ready)
+        for (submission_id, record), embedding, matches in zip(ready, embeddings, duplicates):
+            # One submission failing here must not leave the rest of the batch `processing`
+            try:
+                if isinstance(matches, Exception):
+                    raise matches
+                if matches:
+                    record['duplicate_of'] = matches
+                    self.duplicates += 1
+                self.store.update(submission_id, status='duplicate' if matches else 'pending', record=record, embedding=embedding)
+                self.processed += 1
+            except Exception as e:
+                print(f"Submission {submission_id} could not be processed: {e}")
+                self._fail(submission_id, PROCESSING_ERROR)
+        self.batches += 1
+
+    def _fail(self, submission_id, error):
+        try:
+            self.store.update(submission_id, status='failed', error=error)
+        except Exception as e:
+            # Left `processing`; the lease puts it back in the queue later
+            print(f"Could not mark submission {submission_id} as failed: {e}")
+        self.failed += 1
+
+    def _find_duplicates(self, ready, embeddings):
+        # Per submission: matching vault memes, then matching submissions still awaiting
+        # review (including earlier ones from this batch), or the exception that check raised
+        checker = self.duplicate_checker
+        ids, hashes, vectors = self.store.review_vectors()
+        results = []
+        for n, ((submission_id, record), embedding) in enumerate(zip(ready, embeddings)):
+            try:
+                image_hash = np.uint64(int(record['dhash'], 16))
+                matches = checker.check(image_hash=image_hash, embedding=embedding)
+
+                other_ids = ids + [other_id for other_id, _ in ready[:n]]
+                other_hashes = np.concatenate([hashes, [np.uint64(int(r['dhash'], 16)) for _, r in ready[:n]]]).astype(np.uint64)
+                other_vectors = embeddings[:n] if vectors is None else np.vstack([vectors, embeddings[:n]])
+                if other_ids:
+                    distances = hamming(other_hashes, image_hash)
+                    similarities = other_vectors @ embedding
+                    for i in np.flatnonzero((distances <= checker.max_distance) | (similarities >= checker.threshold)):
+                        if other_ids[i] != submission_id:
+                            matches.append({
+                                "submission_id": other_ids[i],
+                                "hash_distance": int(distances[i]),
+                                "similarity": round(float(similarities[i]), 4)
+                            })
+            except Exception as e:
+                matches = e
+            results.append(matches)
+        return results
+
+    def _public_error(self, error):
+        # The reason shown to the submitter: our own validation messages, never server paths
+        if isinstance(error, UnidentifiedImageError):
+            return "Not a recognized image file"
+        if isinstance(error, OSError):
+            return "The upload could not be read"
+        return str(error)
+
+    def _normalize_image(self, submission_id):
+        # Validate the upload and write the normalized image; returns its file name
+        upload_path = self._upload_path(submission_id)
+        with Image.open(upload_path) as im:
+            if im.format not in IMAGE_FORMATS:
+                raise ValueError(f"Unsupported image format {im.format}")
+            if im.size[0] * im.size[1] > self.max_pixels:
+                raise ValueError(f"Image is too large ({im.size[0]}x{im.size[1]})")
+            im.verify()
+
+        with Image.open(upload_path) as im:
+            if getattr(im, 'is_animated', False):
+                # Keep animations untouched, only the extension is normalized
+                image_name = f"{submission_id}{IMAGE_FORMATS[im.format]}"
+                shutil.copyfile(upload_path, os.path.join(self.pending_dir, image_name))
+            else:
+                frame = ImageOps.exif_transpose(im)
+                frame.thumbnail((self.max_side, self.max_side), Image.LANCZOS)
+                has_alpha = frame.mode in ('RGBA', 'LA') or (frame.mode == 'P' and 'transparency' in frame.info)
+                if has_alpha:
+                    image_name = f"{submission_id}.png"
+                    frame.save(os.path.join(self.pending_dir, image_name), format='PNG', optimize=True)
+                else:
+                    image_name = f"{submission_id}.jpg"
+                    frame.convert('RGB').save(os.path.join(self.pending_dir, image_name), format='JPEG', quality=90)
+        os.remove(upload_path)
+        return image_name
+
+    def reject(self, submission_id, reason=None):
+        if not self.store.update(submission_id, status='rejected', error=reason, expected=REVIEW_STATUSES + ('failed',)):
+            raise ValueError("Only pending, duplicate or failed submissions can be rejected")
+        paths = [self._upload_path(submission_id)]
+        image_name = self.store.record(submission_id).get('image_name')
+        if image_name:
+            paths.append(os.path.join(self.pending_dir, image_name))
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+        return self.store.get(submission_id)
+
+    def approve(self, submission_id, force=False):
+        # Blocking: call from a thread. Returns the published meme and the new search snapshot.
+        # Flagged duplicates are only published with force=True.
+        submission = self.store.get(submission_id)
+        if submission is None:
+            raise KeyError(submission_id)
+        allowed = REVIEW_STATUSES if force else ('pending',)
+        if submission['status'] not in allowed:
+            if submission['status'] == 'duplicate':
+                raise ValueError("Submission is a near-duplicate of an existing meme, approve with force to publish anyway")
+            raise ValueError(f"Submission is {submission['status']}, only pending submissions can be approved")
+
+        meme = {
+            "image_name": submission['image_name'],
+            "category": submission.get('category', 'community_submission'),
+            "tags": submission.get('tags', []),
+            "prompt": submission.get('prompt', ""),
+            "captions": submission.get('captions', []),
+            "submitted_on": submission.get('submitted_on'),
+            "source": "community"
+        }
+        embedding = self.store.embedding(submission_id)
+        if embedding is None:
+            embedding = np.asarray(self.encoder.encode([meme_text(meme)])[0], dtype=np.float32)
+
+        metadata_dir = self.search_engine.metadata_dir
+        with self._publish_lock, open(os.path.join(metadata_dir, '.publish.lock'), 'w') as lock_file:
+            # The file lock serializes publishing across uvicorn workers
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            if not self.store.update(submission_id, status='approved', expected=allowed):
+                raise ValueError("Submission was already handled")
+            try:
+                self._publish(meme, embedding)
+            except Exception:
+                self.store.update(submission_id, status=submission['status'])
+                raise
+
+        snapshot = self.search_engine.reload()
+        return meme, snapshot
+
+    def _publish(self, meme, embedding):
+        metadata_dir = self.search_engine.metadata_dir
+        image_name = meme['image_name']
+        shutil.copyfile(os.path.join(self.pending_dir, image_name), os.path.join(self.images_dir, image_name))
+
+        # Vector first: a meme in the metadata without a vector is still served
+        # (keyword search), a vector without metadata is not
+        store = EmbeddingStore(metadata_dir)
+        sidecar = store.read_sidecar()
+        image_names, matrix = store.load(mmap=True)
+        if image_name not in image_names:
+            text_hashes = sidecar.get('text_hashes')
+            if text_hashes is not None:
+                text_hashes = text_hashes + [text_hash(meme_text(meme), self.encoder.model_name)]
+            matrix = np.vstack([matrix, np.asarray(embedding, dtype=matrix.dtype)[None, :]])
+            store.save(image_names + [image_name], matrix, dtype=sidecar.get('dtype', 'float32'), text_hashes=text_hashes)
+
+            ivf_path = os.path.join(metadata_dir, IVF_INDEX_FILENAME)
+            if os.path.exists(ivf_path):
+                try:
+                    IVFIndex.load(ivf_path, matrix[:-1]).extend(matrix).save(ivf_path)
+                except (OSError, ValueError) as e:
+                    print(f"IVF index not updated, rebuild it with generate_embeddings.py: {e}")
+
+        metadata_path = os.path.join(metadata_dir, 'meme_metadata.json')
+        with open(metadata_path, 'r') as f:
+            data = json.load(f)
+        if not any(m['image_name'] == image_name for m in data['memes']):
+            data['memes'].append(meme)
+            tmp_path = metadata_path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(data, f, indent=2)
+            os.replace(tmp_path, metadata_path)
+
+        os.remove(os.path.join(self.pending_dir, image_name))
+        print(f"Published community submission {image_name}.")
+
+    def stats(self):
+        return {
+            "queued": self._queue.qsize() if self._queue else 0,
+            "processed": self.processed,
+            "failed": self.failed,
+            "duplicates": self.duplicates,
+            "batches": self.batches
+        }
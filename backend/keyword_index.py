@@ -0,0 +1,107 @@
+import math
+import os
+import re
+from collections import defaultdict
+import numpy as np
+from vector_index import top_k
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+# Words that say nothing about a meme; matching on them alone admits almost anything
+STOP_WORDS = frozenset(
+    "a an and are as at be but by for from has have he her his i if in into is it its me my "
+    "no not of on or our she so that the their them they this to was we were what when which "
+    "who will with you your".split()
+)
+
+# Same relative weights the old keyword fallback gave each field.
+# The file name counts like a tag, so "pibble" finds pibble.jpg.
+FIELD_WEIGHTS = {
+    'category': 3.0,
+    'tags': 2.0,
+    'name': 2.0,
+    'captions': 1.0,
+}
+
+
+def tokenize(text):
+    return [token for token in TOKEN_RE.findall(text.lower()) if token not in STOP_WORDS]
+
+
+class KeywordIndex:
+    """
+    Inverted index over meme tags, category, file name and captions, scored with BM25.
+
+    Field occurrences are weighted (category > tags/name > captions) before the
+    BM25 saturation. Every posting's score contribution is precomputed at
+    build time, so a query only touches the postings of its own terms and
+    costs roughly the number of matching postings, not the vault size.
+    """
+
+    def __init__(self, memes, k1=1.2, b=0.75):
+        self.image_names = [m['image_name'] for m in memes]
+        self.postings = {}
+
+        doc_terms = []
+        doc_lengths = np.zeros(len(memes), dtype=np.float32)
+        for doc_id, meme in enumerate(memes):
+            weighted_tf = defaultdict(float)
+            fields = {
+                'category': [meme.get('category', '')],
+                'tags': meme.get('tags', []),
+                'name': [os.path.splitext(meme['image_name'])[0]],
+                'captions': meme.get('captions', []),
+            }
+            for field, texts in fields.items():
+                for text in texts:
+                    for token in tokenize(text):
+                        weighted_tf[token] += FIELD_WEIGHTS[field]
+            doc_terms.append(weighted_tf)
+            doc_lengths[doc_id] = sum(weighted_tf.values())
+
+        avg_length = float(doc_lengths.mean()) if len(memes) else 0.0
+        postings = defaultdict(lambda: ([], []))
+        for doc_id, weighted_tf in enumerate(doc_terms):
+            norm = k1 * (1 - b + b * doc_lengths[doc_id] / avg_length) if avg_length else k1
+            for token, tf in weighted_tf.items():
+                ids, impacts = postings[token]
+                ids.append(doc_id)
+                impacts.append(tf * (k1 + 1) / (tf + norm))
+
+        n_docs = len(memes)
+        for token, (ids, impacts) in postings.items():
+            idf = math.log(1 + (n_docs - len(ids) + 0.5) / (len(ids) + 0.5))
+            self.postings[token] = (
+                np.array(ids, dtype=np.int64),
+                np.array(impacts, dtype=np.float32) * idf
+            )
+
+    def __len__(self):
+        return len(self.image_names)
+
+    def score(self, query):
+        # (doc_ids, scores) for every document matching at least one query term
+        matched = [self.postings[token] for token in set(tokenize(query)) if token in self.postings]
+        if not matched:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        ids = np.concatenate([ids for ids, _ in matched])
+        impacts = np.concatenate([impacts for _, impacts in matched])
+        doc_ids, inverse = np.unique(ids, return_inverse=True)
+        return doc_ids, np.bincount(inverse, weights=impacts).astype(np.float32)
+
+    def search(self, query, k=10):
+        doc_ids, scores = self.score(query)
+        order = top_k(scores, k)
+        return doc_ids[order], scores[order]
+
+    def coverage(self, query, doc_ids):
+        # Fraction of the query's distinct terms each document contains. Terms the
+        # vault has never seen count too, so one common word in a long query is a low coverage.
+        terms = set(tokenize(query))
+        hits = np.zeros(len(doc_ids), dtype=np.float32)
+        if not terms:
+            return hits
+        for token in terms:
+            if token in self.postings:
+                hits += np.isin(doc_ids, self.postings[token][0])
+        return hits / len(terms)
@@ -1,14 +1,44 @@
 import os
 import json
-from fastapi import FastAPI, Query, File, UploadFile, Form
+import asyncio
+import time
+from typing import List, Optional
+from fastapi import FastAPI, Query, File, UploadFile, Form, Request, Response, Header
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
+from pydantic import BaseModel, Field
 from search_engine import SearchEngine
 from fallback import ExternalMemeFetcher
+from encoder import Encoder, EncodeBatcher
+from vote_store import VoteStore
+from catalog import MemeCatalog
+from image_proxy import DiskLRUCache, ImageProxy
+from dedup import DuplicateChecker
+from ingestion import IngestionPipeline, SubmissionStore, SubmissionTooLarge
+from metrics import REGISTRY, GET_MEME_RESULTS, HTTP_REQUEST_SECONDS, SlowRequestProfiler
 
 app = FastAPI()
 
+@app.middleware("http")
+async def observe_request(request: Request, call_next):
+    # Per-route latency (to response headers) and, when enabled, the slow-request profiler
+    session = profiler.begin() if profiler else None
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        seconds = time.perf_counter() - start
+        # Route templates, not raw paths, so the label set stays small
+        route = request.scope.get("route")
+        route_path = getattr(route, "path", None) or "unmatched"
+        HTTP_REQUEST_SECONDS.observe(seconds, method=request.method, route=route_path, status=status)
+        if session is not None:
+            await asyncio.to_thread(profiler.end, session, f"{request.method} {route_path}", seconds)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=[
@@ -24,50 +54,327 @@ app.add_middleware(
 # Initialize Search Engine
 # Use current directory as base (works both locally and on Railway)
 base_dir = os.path.dirname(os.path.abspath(__file__))
-search_engine = SearchEngine(base_dir)
-external_fetcher = ExternalMemeFetcher()
+# One encoder (and one copy of the model) shared by local and external search
+encoder = Encoder()
+# Under gunicorn --preload (gunicorn.conf.py) the model is loaded here, before the workers fork
+if os.getenv('MEMEDOCK_PRELOAD_MODEL', '0') == '1':
+    encoder.preload()
+search_engine = SearchEngine(base_dir, encoder=encoder)
+external_fetcher = ExternalMemeFetcher(encoder=encoder, data_dir=os.path.join(base_dir, 'metadata'))
+
+# Concurrent /get-meme and /search queries are encoded together in small batches
+encode_batcher = EncodeBatcher(
+    encoder,
+    max_batch_size=int(os.getenv('MEMEDOCK_BATCH_MAX_SIZE', '32')),
+    max_wait_ms=float(os.getenv('MEMEDOCK_BATCH_WAIT_MS', '5'))
+)
+
+# Votes go to an embedded SQLite store instead of rewriting meme_metadata.json per click.
+# Counts that used to live in the metadata are imported once.
+vote_store = VoteStore(
+    os.getenv('MEMEDOCK_VOTES_DB') or os.path.join(base_dir, 'metadata', 'votes.db'),
+    flush_interval=float(os.getenv('MEMEDOCK_VOTE_FLUSH_INTERVAL', '0.5'))
+)
+vote_store.seed(search_engine.metadata)
+# A reload from any path (/admin/reload, the file watcher, an approval) imports the new counts too
+search_engine.add_reload_listener(lambda snapshot: vote_store.seed(snapshot.metadata))
+
+# /get-all-memes is served from memory as pre-serialized, pre-gzipped pages
+meme_catalog = MemeCatalog(search_engine, vote_store)
+
+# Fallback images are streamed through a size-capped proxy with a disk LRU cache
+image_proxy = ImageProxy(
+    DiskLRUCache(
+        os.getenv('MEMEDOCK_PROXY_CACHE_DIR') or os.path.join(base_dir, '.proxy_cache'),
+        max_bytes=int(float(os.getenv('MEMEDOCK_PROXY_CACHE_MB', '256')) * 1024 * 1024)
+    ),
+    max_bytes=int(float(os.getenv('MEMEDOCK_PROXY_MAX_MB', '10')) * 1024 * 1024),
+    timeout=float(os.getenv('MEMEDOCK_PROXY_TIMEOUT', '10'))
+)
+
+# Community submissions are spooled to disk and processed by a background worker;
+# records live in SQLite instead of pending_submissions.json (imported once)
+pending_dir = os.path.join(base_dir, 'pending_memes')
+os.makedirs(pending_dir, exist_ok=True)
+submission_store = SubmissionStore(os.getenv('MEMEDOCK_SUBMISSIONS_DB') or os.path.join(pending_dir, 'submissions.db'))
+submission_store.import_json(os.path.join(pending_dir, 'pending_submissions.json'))
+ingestion = IngestionPipeline(
+    submission_store,
+    encoder,
+    search_engine,
+    pending_dir,
+    os.path.join(base_dir, 'images'),
+    # Near-duplicates of vault memes or other submissions are flagged instead of queued for approval
+    duplicate_checker=DuplicateChecker(
+        search_engine,
+        os.path.join(base_dir, 'images'),
+        max_distance=int(os.getenv('MEMEDOCK_DUPLICATE_HASH_DISTANCE', '6')),
+        threshold=float(os.getenv('MEMEDOCK_DUPLICATE_SIMILARITY', '0.97'))
+    ),
+    max_batch_size=int(os.getenv('MEMEDOCK_INGEST_BATCH_SIZE', '16')),
+    max_bytes=int(float(os.getenv('MEMEDOCK_SUBMISSION_MAX_MB', '10')) * 1024 * 1024),
+    # A job `processing` for longer than this is assumed orphaned (its worker died) and re-queued
+    processing_lease=float(os.getenv('MEMEDOCK_INGEST_LEASE', '600'))
+)
+
+# Admin endpoints (e.g. /admin/reload) are disabled unless a token is configured
+admin_token = os.getenv('MEMEDOCK_ADMIN_TOKEN')
+# Seconds between checks of the metadata/embedding files for changes (0 = only reload via /admin/reload).
+# With several workers this is how a reload reaches all of them; gunicorn.conf.py turns it on.
+reload_interval = float(os.getenv('MEMEDOCK_RELOAD_INTERVAL', '0'))
+
+# Optional on-disk copy of the query embedding cache so a restart begins warm
+# (one file per encoder backend, their vectors differ slightly)
+cache_dir = os.getenv('MEMEDOCK_CACHE_DIR')
+query_cache_path = os.path.join(cache_dir, f'query_embeddings_{encoder.backend}.pkl') if cache_dir else None
+
+# Opt-in: requests slower than MEMEDOCK_PROFILE_SLOW_MS get a sampled stack profile written to disk
+profile_slow_ms = float(os.getenv('MEMEDOCK_PROFILE_SLOW_MS', '0'))
+profiler = SlowRequestProfiler(
+    os.getenv('MEMEDOCK_PROFILE_DIR') or os.path.join(base_dir, '.profiles'),
+    threshold_ms=profile_slow_ms,
+    interval_ms=float(os.getenv('MEMEDOCK_PROFILE_INTERVAL_MS', '5')),
+    sample_rate=float(os.getenv('MEMEDOCK_PROFILE_SAMPLE_RATE', '1'))
+) if profile_slow_ms > 0 else None
+
+def collect_stats():
+    # Counts the caches and workers already keep, read at scrape time
+    caches = [encoder.query_cache, search_engine.result_cache, external_fetcher.result_cache,
+              external_fetcher.miss_cache, external_fetcher.caption_cache]
+    cache_stats = [(cache.name, cache.stats()) for cache in caches] + [("proxy_images", image_proxy.cache.stats())]
+    yield ("memedock_cache_hits_total", "counter", "Cache hits",
+           [({"cache": name}, stats["hits"]) for name, stats in cache_stats])
+    yield ("memedock_cache_misses_total", "counter", "Cache misses",
+           [({"cache": name}, stats["misses"]) for name, stats in cache_stats])
+    yield ("memedock_cache_entries", "gauge", "Entries held per cache",
+           [({"cache": name}, stats.get("size", stats.get("entries", 0))) for name, stats in cache_stats])
+    yield ("memedock_encoder_ready", "gauge", "1 once the embedding model is loaded",
+           [({"backend": encoder.backend}, int(encoder.ready))])
+    batcher = encode_batcher.stats()
+    yield ("memedock_encode_batches_total", "counter", "Batched query encodes run by the EncodeBatcher",
+           [({}, batcher["batches"])])
+    yield ("memedock_circuit_open", "gauge", "1 while an external source is skipped by its circuit breaker",
+           [({"source": name}, int(breaker.state == "open")) for name, breaker in external_fetcher.breakers.items()])
+    snapshot = search_engine.snapshot
+    yield ("memedock_snapshot_version", "gauge", "Version of the search snapshot being served", [({}, snapshot.version)])
+    yield ("memedock_snapshot_memes", "gauge", "Memes in the search snapshot", [({}, len(snapshot.metadata))])
+
+REGISTRY.register_collector(collect_stats)
+
+@app.on_event("startup")
+async def startup():
+    if query_cache_path:
+        try:
+            loaded = encoder.query_cache.load(query_cache_path)
+            print(f"Loaded {loaded} cached query embeddings.")
+        except Exception as e:
+            print(f"Could not load query cache: {e}")
+
+    # With eager warmup the server only starts accepting requests once the model
+    # is loaded; otherwise it loads in the background and /ready reports progress.
+    if os.getenv('MEMEDOCK_EAGER_WARMUP', '0') == '1':
+        encoder.warmup()
+    else:
+        encoder.start_background_load()
+
+    encode_batcher.start()
+    external_fetcher.imgflip_catalog.start()
+    search_engine.start_watching(reload_interval)
+    ingestion.start()
 
-# Mount images directory to serve static files
+@app.on_event("shutdown")
+async def shutdown():
+    await search_engine.stop_watching()
+    await ingestion.stop()
+    submission_store.close()
+    await encode_batcher.stop()
+    vote_store.close()
+    await external_fetcher.imgflip_catalog.stop()
+    await external_fetcher.aclose()
+    await image_proxy.aclose()
+
+    if query_cache_path:
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            saved = encoder.query_cache.save(query_cache_path)
+            print(f"Saved {saved} cached query embeddings.")
+        except Exception as e:
+            print(f"Could not save query cache: {e}")
+
+class ImmutableStaticFiles(StaticFiles):
+    # Variant filenames contain a content hash, so they can be cached forever
+    def file_response(self, *args, **kwargs):
+        response = super().file_response(*args, **kwargs)
+        response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        return response
+
+# Mount images directory to serve static files (variants first so they get their cache headers)
 images_dir = os.path.join(base_dir, 'images')
+variants_dir = os.path.join(images_dir, 'variants')
+if os.path.isdir(variants_dir):
+    app.mount("/images/variants", ImmutableStaticFiles(directory=variants_dir), name="image-variants")
 app.mount("/images", StaticFiles(directory=images_dir), name="images")
 
+# semantic (embeddings only), lexical (BM25 only) or hybrid (both, fused)
+default_search_mode = os.getenv('MEMEDOCK_SEARCH_MODE', 'semantic')
+
+async def encode_query(query):
+    try:
+        return await encode_batcher.encode_query(query)
+    except Exception as e:
+        # SearchEngine.search falls back to keyword matching when it can't encode
+        print(f"Batched encode failed: {e}")
+        return None
+
 @app.get("/get-meme")
-async def get_meme(query: str = Query(..., description="The search query for the meme")):
-    result = search_engine.search(query)
+async def get_meme(
+    query: str = Query(..., description="The search query for the meme"),
+    mode: str = Query(default_search_mode, pattern="^(semantic|lexical|hybrid)$", description="Ranking mode")
+):
+    query_embedding = await encode_query(query) if mode != "lexical" else None
+    # Scoring and the keyword fallback are CPU work too, keep them off the event loop
+    result = await asyncio.to_thread(search_engine.search, query, query_embedding=query_embedding, mode=mode)
     
     if result:
+        GET_MEME_RESULTS.inc(result="vault")
         return JSONResponse(content=result)
     else:
         # Fallback logic: Search external sources
         print("Local search failed. Trying external sources...")
-        external_result = external_fetcher.search_external(query)
+        external_result = await external_fetcher.search_external(query)
         
+        GET_MEME_RESULTS.inc(result="external" if external_result else "none")
         if external_result:
-            return JSONResponse(content={
+            content = {
                 "message": "Meme found from external source.",
                 "fallback": True,
                 "source": external_result['source'],
                 "image_url": external_result['image_url'],
                 "caption": external_result['caption'],
                 "score": external_result.get('similarity_score', 0)
-            })
+            }
+            if external_result.get('degraded'):
+                # Some sources didn't answer in time or were skipped
+                content["degraded"] = True
+                content["unavailable_sources"] = external_fetcher.unavailable_sources()
+            return JSONResponse(content=content)
             
-        return JSONResponse(content={
+        content = {
             "message": "No relevant meme found in vault or external sources.",
             "fallback": True,
             "query": query
-        })
+        }
+        unavailable = external_fetcher.unavailable_sources()
+        if unavailable:
+            # Answered without asking these sources, they are failing right now
+            content["degraded"] = True
+            content["unavailable_sources"] = unavailable
+        return JSONResponse(content=content)
+
+@app.get("/search")
+async def search(
+    query: str = Query(..., description="The search query for the meme"),
+    k: int = Query(10, ge=1, le=50, description="Number of results per page"),
+    offset: int = Query(0, ge=0, description="Number of ranked results to skip"),
+    mode: str = Query(default_search_mode, pattern="^(semantic|lexical|hybrid)$", description="Ranking mode")
+):
+    try:
+        # Lexical mode never touches the model
+        query_embedding = await encode_batcher.encode_query(query) if mode != "lexical" else None
+        result = await asyncio.to_thread(
+            search_engine.search_top_k, query, k=k, offset=offset, query_embedding=query_embedding, mode=mode
+        )
+        return JSONResponse(content=result)
+    except Exception as e:
+        return JSONResponse(content={"error": str(e)}, status_code=500)
+
+# Most queries one /batch-search request may carry
+batch_search_max_queries = int(os.getenv('MEMEDOCK_BATCH_SEARCH_MAX_QUERIES', '100'))
+
+class BatchSearchRequest(BaseModel):
+    queries: List[str] = Field(..., min_length=1, max_length=batch_search_max_queries)
+    k: int = Field(5, ge=1, le=50)
+    mode: str = Field(default_search_mode, pattern="^(semantic|lexical|hybrid)$")
+    threshold: float = Field(0.3, ge=-1, le=1)
+
+@app.post("/batch-search")
+async def batch_search(request: BatchSearchRequest):
+    try:
+        # One batched encode and one matrix-matrix scoring pass for every query in the request
+        result = await asyncio.to_thread(
+            search_engine.search_many, request.queries, k=request.k, threshold=request.threshold, mode=request.mode
+        )
+        return JSONResponse(content=result)
+    except Exception as e:
+        return JSONResponse(content={"error": str(e)}, status_code=500)
 
 @app.get("/get-all-memes")
-async def get_all_memes():
+async def get_all_memes(
+    request: Request,
+    offset: int = Query(0, ge=0, description="Number of memes to skip"),
+    limit: Optional[int] = Query(None, ge=1, le=500, description="Page size (default: everything)"),
+    fields: Optional[str] = Query(None, description="Comma-separated fields to return, e.g. image_name,tags")
+):
     try:
-        metadata_path = os.path.join(base_dir, 'metadata', 'meme_metadata.json')
-        with open(metadata_path, 'r') as f:
-            data = json.load(f)
-        return JSONResponse(content=data)
+        field_list = [f.strip() for f in fields.split(',') if f.strip()] if fields else None
+        body, gzipped, etag = meme_catalog.render(offset=offset, limit=limit, fields=field_list)
+        
+        headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+        if etag in request.headers.get("if-none-match", ""):
+            return Response(status_code=304, headers=headers)
+        if "gzip" in request.headers.get("accept-encoding", ""):
+            return Response(content=gzipped, media_type="application/json", headers={**headers, "Content-Encoding": "gzip"})
+        return Response(content=body, media_type="application/json", headers=headers)
     except Exception as e:
         return JSONResponse(content={"error": str(e)}, status_code=500)
 
+@app.get("/cache-stats")
+async def cache_stats():
+    caches = [
+        encoder.query_cache,
+        search_engine.result_cache,
+        external_fetcher.result_cache,
+        external_fetcher.miss_cache,
+        external_fetcher.caption_cache,
+    ]
+    stats = {cache.name: cache.stats() for cache in caches}
+    stats["encode_batcher"] = encode_batcher.stats()
+    stats["proxy_images"] = image_proxy.cache.stats()
+    stats["ingestion"] = ingestion.stats()
+    stats["circuit_breakers"] = {name: breaker.stats() for name, breaker in external_fetcher.breakers.items()}
+    return JSONResponse(content=stats)
+
+@app.get("/metrics")
+async def metrics():
+    # Prometheus text exposition format
+    return Response(content=REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/ready")
+async def ready():
+    status = encoder.status()
+    status["snapshot"] = search_engine.snapshot.info()
+    return JSONResponse(content=status, status_code=200 if status["ready"] else 503)
+
+def admin_error(token):
+    if not admin_token:
+        return JSONResponse(content={"error": "Admin endpoints are disabled (set MEMEDOCK_ADMIN_TOKEN)"}, status_code=403)
+    if token != admin_token:
+        return JSONResponse(content={"error": "Invalid admin token"}, status_code=401)
+    return None
+
+@app.post("/admin/reload")
+async def admin_reload(x_admin_token: Optional[str] = Header(None)):
+    denied = admin_error(x_admin_token)
+    if denied:
+        return denied
+    try:
+        # Built off the event loop; searches keep using the current snapshot until the swap.
+        # Other workers see the touched reload stamp and follow within MEMEDOCK_RELOAD_INTERVAL.
+        snapshot = await asyncio.to_thread(search_engine.reload, broadcast=True)
+        return JSONResponse(content={"message": "Search index reloaded", "snapshot": snapshot.info()})
+    except Exception as e:
+        return JSONResponse(content={"error": f"Reload failed, still serving v{search_engine.snapshot.version}: {e}"}, status_code=500)
+
 @app.get("/")
 async def root():
     return {"message": "Meme Vault Backend is running. Use /get-meme?query=... to search."}
@@ -81,37 +388,31 @@ class VoteRequest(BaseModel):
 @app.post("/vote")
 async def vote_meme(vote: VoteRequest):
     try:
-        metadata_path = os.path.join(base_dir, 'metadata', 'meme_metadata.json')
-        with open(metadata_path, 'r') as f:
-            data = json.load(f)
-        
-        found = False
-        for meme in data['memes']:
-            if meme['image_name'] == vote.image_name:
-                if vote.vote_type == "upvote":
-                    meme['upvotes'] = meme.get('upvotes', 0) + 1
-                elif vote.vote_type == "downvote":
-                    meme['downvotes'] = meme.get('downvotes', 0) + 1
-                found = True
-                break
-        
-        if not found:
+        meme = search_engine.meme_map.get(vote.image_name)
+        if meme is None:
             return JSONResponse(content={"error": "Meme not found"}, status_code=404)
-            
-        with open(metadata_path, 'w') as f:
-            json.dump(data, f, indent=2)
-            
-        return JSONResponse(content={"message": "Vote recorded", "meme": meme})
+        if vote.vote_type not in ("upvote", "downvote"):
+            return JSONResponse(content={"error": "vote_type must be 'upvote' or 'downvote'"}, status_code=400)
+        
+        counts = vote_store.record(vote.image_name, vote.vote_type)
+        return JSONResponse(content={"message": "Vote recorded", "meme": {**meme, **counts}})
     except Exception as e:
         return JSONResponse(content={"error": str(e)}, status_code=500)
 
+@app.get("/votes")
+async def get_votes():
+    return JSONResponse(content=vote_store.all_counts())
+
+@app.get("/votes/{image_name}")
+async def get_meme_votes(image_name: str):
+    if image_name not in search_engine.meme_map:
+        return JSONResponse(content={"error": "Meme not found"}, status_code=404)
+    return JSONResponse(content={"image_name": image_name, **vote_store.get(image_name)})
+
 from fastapi import FastAPI, Query, File, UploadFile, Form
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel
-import shutil
-import uuid
-import datetime
 
 # ... existing code ...
 
@@ -123,51 +424,76 @@ async def submit_meme(
     utility: str = Form(...)
 ):
     try:
-        # Ensure pending directory exists
-        pending_dir = os.path.join(base_dir, 'pending_memes')
-        os.makedirs(pending_dir, exist_ok=True)
-
-        # Generate unique filename
-        file_extension = os.path.splitext(file.filename)[1]
-        unique_filename = f"{uuid.uuid4()}{file_extension}"
-        file_path = os.path.join(pending_dir, unique_filename)
-        
-        # Save image to pending directory
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-            
-        # Update pending metadata
-        pending_metadata_path = os.path.join(pending_dir, 'pending_submissions.json')
-        
-        # Create pending metadata file if it doesn't exist
-        if not os.path.exists(pending_metadata_path):
-            with open(pending_metadata_path, 'w') as f:
-                json.dump({"submissions": []}, f, indent=2)
+        # Validation, normalization and embedding happen in the ingestion worker
+        submission = await ingestion.submit(file, name, description, utility)
+        return JSONResponse(
+            content={
+                "message": "Meme submitted for review",
+                "job_id": submission["id"],
+                "status_url": f"/submissions/{submission['id']}",
+                "submission": submission
+            },
+            status_code=202
+        )
+    except SubmissionTooLarge as e:
+        return JSONResponse(content={"error": str(e)}, status_code=413)
+    except Exception as e:
+        return JSONResponse(content={"error": str(e)}, status_code=500)
 
-        with open(pending_metadata_path, 'r') as f:
-            data = json.load(f)
-            
-        new_submission = {
-            "id": str(uuid.uuid4()),
-            "image_name": unique_filename,
-            "original_filename": file.filename,
-            "category": "community_submission",
-            "tags": [name],
-            "prompt": description,
-            "captions": [utility],
-            "submitted_on": datetime.date.today().isoformat(),
-            "status": "pending"
-        }
-        
-        data['submissions'].append(new_submission)
-        
-        with open(pending_metadata_path, 'w') as f:
-            json.dump(data, f, indent=2)
-            
-        return JSONResponse(content={"message": "Meme submitted for review", "submission": new_submission})
+@app.get("/submissions/{submission_id}")
+async def get_submission(submission_id: str):
+    submission = submission_store.get(submission_id)
+    if submission is None:
+        return JSONResponse(content={"error": "Submission not found"}, status_code=404)
+    return JSONResponse(content=submission)
+
+@app.get("/admin/submissions")
+async def list_submissions(
+    status: Optional[str] = Query("pending", description="Filter by status, e.g. pending or duplicate (empty for all)"),
+    limit: int = Query(100, ge=1, le=1000),
+    x_admin_token: Optional[str] = Header(None)
+):
+    denied = admin_error(x_admin_token)
+    if denied:
+        return denied
+    return JSONResponse(content={"submissions": submission_store.list(status=status or None, limit=limit)})
+
+@app.post("/admin/submissions/{submission_id}/approve")
+async def approve_submission(
+    submission_id: str,
+    force: bool = Query(False, description="Publish even if flagged as a near-duplicate"),
+    x_admin_token: Optional[str] = Header(None)
+):
+    denied = admin_error(x_admin_token)
+    if denied:
+        return denied
+    try:
+        # Appends the stored vector and reloads the search snapshot, no full regenerate
+        meme, snapshot = await asyncio.to_thread(ingestion.approve, submission_id, force)
+        return JSONResponse(content={"message": "Meme is live", "meme": meme, "snapshot": snapshot.info()})
+    except KeyError:
+        return JSONResponse(content={"error": "Submission not found"}, status_code=404)
+    except ValueError as e:
+        return JSONResponse(content={"error": str(e)}, status_code=409)
     except Exception as e:
         return JSONResponse(content={"error": str(e)}, status_code=500)
 
+@app.post("/admin/submissions/{submission_id}/reject")
+async def reject_submission(
+    submission_id: str,
+    reason: Optional[str] = Query(None),
+    x_admin_token: Optional[str] = Header(None)
+):
+    denied = admin_error(x_admin_token)
+    if denied:
+        return denied
+    if submission_store.get(submission_id) is None:
+        return JSONResponse(content={"error": "Submission not found"}, status_code=404)
+    try:
+        return JSONResponse(content={"message": "Submission rejected", "submission": ingestion.reject(submission_id, reason)})
+    except ValueError as e:
+        return JSONResponse(content={"error": str(e)}, status_code=409)
+
 @app.get("/proxy-image")
 async def proxy_image(url: str = Query(..., description="URL of the image to proxy")):
     try:
@@ -175,18 +501,10 @@ async def proxy_image(url: str = Query(..., description="URL of the image to pro
         if not url.startswith("http"):
              return JSONResponse(content={"error": "Invalid URL"}, status_code=400)
 
-        import requests
-        from fastapi import Response
-        response = requests.get(url, stream=True)
-        response.raise_for_status()
-        
-        return Response(
-            content=response.content, 
-            media_type=response.headers.get("content-type", "image/jpeg")
-        )
+        return await image_proxy.fetch(url)
     except Exception as e:
         print(f"Proxy error: {e}")
-        return JSONResponse(content={"error": str(e)}, status_code=500)
+        return JSONResponse(content={"error": str(e)}, status_code=502)
 
 
 if __name__ == "__main__":
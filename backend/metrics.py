@@ -0,0 +1,334 @@
+import bisect
+import os
+import random
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+# Seconds; covers a sub-millisecond index scan up to a stalled external source
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _labels(self, key, extra=()):
+        return list(zip(self.labelnames, key)) + list(extra)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return lines
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        super().__init__(name, help, labelnames)
+        self._values = defaultdict(float)
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] += amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self._labels(key))} {_format_value(value)}" for key, value in items]
+
+
+class Histogram(Metric):
+    """
+    Cumulative-bucket histogram in the Prometheus sense: per label set a count
+    per bucket, a running sum and a total count. `observe` is a bisect and
+    three additions under a lock, cheap enough for every request.
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # label values -> [bucket counts, sum, count]
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            if i < len(self.buckets):
+                series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels):
+        series = self._series.get(self._key(labels))
+        return series[2] if series else 0
+
+    def _samples(self):
+        with self._lock:
+            items = sorted((key, (list(s[0]), s[1], s[2])) for key, s in self._series.items())
+        lines = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self._labels(key, [('le', _format_value(float(bound)))]))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(self._labels(key, [('le', '+Inf')]))} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self._labels(key))} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self._labels(key))} {count}")
+        return lines
+
+
+class Registry:
+    """
+    Process-wide set of metrics rendered in the Prometheus text format.
+
+    Besides counters and histograms, collectors can be registered: callables
+    returning `(name, kind, help, [(labels dict, value), ...])` tuples, read
+    at scrape time. They expose numbers other objects already keep (cache
+    hit counts, queue sizes) without a second copy on the hot path.
+
+    Every process (uvicorn/gunicorn worker) has its own registry, so each
+    worker is scraped, or aggregated, separately.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+
+    def _register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self._register(Counter(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def register_collector(self, collector):
+        self._collectors.append(collector)
+
+    def render(self):
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            try:
+                families = list(collector())
+            except Exception as e:
+                print(f"Metrics collector {collector} failed: {e}")
+                continue
+            for name, kind, help, samples in families:
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_format_labels(sorted(labels.items()))} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+# Hot-path stages. Modules import these and record into them directly.
+MODEL_LOAD_SECONDS = REGISTRY.histogram(
+    'memedock_model_load_seconds', "Time to load the embedding model", ['backend'],
+    buckets=(0.5, 1, 2.5, 5, 10, 30, 60, 120)
+)
+ENCODE_SECONDS = REGISTRY.histogram('memedock_encode_seconds', "Time per Encoder.encode call", ['backend'])
+ENCODE_BATCH_SIZE = REGISTRY.histogram(
+    'memedock_encode_batch_texts', "Texts per Encoder.encode call", buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256)
+)
+SEARCH_STAGE_SECONDS = REGISTRY.histogram(
+    'memedock_search_stage_seconds', "Time per local search stage (similarity, similarity_batch, keyword, fusion)", ['stage']
+)
+SEARCHES = REGISTRY.counter(
+    'memedock_searches_total', "Local /get-meme searches by mode and outcome (match, threshold_miss, error)",
+    ['mode', 'outcome']
+)
+SNAPSHOT_LOAD_SECONDS = REGISTRY.histogram(
+    'memedock_snapshot_load_seconds', "Time to load metadata, embeddings and indexes into a search snapshot",
+    buckets=(0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60)
+)
+GET_MEME_RESULTS = REGISTRY.counter(
+    'memedock_get_meme_results_total', "/get-meme answers by where they came from (vault, external, none)",
+    ['result']
+)
+FALLBACK_SECONDS = REGISTRY.histogram(
+    'memedock_fallback_seconds', "Time of an uncached external fallback lookup (found, not_found, degraded, error)",
+    ['outcome']
+)
+FALLBACK_SOURCE_SECONDS = REGISTRY.histogram(
+    'memedock_fallback_source_seconds', "Time per external source fetch (ok, timeout, error, over_budget)",
+    ['source', 'outcome']
+)
+FALLBACK_SOURCES_SKIPPED = REGISTRY.counter(
+    'memedock_fallback_source_skipped_total', "External source fetches skipped because the source's circuit was open",
+    ['source']
+)
+VOTE_FLUSH_SECONDS = REGISTRY.histogram(
+    'memedock_vote_flush_seconds', "Time per vote flush transaction", ['outcome']
+)
+VOTES = REGISTRY.counter('memedock_votes_total', "Votes recorded", ['vote_type'])
+PROXY_BYTES = REGISTRY.counter(
+    'memedock_proxy_bytes_total', "Image bytes served by /proxy-image (cache hit or streamed from upstream)", ['cache']
+)
+PROXY_UPSTREAM_SECONDS = REGISTRY.histogram(
+    'memedock_proxy_upstream_seconds', "Time to stream an upstream image body (complete, truncated, error)",
+    ['outcome']
+)
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    'memedock_http_request_seconds', "Time until response headers, per route", ['method', 'route', 'status']
+)
+SLOW_REQUESTS = REGISTRY.counter(
+    'memedock_slow_requests_profiled_total', "Slow requests whose profile was written", ['route']
+)
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SlowRequestProfiler:
+    """
+    Opt-in sampling profiler for slow requests.
+
+    While at least one profiled request is in flight, a background thread
+    records the stack of every thread each `interval_ms`. When a request
+    finishes after `threshold_ms` or more, its samples are written to
+    `output_dir` as collapsed stacks ("thread;frame;frame count" lines, what
+    flamegraph.pl and speedscope read). Samples cover all threads, so model
+    and index work in to_thread workers shows up, and so does anything else
+    running at the same time. Only a `sample_rate` fraction of requests is
+    profiled; the newest `max_files` profiles are kept.
+    """
+
+    def __init__(self, output_dir, threshold_ms=500, interval_ms=5, sample_rate=1.0, max_files=100):
+        self.output_dir = output_dir
+        self.threshold = threshold_ms / 1000
+        self.interval = interval_ms / 1000
+        self.sample_rate = sample_rate
+        self.max_files = max_files
+        self.written = 0
+        self._sessions = []
+        self._cond = threading.Condition()
+        self._thread = None
+        os.makedirs(output_dir, exist_ok=True)
+
+    def begin(self):
+        # A session is the stack -> sample count map for one request, or None when not sampled
+        if random.random() >= self.sample_rate:
+            return None
+        session = defaultdict(int)
+        with self._cond:
+            self._sessions.append(session)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='slow-request-profiler', daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return session
+
+    def end(self, session, label, seconds):
+        with self._cond:
+            self._sessions.remove(session)
+        if seconds < self.threshold or not session:
+            return None
+
+        route = label.split(' ', 1)[-1]
+        safe = ''.join(c if c.isalnum() else '_' for c in label).strip('_')
+        with self._cond:
+            self.written += 1
+            number = self.written
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}_{os.getpid()}-{number}_{safe}_{int(seconds * 1000)}ms.folded"
+        path = os.path.join(self.output_dir, name)
+        with open(path, 'w') as f:
+            for stack, count in sorted(session.items(), key=lambda item: -item[1]):
+                f.write(f"{stack} {count}\n")
+        SLOW_REQUESTS.inc(route=route)
+        print(f"Slow request {label} took {seconds * 1000:.0f}ms, profile written to {path}")
+        self._prune()
+        return path
+
+    def _prune(self):
+        profiles = sorted(
+            (os.path.join(self.output_dir, name) for name in os.listdir(self.output_dir) if name.endswith('.folded')),
+            key=os.path.getmtime
+        )
+        for path in profiles[:-self.max_files]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _run(self):
+        own = threading.get_ident()
+        while True:
+            with self._cond:
+                while not self._sessions:
+                    self._cond.wait()
+            time.sleep(self.interval)
+
+            names = {t.ident: t.name for t in threading.enumerate()}
+            stacks = []
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                frames = []
+                while frame is not None:
+                    frames.append(_frame_name(frame))
+                    frame = frame.f_back
+                frames.append(names.get(ident, f"thread-{ident}"))
+                stacks.append(';'.join(reversed(frames)))
+
+            with self._cond:
+                for session in self._sessions:
+                    for stack in stacks:
+                        session[stack] += 1
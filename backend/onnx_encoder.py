@@ -0,0 +1,61 @@
+import os
+import numpy as np
+import onnxruntime as ort
+from tokenizers import Tokenizer
+
+ONNX_MODEL_FILENAME = 'model_int8.onnx'
+TOKENIZER_FILENAME = 'tokenizer.json'
+DEFAULT_MODEL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models', 'all-MiniLM-L6-v2-onnx')
+
+
+class OnnxEncoder:
+    """
+    all-MiniLM-L6-v2 exported to ONNX (see scripts/export_onnx.py), run with onnxruntime.
+
+    Reproduces what SentenceTransformer does for this model: tokenize, run
+    the transformer, mean-pool over the attention mask and L2-normalize.
+    Only onnxruntime and tokenizers are needed, not torch. `encode` has the
+    same call shape as SentenceTransformer.encode, so it can stand in for it.
+    """
+
+    def __init__(self, model_dir=DEFAULT_MODEL_DIR, threads=None, model_file=ONNX_MODEL_FILENAME, max_length=256):
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+            options.inter_op_num_threads = 1
+        self.model_path = os.path.join(model_dir, model_file)
+        self.session = ort.InferenceSession(self.model_path, options, providers=['CPUExecutionProvider'])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, TOKENIZER_FILENAME))
+        self.tokenizer.enable_truncation(max_length)
+        self.tokenizer.enable_padding(pad_id=0, pad_token='[PAD]')
+
+    def encode(self, sentences, batch_size=32, normalize_embeddings=True, **kwargs):
+        # Extra SentenceTransformer kwargs (convert_to_numpy, show_progress_bar) are accepted and ignored
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+
+        # Similar lengths share a batch, so there is less padding to run through the model
+        order = np.argsort([-len(t) for t in texts], kind='stable')
+        embeddings = [None] * len(texts)
+        for start in range(0, len(texts), batch_size):
+            batch = order[start:start + batch_size]
+            encodings = self.tokenizer.encode_batch([texts[i] for i in batch])
+            feed = {
+                'input_ids': np.array([e.ids for e in encodings], dtype=np.int64),
+                'attention_mask': np.array([e.attention_mask for e in encodings], dtype=np.int64),
+                'token_type_ids': np.array([e.type_ids for e in encodings], dtype=np.int64),
+            }
+            hidden = self.session.run(None, {k: v for k, v in feed.items() if k in self.input_names})[0]
+
+            mask = feed['attention_mask'][:, :, None].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            if normalize_embeddings:
+                pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            for i, vector in zip(batch, pooled):
+                embeddings[i] = vector
+
+        matrix = np.asarray(embeddings, dtype=np.float32) if texts else np.empty((0, 0), dtype=np.float32)
+        return matrix[0] if single else matrix
@@ -1,125 +1,453 @@
+import asyncio
 import json
 import os
+import threading
+import time
 import numpy as np
-from sentence_transformers import SentenceTransformer
+from embedding_store import EmbeddingStore, VECTORS_FILENAME, NAMES_FILENAME
+from vector_index import IVF_INDEX_FILENAME, load_index, top_k
+from cache import LRUCache, MISSING, normalize_query
+from encoder import get_encoder
+from keyword_index import KeywordIndex
+from metrics import SEARCHES, SEARCH_STAGE_SECONDS, SNAPSHOT_LOAD_SECONDS
 
-class SearchEngine:
-    def __init__(self, base_dir):
-        self.base_dir = base_dir
-        self.metadata_path = os.path.join(base_dir, 'metadata', 'meme_metadata.json')
-        self.embeddings_path = os.path.join(base_dir, 'metadata', 'meme_embeddings.json')
-        
+SEARCH_MODES = ('semantic', 'lexical', 'hybrid')
+
+# Reciprocal rank fusion: each ranking contributes weight / (RRF_K + rank)
+RRF_K = 60
+HYBRID_POOL = 100
+# A hybrid hit below the similarity threshold needs at least this share of the query's terms
+HYBRID_MIN_KEYWORD_COVERAGE = 0.5
+
+KEYWORD_EXPLANATION = "Found based on keywords matching tags/captions."
+
+# Touched by a forced reload so the watchers of the other workers reload too
+RELOAD_STAMP_FILENAME = '.reload'
+
+class SearchSnapshot:
+    """
+    Everything a search reads: metadata, embeddings, ANN index and BM25 index.
+
+    A snapshot is built in full and never mutated afterwards. Searches take a
+    reference to the current one and use it to the end, so a reload can build
+    the next snapshot in the background and swap it in with one assignment.
+    """
+
+    def __init__(self, metadata_dir, version=1):
+        start = time.perf_counter()
+        self.version = version
+        self.metadata_dir = metadata_dir
+        self.metadata_path = os.path.join(metadata_dir, 'meme_metadata.json')
         self.metadata = self._load_json(self.metadata_path).get('memes', [])
-        self.embeddings_data = self._load_json(self.embeddings_path)
         
         # Create a map for quick lookup
         self.meme_map = {m['image_name']: m for m in self.metadata}
         
-        # Prepare embeddings matrix and image names list
-        self.image_names = [item['image_name'] for item in self.embeddings_data]
-        self.embeddings_matrix = np.array([item['embedding'] for item in self.embeddings_data])
+        # Resized WebP/AVIF variants from scripts/generate_thumbnails.py (optional)
+        variants_path = os.path.join(metadata_dir, 'image_variants.json')
+        self.image_variants = self._load_json(variants_path) if os.path.exists(variants_path) else {}
+        
+        # Image names list and a memory-mapped (zero-copy) embeddings matrix
+        self.image_names, self.embeddings_matrix = EmbeddingStore(metadata_dir).load_or_import()
         
-        print("SearchEngine initialized (Model will load on first search).")
-        self.model = None
+        # Nearest-neighbour index over the matrix (exact flat scan unless MEMEDOCK_INDEX=ivf)
+        self.index = load_index(metadata_dir, self.embeddings_matrix)
+        
+        # BM25 inverted index for keyword search, built once here instead of scanning per query.
+        # Documents follow the embedding row order (memes without a vector go last),
+        # so hybrid ranking can fuse both signals on row ids without any lookups.
+        embedded = set(self.image_names)
+        keyword_docs = [self.meme_map.get(name, {'image_name': name}) for name in self.image_names]
+        keyword_docs += [m for m in self.metadata if m['image_name'] not in embedded]
+        self.keyword_index = KeywordIndex(keyword_docs)
+
+        self.loaded_at = time.time()
+        self.load_seconds = time.perf_counter() - start
+        SNAPSHOT_LOAD_SECONDS.observe(self.load_seconds)
 
     def _load_json(self, path):
         with open(path, 'r') as f:
             return json.load(f)
 
-    def _get_model(self):
-        if self.model is None:
-            print("Loading SentenceTransformer model...")
-            self.model = SentenceTransformer('all-MiniLM-L6-v2')
-        return self.model
+    def image_urls(self, image_name):
+        # Serving paths for the original plus any pre-generated variants (smallest first)
+        variants = [
+            {"width": v['width'], "format": v['format'], "url": v['url']}
+            for v in self.image_variants.get(image_name, {}).get('variants', [])
+        ]
+        thumbnail = next((v['url'] for v in variants if v['format'] == 'webp'), None)
+        return {
+            "image_url": f"/images/{image_name}",
+            "thumbnail_url": thumbnail or f"/images/{image_name}",
+            "variants": variants
+        }
+
+    def info(self):
+        return {
+            "version": self.version,
+            "memes": len(self.metadata),
+            "embeddings": len(self.image_names),
+            "index": type(self.index).__name__,
+            "loaded_at": self.loaded_at,
+            "load_seconds": round(self.load_seconds, 3)
+        }
+
+
+def watched_files(metadata_dir):
+    # Files a regenerate or an approval rewrites; any change triggers a reload
+    names = (
+        'meme_metadata.json', VECTORS_FILENAME, NAMES_FILENAME,
+        IVF_INDEX_FILENAME, 'image_variants.json', RELOAD_STAMP_FILENAME
+    )
+    return [os.path.join(metadata_dir, name) for name in names]
 
-    def search(self, query, threshold=0.3):
+
+def files_signature(paths):
+    signature = []
+    for path in paths:
         try:
-            # Encode query
-            model = self._get_model()
-            query_embedding = model.encode(query)
+            stat = os.stat(path)
+            signature.append((path, stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            signature.append((path, None, None))
+    return tuple(signature)
+
+
+class SearchEngine:
+    def __init__(self, base_dir, encoder=None):
+        self.base_dir = base_dir
+        self.encoder = encoder or get_encoder()
+        self.metadata_dir = os.path.join(base_dir, 'metadata')
+        self.metadata_path = os.path.join(self.metadata_dir, 'meme_metadata.json')
+        self.embedding_store = EmbeddingStore(self.metadata_dir)
+
+        self._reload_lock = threading.Lock()
+        self._signature = files_signature(watched_files(self.metadata_dir))
+        self._watch_task = None
+        self._reload_listeners = []
+        self.snapshot = SearchSnapshot(self.metadata_dir)
+
+        self.lexical_weight = float(os.getenv('MEMEDOCK_HYBRID_LEXICAL_WEIGHT', '1.0'))
+        
+        # Repeated queries skip the scan entirely (query embeddings are cached by the encoder)
+        self.result_cache = LRUCache('search_results', maxsize=int(os.getenv('MEMEDOCK_RESULT_CACHE_SIZE', '4096')))
+        
+        print("SearchEngine initialized.")
+
+    # Read-only views of the current snapshot
+    @property
+    def metadata(self):
+        return self.snapshot.metadata
+
+    @property
+    def meme_map(self):
+        return self.snapshot.meme_map
+
+    @property
+    def image_names(self):
+        return self.snapshot.image_names
+
+    @property
+    def embeddings_matrix(self):
+        return self.snapshot.embeddings_matrix
+
+    @property
+    def index(self):
+        return self.snapshot.index
+
+    @property
+    def keyword_index(self):
+        return self.snapshot.keyword_index
+
+    def reload(self, broadcast=False):
+        """
+        Rebuild the snapshot from disk and swap it in.
+
+        The old snapshot keeps serving until the new one is complete, and
+        searches already running finish on the snapshot they started with.
+        The encoder is shared and not touched. If loading fails the current
+        snapshot stays in place and the error is raised.
+
+        A reload only affects this process. With `broadcast`, the reload
+        stamp file is touched first, so every other process watching the
+        same metadata directory (see `start_watching`) reloads as well.
+
+        Listeners added with `add_reload_listener` run after every swap,
+        whichever path triggered it (admin endpoint, watcher, approval).
+        """
+        with self._reload_lock:
+            if broadcast:
+                with open(os.path.join(self.metadata_dir, RELOAD_STAMP_FILENAME), 'w') as f:
+                    f.write(str(time.time()))
+            signature = files_signature(watched_files(self.metadata_dir))
+            snapshot = SearchSnapshot(self.metadata_dir, version=self.snapshot.version + 1)
+            self.snapshot = snapshot
+            self._signature = signature
+            # Entries are keyed by snapshot version, clearing just frees the memory
+            self.result_cache.clear()
+        print(f"Reloaded search snapshot v{snapshot.version}: {len(snapshot.metadata)} memes in {snapshot.load_seconds:.2f}s.")
+        for listener in self._reload_listeners:
+            try:
+                listener(snapshot)
+            except Exception as e:
+                # The new snapshot is already serving; a failing listener must not undo that
+                print(f"Reload listener {listener} failed: {e}")
+        return snapshot
+
+    def add_reload_listener(self, listener):
+        # listener(snapshot) is called after each successful reload
+        self._reload_listeners.append(listener)
+
+    def start_watching(self, interval):
+        # Poll the metadata files and reload once they have stopped changing
+        if self._watch_task is None and interval > 0:
+            self._watch_task = asyncio.create_task(self._watch(interval))
+
+    async def stop_watching(self):
+        if self._watch_task is not None:
+            self._watch_task.cancel()
+            try:
+                await self._watch_task
+            except asyncio.CancelledError:
+                pass
+            self._watch_task = None
+
+    async def _watch(self, interval):
+        paths = watched_files(self.metadata_dir)
+        previous = self._signature
+        while True:
+            await asyncio.sleep(interval)
+            current = files_signature(paths)
+            # Wait for one quiet interval so a regenerate that writes several files is picked up whole
+            if current != self._signature and current == previous:
+                try:
+                    await asyncio.to_thread(self.reload)
+                except Exception as e:
+                    print(f"Search snapshot reload failed, keeping v{self.snapshot.version}: {e}")
+            previous = current
+
+    def _encode(self, query):
+        return self.encoder.encode_query(query)
+
+    def image_urls(self, image_name):
+        return self.snapshot.image_urls(image_name)
+
+    def _build_result(self, snap, image_name, score, query, explanation=None, details=None):
+        # `details` are extra fields from the ranking (match_type, bm25_score)
+        meme_info = snap.meme_map.get(image_name)
+        if not meme_info:
+            return None
+        details = details or {}
+        if explanation is None and details.get('match_type') == 'keyword':
+            explanation = KEYWORD_EXPLANATION
+        return {
+            "image_name": image_name,
+            "score": float(score),
+            "metadata": meme_info,
+            **snap.image_urls(image_name),
+            **details,
+            "explanation": explanation or f"This meme matches your vibe with a {int(score * 100)}% confidence. It is associated with tags like {', '.join(meme_info.get('tags', [])[:3])}, making it a great fit for '{query}'."
+        }
+
+    def _ranked(self, snap, query, count, mode, threshold, query_embedding):
+        # Best `count` image names for the query, best first, with their scores and
+        # per-result details (match_type, and bm25_score for keyword matches)
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"Unknown search mode '{mode}', expected one of {SEARCH_MODES}")
+        if mode == 'lexical':
+            with SEARCH_STAGE_SECONDS.time(stage='keyword'):
+                ids, bm25 = snap.keyword_index.search(query, count)
+            # Ranked by BM25, which is unbounded; `score` is the share of query terms matched,
+            # on the same [0, 1] scale as a cosine
+            details = [{"match_type": "keyword", "bm25_score": float(score)} for score in bm25]
+            return [snap.keyword_index.image_names[i] for i in ids], snap.keyword_index.coverage(query, ids), details
+
+        if query_embedding is None:
+            query_embedding = self._encode(query)
+        if mode == 'hybrid':
+            return self._hybrid(snap, query, count, threshold, query_embedding)
+        with SEARCH_STAGE_SECONDS.time(stage='similarity'):
+            ids, scores = snap.index.search(query_embedding, count)
+        keep = scores >= threshold
+        return [snap.image_names[i] for i in ids[keep]], scores[keep], [{"match_type": "semantic"}] * int(keep.sum())
+
+    def _hybrid(self, snap, query, count, threshold, query_embedding):
+        # Fuse the semantic and BM25 rankings with reciprocal rank fusion.
+        # Returned scores are the cosine similarities so they stay comparable to semantic mode
+        # (and on the [0, 1] scale clients show); docs a keyword hit let in also get their BM25 score.
+        pool = max(count, HYBRID_POOL)
+        with SEARCH_STAGE_SECONDS.time(stage='similarity'):
+            sem_ids, sem_scores = snap.index.search(query_embedding, pool)
+        with SEARCH_STAGE_SECONDS.time(stage='keyword'):
+            lex_ids, lex_scores = snap.keyword_index.search(query, pool)
+        fuse_start = time.perf_counter()
+
+        ids = np.concatenate([sem_ids, lex_ids])
+        contributions = np.concatenate([
+            1.0 / (RRF_K + np.arange(1, len(sem_ids) + 1)),
+            self.lexical_weight / (RRF_K + np.arange(1, len(lex_ids) + 1))
+        ])
+        doc_ids, inverse = np.unique(ids, return_inverse=True)
+        fused = np.bincount(inverse, weights=contributions)
+
+        # Cosine for every fused doc: lexical-only hits get theirs from the matrix,
+        # memes without a vector count as 0
+        cosine = np.zeros(len(doc_ids), dtype=np.float32)
+        has_vector = doc_ids < len(snap.image_names)
+        cosine[has_vector] = np.dot(np.asarray(snap.embeddings_matrix[doc_ids[has_vector]], dtype=np.float32), query_embedding)
+
+        bm25 = np.zeros(len(doc_ids), dtype=np.float32)
+        bm25[np.searchsorted(doc_ids, lex_ids)] = lex_scores
+
+        # A doc qualifies on either signal: semantic similarity, or a keyword match on
+        # enough of the query that it isn't just one shared word
+        semantic = cosine >= threshold
+        keyword = np.zeros(len(doc_ids), dtype=bool)
+        candidates = ~semantic & (bm25 > 0)
+        keyword[candidates] = snap.keyword_index.coverage(query, doc_ids[candidates]) >= HYBRID_MIN_KEYWORD_COVERAGE
+        eligible = semantic | keyword
+        doc_ids, fused, cosine, bm25, semantic = doc_ids[eligible], fused[eligible], cosine[eligible], bm25[eligible], semantic[eligible]
+
+        order = top_k(fused, count)
+        SEARCH_STAGE_SECONDS.observe(time.perf_counter() - fuse_start, stage='fusion')
+        details = [
+            {"match_type": "semantic"} if semantic[i] else {"match_type": "keyword", "bm25_score": float(bm25[i])}
+            for i in order
+        ]
+        return [snap.keyword_index.image_names[i] for i in doc_ids[order]], np.maximum(cosine[order], 0), details
+
+    def search_top_k(self, query, k=10, offset=0, threshold=0.3, query_embedding=None, mode='semantic'):
+        # One encode and one index lookup serve a whole page of ranked results.
+        # Lexical mode ranks by BM25 alone and ignores the similarity threshold.
+
+        snap = self.snapshot
+
+        # Ask for one extra hit so we know whether another page exists
+        names, scores, details = self._ranked(snap, query, offset + k + 1, mode, threshold, query_embedding)
+
+        results = []
+        for rank in range(offset, min(offset + k, len(names))):
+            result = self._build_result(snap, names[rank], scores[rank], query, details=details[rank])
+            if result:
+                result["rank"] = rank + 1
+                results.append(result)
+
+        print(f"Query: '{query}' | {mode} top-k page offset={offset} k={k} | {len(results)} results")
+        return {
+            "query": query,
+            "mode": mode,
+            "offset": offset,
+            "k": k,
+            "has_more": len(names) > offset + k,
+            "results": results
+        }
+
+    def search_many(self, queries, k=5, threshold=0.3, query_embeddings=None, mode='semantic'):
+        # Top-k for a whole batch of queries: one batched encode and, in semantic mode,
+        # one matrix-matrix scoring pass instead of an encode and a scan per query.
+        # Vault only: there is no external fallback for a batch.
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"Unknown search mode '{mode}', expected one of {SEARCH_MODES}")
+
+        snap = self.snapshot
+        if query_embeddings is None and mode != 'lexical' and queries:
+            query_embeddings = self.encoder.encode_queries(queries)
+
+        if mode == 'semantic' and queries:
+            with SEARCH_STAGE_SECONDS.time(stage='similarity_batch'):
+                ids, scores = snap.index.search_many(query_embeddings, k)
+            ranked = []
+            for row_ids, row_scores in zip(ids, scores):
+                keep = row_scores >= threshold
+                ranked.append(([snap.image_names[i] for i in row_ids[keep]], row_scores[keep], [{"match_type": "semantic"}] * int(keep.sum())))
+        else:
+            ranked = [
+                self._ranked(snap, query, k, mode, threshold, None if mode == 'lexical' else query_embeddings[i])
+                for i, query in enumerate(queries)
+            ]
+
+        results = []
+        for query, (names, scores, details) in zip(queries, ranked):
+            matches = []
+            for rank, (name, score, detail) in enumerate(zip(names, scores, details), start=1):
+                result = self._build_result(snap, name, score, query, details=detail)
+                if result:
+                    result["rank"] = rank
+                    matches.append(result)
+            results.append({"query": query, "results": matches})
+
+        print(f"Batch of {len(queries)} {mode} queries | {sum(len(r['results']) for r in results)} results")
+        return {"mode": mode, "k": k, "results": results}
+
+    def search(self, query, threshold=0.3, query_embedding=None, mode='semantic'):
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"Unknown search mode '{mode}', expected one of {SEARCH_MODES}")
+
+        snap = self.snapshot
+        # The cache holds the ranking, (image_name, score, details) or None; the result is
+        # built per call because its explanation quotes the caller's own query text
+        cache_key = (snap.version, normalize_query(query), threshold, mode)
+        cached = self.result_cache.get(cache_key, MISSING)
+        if cached is not MISSING:
+            SEARCHES.inc(mode=mode, outcome='match' if cached else 'threshold_miss')
+            return self._build_result(snap, *cached[:2], query, details=cached[2]) if cached else None
+
+        try:
+            # Encode query (unless the caller already batched it)
+            if query_embedding is None and mode != 'lexical':
+                query_embedding = self._encode(query)
             
             # Calculate cosine similarity
             # Cosine Similarity = (A . B) / (||A|| * ||B||)
             # Since embeddings from SentenceTransformer are normalized, ||A|| = ||B|| = 1
-            # So we just need the dot product
-            similarities = np.dot(self.embeddings_matrix, query_embedding)
+            # So the index just ranks by dot product
+            names, scores, details = self._ranked(snap, query, 1, mode, threshold, query_embedding)
             
-            # Find best match
-            best_idx = np.argmax(similarities)
-            best_score = similarities[best_idx]
-            
-            print(f"Query: '{query}' | Best match score: {best_score:.4f} | Image: {self.image_names[best_idx]}")
-            
-            if best_score < threshold:
-                print(f"Score {best_score:.4f} below threshold {threshold}, returning None")
+            if not names:
+                print(f"Query: '{query}' | No {mode} match above threshold {threshold}, returning None")
+                SEARCHES.inc(mode=mode, outcome='threshold_miss')
+                self.result_cache.set(cache_key, None)
                 return None
-                
-            best_image_name = self.image_names[best_idx]
-            meme_info = self.meme_map.get(best_image_name)
             
-            if meme_info:
-                return {
-                    "image_name": best_image_name,
-                    "score": float(best_score),
-                    "metadata": meme_info,
-                    "image_url": f"/images/{best_image_name}", # Serving path
-                    "explanation": f"This meme matches your vibe with a {int(best_score * 100)}% confidence. It is associated with tags like {', '.join(meme_info.get('tags', [])[:3])}, making it a great fit for '{query}'."
-                }
-            return None
+            print(f"Query: '{query}' | Best {mode} match score: {scores[0]:.4f} | Image: {names[0]}")
+            
+            result = self._build_result(snap, names[0], scores[0], query, details=details[0])
+            SEARCHES.inc(mode=mode, outcome='match')
+            self.result_cache.set(cache_key, (names[0], scores[0], details[0]) if result else None)
+            return result
         except Exception as e:
+            SEARCHES.inc(mode=mode, outcome='error')
             print(f"ERROR in semantic search: {str(e)}")
             import traceback
             traceback.print_exc()
             
             # Fallback: Keyword Search
             print("Falling back to keyword search...")
-            query_terms = query.lower().split()
-            best_match = None
-            max_matches = 0
-            
-            for image_name, meme in self.meme_map.items():
-                score = 0
-                # Check tags
-                for tag in meme.get('tags', []):
-                    if any(term in tag.lower() for term in query_terms):
-                        score += 2
-                
-                # Check category
-                if any(term in meme.get('category', '').lower() for term in query_terms):
-                    score += 3
-                    
-                # Check captions
-                for caption in meme.get('captions', []):
-                    if any(term in caption.lower() for term in query_terms):
-                        score += 1
-                        
-                if score > max_matches:
-                    max_matches = score
-                    best_match = image_name
+            ids, scores = snap.keyword_index.search(query, 1)
             
-            if best_match and max_matches > 0:
-                print(f"Keyword match found: {best_match} (Score: {max_matches})")
-                meme_info = self.meme_map[best_match]
-                return {
-                    "image_name": best_match,
-                    "score": 0.5, # Artificial score
-                    "metadata": meme_info,
-                    "image_url": f"/images/{best_match}",
-                    "explanation": f"Found based on keywords matching tags/captions."
-                }
+            if len(ids):
+                best_match = snap.keyword_index.image_names[ids[0]]
+                print(f"Keyword match found: {best_match} (Score: {scores[0]:.4f})")
+                return self._build_result(
+                    snap,
+                    best_match,
+                    0.5, # Artificial score
+                    query,
+                    explanation=KEYWORD_EXPLANATION
+                )
 
             # If keyword search also fails, return random
             print("Keyword search failed. Returning random meme.")
             import random
-            random_idx = random.randint(0, len(self.image_names) - 1)
-            random_image_name = self.image_names[random_idx]
-            random_meme_info = self.meme_map.get(random_image_name)
+            random_idx = random.randint(0, len(snap.image_names) - 1)
+            random_image_name = snap.image_names[random_idx]
+            random_meme_info = snap.meme_map.get(random_image_name)
             if random_meme_info:
                 return {
                     "image_name": random_image_name,
                     "score": 0.1,
                     "metadata": random_meme_info,
-                    "image_url": f"/images/{random_image_name}",
+                    **snap.image_urls(random_image_name),
                     "explanation": f"We couldn't find an exact match, but here is a meme from our vault!"
                 }
             return None
@@ -0,0 +1,241 @@
+import os
+import numpy as np
+
+IVF_INDEX_FILENAME = 'meme_index_ivf.npz'
+
+INDEX_KINDS = ('flat', 'ivf')
+
+# Cap on the (queries x N) score matrix of one batched flat scan: 32M float32 = 128 MB
+MAX_BATCH_SCORES = 32 * 1024 * 1024
+
+
+def top_k(scores, k):
+    # Indices of the k best scores, best first.
+    # argpartition is O(N) and only the selected slice gets sorted.
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
+    if k < len(scores):
+        top = np.argpartition(-scores, k - 1)[:k]
+    else:
+        top = np.arange(len(scores))
+    return top[np.argsort(-scores[top], kind='stable')]
+
+
+def top_k_rows(scores, k):
+    # top_k for every row of a 2-D score matrix, best first per row
+    k = min(k, scores.shape[1])
+    if k <= 0:
+        return np.empty((scores.shape[0], 0), dtype=np.intp)
+    if k < scores.shape[1]:
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        top = np.tile(np.arange(scores.shape[1]), (scores.shape[0], 1))
+    order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1, kind='stable')
+    return np.take_along_axis(top, order, axis=1)
+
+
+class FlatIndex:
+    """Exact brute-force scan: one matrix-vector product over every embedding."""
+
+    kind = 'flat'
+
+    def __init__(self, matrix):
+        self.matrix = matrix
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    def search(self, query_embedding, k):
+        similarities = np.dot(self.matrix, query_embedding)
+        ids = top_k(similarities, k)
+        return ids, similarities[ids]
+
+    def search_many(self, query_matrix, k, max_scores=MAX_BATCH_SCORES):
+        # One matrix-matrix product per block of queries instead of a matrix-vector
+        # product per query. Returns (ids, scores) lists with one array per query.
+        queries = np.asarray(query_matrix, dtype=np.float32)
+        block = max(1, max_scores // max(len(self), 1))
+        ids, scores = [], []
+        for start in range(0, len(queries), block):
+            similarities = np.dot(queries[start:start + block], self.matrix.T)
+            top = top_k_rows(similarities, k)
+            ids.extend(top)
+            scores.extend(np.take_along_axis(similarities, top, axis=1))
+        return ids, scores
+
+
+class IVFIndex:
+    """
+    Inverted-file index for large vaults.
+
+    Embeddings are clustered with spherical k-means into `nlist` lists. A query
+    only scans the `nprobe` lists whose centroids are closest to it, so the
+    cost is roughly nprobe / nlist of a flat scan. Raising nprobe trades
+    latency for recall; nprobe == nlist is an exact search.
+    """
+
+    kind = 'ivf'
+
+    def __init__(self, matrix, centroids, list_offsets, list_ids, nprobe=8):
+        self.matrix = matrix
+        self.centroids = centroids
+        self.list_offsets = list_offsets
+        self.list_ids = list_ids
+        self.nprobe = nprobe
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    @property
+    def nlist(self):
+        return self.centroids.shape[0]
+
+    @classmethod
+    def build(cls, matrix, nlist=None, iterations=20, sample_size=None, nprobe=8, seed=0):
+        matrix = np.asarray(matrix, dtype=np.float32)
+        n = matrix.shape[0]
+        if nlist is None:
+            nlist = max(1, int(4 * np.sqrt(n)))
+        nlist = min(nlist, n)
+
+        rng = np.random.default_rng(seed)
+        sample_size = sample_size or min(n, 256 * nlist)
+        sample = matrix[rng.choice(n, size=min(sample_size, n), replace=False)]
+
+        # Spherical k-means on a sample: centroids stay unit length so that
+        # the dot product ranks lists the same way it ranks embeddings.
+        centroids = sample[rng.choice(len(sample), size=nlist, replace=False)].copy()
+        for _ in range(iterations):
+            assignments = _assign(sample, centroids)
+            counts = np.bincount(assignments, minlength=nlist)
+            sums = np.zeros_like(centroids)
+            empty = counts == 0
+            starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+            grouped = sample[np.argsort(assignments, kind='stable')]
+            sums[~empty] = np.add.reduceat(grouped, starts[~empty], axis=0)
+            if empty.any():
+                # Reseed empty lists with random sample points
+                sums[empty] = sample[rng.choice(len(sample), size=int(empty.sum()))]
+            centroids = _normalize(sums)
+
+        assignments = _assign(matrix, centroids)
+        list_ids = np.argsort(assignments, kind='stable').astype(np.int64)
+        list_offsets = np.concatenate(([0], np.cumsum(np.bincount(assignments, minlength=nlist)))).astype(np.int64)
+        return cls(matrix, centroids, list_offsets, list_ids, nprobe=nprobe)
+
+    def search(self, query_embedding, k, nprobe=None):
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        probe = top_k(np.dot(self.centroids, query_embedding), nprobe)
+        candidates = np.concatenate([
+            self.list_ids[self.list_offsets[i]:self.list_offsets[i + 1]] for i in probe
+        ])
+        if len(candidates) == 0:
+            return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.float32)
+
+        candidates.sort()  # sequential reads from the (possibly memory-mapped) matrix
+        similarities = np.dot(self.matrix[candidates], query_embedding)
+        best = top_k(similarities, k)
+        return candidates[best], similarities[best]
+
+    def search_many(self, query_matrix, k, nprobe=None):
+        # Centroids are scored for all queries at once, and each probed list is
+        # read and scored once for every query that probes it.
+        queries = np.asarray(query_matrix, dtype=np.float32)
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        probes = top_k_rows(np.dot(queries, self.centroids.T), nprobe)
+
+        candidate_ids = [[] for _ in range(len(queries))]
+        candidate_scores = [[] for _ in range(len(queries))]
+        for list_no in np.unique(probes):
+            members = np.flatnonzero((probes == list_no).any(axis=1))
+            ids = self.list_ids[self.list_offsets[list_no]:self.list_offsets[list_no + 1]]  # ascending
+            if len(ids) == 0:
+                continue
+            similarities = np.dot(queries[members], np.asarray(self.matrix[ids], dtype=np.float32).T)
+            for row, q in enumerate(members):
+                candidate_ids[q].append(ids)
+                candidate_scores[q].append(similarities[row])
+
+        result_ids, result_scores = [], []
+        for ids, scores in zip(candidate_ids, candidate_scores):
+            if not ids:
+                result_ids.append(np.empty(0, dtype=np.intp))
+                result_scores.append(np.empty(0, dtype=np.float32))
+                continue
+            ids, scores = np.concatenate(ids), np.concatenate(scores)
+            best = top_k(scores, k)
+            result_ids.append(ids[best])
+            result_scores.append(scores[best])
+        return result_ids, result_scores
+
+    def extend(self, matrix):
+        # Index over `matrix`, whose first len(self) rows are the ones already indexed.
+        # New rows join their nearest existing list; centroids are kept as they are.
+        n = len(self)
+        assignments = np.repeat(np.arange(self.nlist), np.diff(self.list_offsets))
+        ids = np.concatenate([self.list_ids, np.arange(n, matrix.shape[0], dtype=np.int64)])
+        assignments = np.concatenate([assignments, _assign(matrix[n:], self.centroids)])
+        order = np.argsort(assignments, kind='stable')
+        list_offsets = np.concatenate(([0], np.cumsum(np.bincount(assignments, minlength=self.nlist)))).astype(np.int64)
+        return IVFIndex(matrix, self.centroids, list_offsets, ids[order], nprobe=self.nprobe)
+
+    def save(self, path):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(
+                f,
+                centroids=self.centroids,
+                list_offsets=self.list_offsets,
+                list_ids=self.list_ids,
+                count=np.int64(len(self)),
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, matrix, nprobe=8):
+        with np.load(path) as data:
+            if int(data['count']) != matrix.shape[0] or data['centroids'].shape[1] != matrix.shape[1]:
+                raise ValueError(f"IVF index at {path} does not match the embedding store, rebuild it")
+            return cls(matrix, data['centroids'], data['list_offsets'], data['list_ids'], nprobe=nprobe)
+
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return (vectors / norms).astype(np.float32)
+
+
+def _assign(vectors, centroids, chunk_size=65536):
+    # Nearest centroid per vector, chunked so large vaults don't allocate an N x nlist matrix at once
+    assignments = np.empty(vectors.shape[0], dtype=np.int64)
+    for start in range(0, vectors.shape[0], chunk_size):
+        block = np.asarray(vectors[start:start + chunk_size], dtype=np.float32)
+        assignments[start:start + chunk_size] = np.argmax(np.dot(block, centroids.T), axis=1)
+    return assignments
+
+
+def load_index(metadata_dir, matrix, kind=None, nprobe=None):
+    """
+    Open the configured index over `matrix`.
+
+    `kind` and `nprobe` default to the MEMEDOCK_INDEX and MEMEDOCK_IVF_NPROBE
+    environment variables. An IVF index is built offline by
+    scripts/generate_embeddings.py; if it is missing or stale we fall back to
+    the exact flat scan.
+    """
+    kind = kind or os.getenv('MEMEDOCK_INDEX', 'flat')
+    nprobe = nprobe or int(os.getenv('MEMEDOCK_IVF_NPROBE', '8'))
+
+    if kind == 'ivf':
+        path = os.path.join(metadata_dir, IVF_INDEX_FILENAME)
+        try:
+            index = IVFIndex.load(path, matrix, nprobe=nprobe)
+            print(f"Loaded IVF index ({index.nlist} lists, nprobe={index.nprobe}).")
+            return index
+        except (OSError, ValueError) as e:
+            print(f"Could not load IVF index, using flat scan: {e}")
+    elif kind != 'flat':
+        print(f"Unknown index kind '{kind}', using flat scan.")
+
+    return FlatIndex(matrix)
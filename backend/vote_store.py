@@ -0,0 +1,177 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from metrics import VOTES, VOTE_FLUSH_SECONDS
+
+VOTE_COLUMNS = {"upvote": 0, "downvote": 1}
+
+
+class VoteStore:
+    """
+    Vote counts in an embedded SQLite database (WAL mode).
+
+    A vote is an O(1) in-memory increment; a background thread flushes the
+    pending increments every `flush_interval` seconds in one transaction.
+    Flushes are additive upserts, so several uvicorn workers can share the
+    same database file without losing updates. Counts that are still pending
+    in this process are included in every read.
+    """
+
+    def __init__(self, db_path, flush_interval=0.5):
+        self.db_path = db_path
+        self.flush_interval = flush_interval
+        self.flushes = 0
+        self._local_version = 0
+        self._pending = defaultdict(lambda: [0, 0])
+        self._inflight = {}  # batch being committed, still counted by readers
+        self._pending_lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._conn = self._connect()
+        self._thread = self._start_flusher()
+        # gunicorn --preload forks workers from a process that already opened the store
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS votes ("
+            " image_name TEXT PRIMARY KEY,"
+            " upvotes INTEGER NOT NULL DEFAULT 0,"
+            " downvotes INTEGER NOT NULL DEFAULT 0)"
+        )
+        return conn
+
+    def _start_flusher(self):
+        thread = threading.Thread(target=self._run, name='vote-flush', daemon=True)
+        thread.start()
+        return thread
+
+    def _after_fork(self):
+        # A SQLite connection must not be used across fork and the flush thread
+        # doesn't exist in the child: the worker gets its own of both. Increments
+        # still pending in the parent are the parent's to flush.
+        if self._stop.is_set():
+            return
+        self._pending_lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._pending = defaultdict(lambda: [0, 0])
+        self._inflight = {}
+        self._conn = self._connect()
+        self._thread = self._start_flusher()
+
+    def seed(self, memes):
+        # Import counts that used to live in meme_metadata.json; existing rows win
+        rows = [
+            (m['image_name'], m.get('upvotes', 0), m.get('downvotes', 0))
+            for m in memes
+            if m.get('upvotes') or m.get('downvotes')
+        ]
+        with self._db_lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO votes (image_name, upvotes, downvotes) VALUES (?, ?, ?)", rows
+            )
+            self._conn.execute("COMMIT")
+
+    def record(self, image_name, vote_type):
+        if vote_type not in VOTE_COLUMNS:
+            raise ValueError(f"Unknown vote type '{vote_type}'")
+        with self._pending_lock:
+            self._pending[image_name][VOTE_COLUMNS[vote_type]] += 1
+            self._local_version += 1
+        VOTES.inc(vote_type=vote_type)
+        return self.get(image_name)
+
+    def version(self):
+        # Changes whenever any count may have changed: a vote in this process
+        # or a commit by another worker (SQLite's data_version)
+        with self._db_lock:
+            data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        return (data_version, self._local_version)
+
+    def _unflushed(self):
+        # Increments not yet visible in the database; call with _pending_lock held
+        yield from self._inflight.items()
+        yield from self._pending.items()
+
+    def get(self, image_name):
+        # The db lock is held across both reads so a concurrent flush can't be counted twice or missed
+        with self._db_lock:
+            row = self._conn.execute(
+                "SELECT upvotes, downvotes FROM votes WHERE image_name = ?", (image_name,)
+            ).fetchone()
+            upvotes, downvotes = row if row else (0, 0)
+            with self._pending_lock:
+                for name, (up, down) in self._unflushed():
+                    if name == image_name:
+                        upvotes += up
+                        downvotes += down
+        return {"upvotes": upvotes, "downvotes": downvotes}
+
+    def all_counts(self):
+        with self._db_lock:
+            rows = self._conn.execute("SELECT image_name, upvotes, downvotes FROM votes").fetchall()
+            counts = {name: {"upvotes": up, "downvotes": down} for name, up, down in rows}
+            with self._pending_lock:
+                for name, (up, down) in self._unflushed():
+                    entry = counts.setdefault(name, {"upvotes": 0, "downvotes": 0})
+                    entry["upvotes"] += up
+                    entry["downvotes"] += down
+        return counts
+
+    def flush(self):
+        with self._pending_lock:
+            if not self._pending:
+                return 0
+            self._inflight, self._pending = self._pending, defaultdict(lambda: [0, 0])
+
+        rows = [(name, up, down) for name, (up, down) in self._inflight.items()]
+        start = time.perf_counter()
+        with self._db_lock:
+            try:
+                self._conn.execute("BEGIN IMMEDIATE")
+                self._conn.executemany(
+                    "INSERT INTO votes (image_name, upvotes, downvotes) VALUES (?, ?, ?) "
+                    "ON CONFLICT(image_name) DO UPDATE SET "
+                    "upvotes = upvotes + excluded.upvotes, downvotes = downvotes + excluded.downvotes",
+                    rows
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                if self._conn.in_transaction:
+                    self._conn.execute("ROLLBACK")
+                VOTE_FLUSH_SECONDS.observe(time.perf_counter() - start, outcome='error')
+                # Put the increments back so the next flush retries them
+                with self._pending_lock:
+                    for name, up, down in rows:
+                        self._pending[name][0] += up
+                        self._pending[name][1] += down
+                    self._inflight = {}
+                raise
+            with self._pending_lock:
+                self._inflight = {}
+
+        VOTE_FLUSH_SECONDS.observe(time.perf_counter() - start, outcome='ok')
+        self.flushes += 1
+        return len(rows)
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Vote flush failed, will retry: {e}")
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+        self.flush()
+        with self._db_lock:
+            self._conn.close()
@@ -5,9 +5,11 @@ const API_BASE_URL = process.env.NEXT_PUBLIC_API_URL || 'http://127.0.0.1:8000';
 
 export const API_ENDPOINTS = {
     getMeme: (query: string) => `${API_BASE_URL}/get-meme?query=${encodeURIComponent(query)}`,
+    search: (query: string, k: number = 10, offset: number = 0) => `${API_BASE_URL}/search?query=${encodeURIComponent(query)}&k=${k}&offset=${offset}`,
     getAllMemes: () => `${API_BASE_URL}/get-all-memes`,
     vote: () => `${API_BASE_URL}/vote`,
     submitMeme: () => `${API_BASE_URL}/submit-meme`,
+    submissionStatus: (jobId: string) => `${API_BASE_URL}/submissions/${encodeURIComponent(jobId)}`,
     proxyImage: (url: string) => `${API_BASE_URL}/proxy-image?url=${encodeURIComponent(url)}`,
     imageUrl: (imageName: string) => `${API_BASE_URL}/images/${imageName}`,
     root: () => API_BASE_URL,
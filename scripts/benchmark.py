@@ -0,0 +1,457 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+backend_dir = os.path.join(base_dir, 'backend')
+sys.path.insert(0, backend_dir)
+
+from embedding_store import EmbeddingStore, FORMAT_VERSION, NAMES_FILENAME, VECTORS_FILENAME
+from vector_index import FlatIndex, IVFIndex
+
+WORDS = (
+    "cat dog code bug deploy friday monday coffee sleep exam teacher boss meeting "
+    "crying laughing stonks chad wojak drake distracted brain galaxy npc rizz cursed "
+    "wholesome panik kalm surprised pikachu this is fine uno reverse gaming pizza"
+).split()
+
+# Metrics where a larger value is better; everything else (times, latencies) is lower-is-better
+HIGHER_IS_BETTER = ('rps', 'recall')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark index loading, search latency and /get-meme throughput.")
+    parser.add_argument('--suite', choices=['index', 'http', 'all'], default='all')
+    parser.add_argument('--output', default='benchmark_results.json',
+                        help="Where to write the machine-readable results")
+    parser.add_argument('--compare', help="Earlier results file to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.10,
+                        help="Relative change that counts as a regression in --compare")
+
+    index = parser.add_argument_group('index suite (synthetic vaults)')
+    index.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    index.add_argument('--dim', type=int, default=384)
+    index.add_argument('--dtype', choices=['float32', 'float16'], default='float32')
+    index.add_argument('--queries', type=int, default=200, help="Queries timed per index")
+    index.add_argument('--k', type=int, default=10)
+    index.add_argument('--nlist', type=int, default=None, help="IVF lists (default 4*sqrt(N))")
+    index.add_argument('--nprobe', type=int, nargs='+', default=[8, 32])
+    index.add_argument('--ivf-sample-size', type=int, default=100_000,
+                       help="Vectors the IVF k-means is trained on (the build default uses up to 256 per list)")
+    index.add_argument('--ivf-iterations', type=int, default=10)
+    index.add_argument('--skip-snapshot', action='store_true',
+                       help="Only time the vectors, not a full SearchSnapshot load (metadata + BM25 take "
+                            "several GB of RAM at 1M memes)")
+
+    http = parser.add_argument_group('http suite (/get-meme load test)')
+    http.add_argument('--url', help="Benchmark an already running server instead of starting one")
+    http.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16, 64])
+    http.add_argument('--requests', type=int, default=200, help="Requests per concurrency level")
+    http.add_argument('--fallback-ratio', type=float, default=0.2,
+                      help="Share of queries with no vault match, served by the stubbed external fallback")
+    http.add_argument('--stub-delay-ms', type=float, default=50,
+                      help="Latency of the stubbed Reddit/Imgflip endpoints")
+    http.add_argument('--unique-queries', action='store_true',
+                      help="Make every query unique so the server's caches never hit")
+    return parser.parse_args()
+
+
+def percentiles(samples_ms):
+    samples = np.asarray(samples_ms, dtype=np.float64)
+    if len(samples) == 0:
+        return {}
+    return {
+        "p50_ms": round(float(np.percentile(samples, 50)), 3),
+        "p90_ms": round(float(np.percentile(samples, 90)), 3),
+        "p99_ms": round(float(np.percentile(samples, 99)), 3),
+        "mean_ms": round(float(samples.mean()), 3),
+        "max_ms": round(float(samples.max()), 3)
+    }
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=base_dir, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+        "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S'),
+        "commit": commit or None,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count()
+    }
+
+
+# ---------------------------------------------------------------- index suite
+
+def write_synthetic_vault(directory, n, dim, dtype, with_metadata=True, seed=0, chunk_size=65536):
+    """
+    A clustered, unit-length embedding store plus matching metadata.
+
+    Vectors are written chunk by chunk into the .npy file so a 1M x 384 vault
+    never needs a second in-memory copy.
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((max(1, n // 500), dim)).astype(np.float32)
+    vectors = np.lib.format.open_memmap(os.path.join(directory, VECTORS_FILENAME), mode='w+', dtype=dtype, shape=(n, dim))
+    for start in range(0, n, chunk_size):
+        count = min(chunk_size, n - start)
+        chunk = centers[rng.integers(0, len(centers), count)] + 0.5 * rng.standard_normal((count, dim)).astype(np.float32)
+        chunk /= np.linalg.norm(chunk, axis=1, keepdims=True)
+        vectors[start:start + count] = chunk
+    vectors.flush()
+    del vectors
+
+    image_names = [f"synthetic_{i:07d}.jpg" for i in range(n)]
+    with open(os.path.join(directory, NAMES_FILENAME), 'w') as f:
+        json.dump({
+            "format_version": FORMAT_VERSION,
+            "dtype": dtype,
+            "dim": dim,
+            "count": n,
+            "image_names": image_names
+        }, f)
+
+    if not with_metadata:
+        return
+    with open(os.path.join(directory, 'meme_metadata.json'), 'w') as f:
+        json.dump({"memes": [
+            {
+                "image_name": name,
+                "category": random.choice(WORDS),
+                "tags": random.sample(WORDS, 4),
+                "prompt": " ".join(random.sample(WORDS, 6)),
+                "captions": [" ".join(random.sample(WORDS, 5))]
+            }
+            for name in image_names
+        ]}, f)
+
+
+def time_searches(index, queries, k, **kwargs):
+    latencies = []
+    results = []
+    for q in queries:
+        start = time.perf_counter()
+        ids, _ = index.search(q, k, **kwargs)
+        latencies.append((time.perf_counter() - start) * 1000)
+        results.append(ids)
+    return latencies, results
+
+
+def bench_index(args):
+    results = []
+    for n in args.sizes:
+        directory = tempfile.mkdtemp(prefix=f'memedock_bench_{n}_')
+        try:
+            print(f"\n== Synthetic vault: {n} x {args.dim} {args.dtype} ==")
+            start = time.perf_counter()
+            write_synthetic_vault(directory, n, args.dim, args.dtype, with_metadata=not args.skip_snapshot)
+            entry = {"size": n, "dim": args.dim, "dtype": args.dtype, "generate_s": round(time.perf_counter() - start, 3)}
+
+            start = time.perf_counter()
+            _, matrix = EmbeddingStore(directory).load(mmap=True)
+            entry["store_load_s"] = round(time.perf_counter() - start, 4)
+
+            if not args.skip_snapshot:
+                from search_engine import SearchSnapshot
+                start = time.perf_counter()
+                SearchSnapshot(directory)
+                entry["snapshot_load_s"] = round(time.perf_counter() - start, 3)
+
+            rng = np.random.default_rng(1)
+            rows = rng.integers(0, n, args.queries)
+            queries = np.asarray(matrix[np.sort(rows)], dtype=np.float32) + 0.1 * rng.standard_normal((args.queries, args.dim)).astype(np.float32)
+            queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+            flat = FlatIndex(matrix)
+            time_searches(flat, queries[:5], args.k)  # page the matrix in
+            latencies, exact = time_searches(flat, queries, args.k)
+            entry["flat"] = percentiles(latencies)
+            print(f"store load {entry['store_load_s']}s | flat p50 {entry['flat']['p50_ms']}ms p99 {entry['flat']['p99_ms']}ms")
+
+            # The same queries as one /batch-search: a matrix-matrix product instead of a scan each
+            start = time.perf_counter()
+            flat.search_many(queries, args.k)
+            batch_ms = (time.perf_counter() - start) * 1000
+            entry["flat_batch"] = {"batch_ms": round(batch_ms, 3), "per_query_ms": round(batch_ms / len(queries), 4)}
+            print(f"flat batch of {len(queries)}: {batch_ms:.1f}ms ({batch_ms / len(queries):.3f}ms per query)")
+
+            start = time.perf_counter()
+            ivf = IVFIndex.build(matrix, nlist=args.nlist, iterations=args.ivf_iterations, sample_size=args.ivf_sample_size)
+            entry["ivf_build_s"] = round(time.perf_counter() - start, 3)
+            entry["ivf_nlist"] = ivf.nlist
+            for nprobe in args.nprobe:
+                latencies, approx = time_searches(ivf, queries, args.k, nprobe=nprobe)
+                recall = np.mean([len(np.intersect1d(a, e)) / len(e) for a, e in zip(approx, exact)])
+                entry[f"ivf_nprobe{nprobe}"] = {**percentiles(latencies), "recall": round(float(recall), 4)}
+                print(f"ivf nprobe={nprobe}: p50 {entry[f'ivf_nprobe{nprobe}']['p50_ms']}ms recall@{args.k} {recall:.3f}")
+            results.append(entry)
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+
+# ----------------------------------------------------------------- http suite
+
+def stub_app(delay):
+    # Stand-in for Reddit and Imgflip so fallback latency is controlled and nothing leaves the machine
+    from fastapi import FastAPI
+    app = FastAPI()
+
+    @app.get("/r/{sub}/search.json")
+    async def reddit_search(sub: str, q: str = ""):
+        await asyncio.sleep(delay)
+        return {"data": {"children": [
+            {"data": {"url": f"https://i.example.com/{sub}_{i}.jpg", "title": f"{q} {sub} {i}", "score": 100 - i}}
+            for i in range(10)
+        ]}}
+
+    @app.get("/get_memes")
+    async def imgflip():
+        await asyncio.sleep(delay)
+        return {"success": True, "data": {"memes": [
+            {"id": str(i), "name": " ".join(random.Random(i).sample(WORDS, 3)), "url": f"https://i.example.com/t{i}.jpg"}
+            for i in range(100)
+        ]}}
+
+    return app
+
+
+def start_stub(delay):
+    import uvicorn
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(stub_app(delay), host='127.0.0.1', port=port, log_level='warning'))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, thread, f"http://127.0.0.1:{port}"
+
+
+def prepare_app_dir(work_dir):
+    # A copy of the backend code and vault: the server writes its Imgflip catalogue (built
+    # from the stub's fake templates), pending uploads and caches here, never into backend/
+    app_dir = os.path.join(work_dir, 'app')
+    metadata_dir = os.path.join(app_dir, 'metadata')
+    os.makedirs(metadata_dir)
+    for name in os.listdir(backend_dir):
+        if name.endswith('.py'):
+            shutil.copy(os.path.join(backend_dir, name), app_dir)
+    source_metadata = os.path.join(backend_dir, 'metadata')
+    for name in os.listdir(source_metadata):
+        if not name.startswith(('imgflip_catalog.', 'votes.db')):
+            shutil.copy(os.path.join(source_metadata, name), metadata_dir)
+    os.symlink(os.path.join(backend_dir, 'images'), os.path.join(app_dir, 'images'))
+    return app_dir
+
+
+def start_server(stub_url, work_dir):
+    app_dir = prepare_app_dir(work_dir)
+    port = free_port()
+    env = {
+        **os.environ,
+        "MEMEDOCK_EAGER_WARMUP": "1",
+        "REDDIT_BASE_URL": stub_url,
+        "IMGFLIP_API_URL": f"{stub_url}/get_memes",
+        "MEMEDOCK_VOTES_DB": os.path.join(work_dir, 'votes.db'),
+        "MEMEDOCK_SUBMISSIONS_DB": os.path.join(work_dir, 'submissions.db'),
+        "MEMEDOCK_PROXY_CACHE_DIR": os.path.join(work_dir, 'proxy_cache'),
+    }
+    # Force the JSON endpoints so the stub serves Reddit too
+    env.pop('REDDIT_CLIENT_ID', None)
+    env.pop('REDDIT_CLIENT_SECRET', None)
+    log = open(os.path.join(work_dir, 'server.log'), 'w')
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'main:app', '--app-dir', app_dir,
+         '--host', '127.0.0.1', '--port', str(port), '--log-level', 'warning'],
+        env=env, stdout=log, stderr=subprocess.STDOUT
+    )
+    return process, f"http://127.0.0.1:{port}"
+
+
+async def wait_ready(client, url, process=None, timeout=300):
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {process.returncode}")
+        try:
+            if (await client.get(f"{url}/ready")).status_code == 200:
+                return time.perf_counter() - start
+        except Exception:
+            pass
+        await asyncio.sleep(0.2)
+    raise TimeoutError(f"{url} was not ready after {timeout}s")
+
+
+def make_queries(count, fallback_ratio, unique):
+    with open(os.path.join(backend_dir, 'metadata', 'meme_metadata.json'), 'r') as f:
+        memes = json.load(f)['memes']
+    vault_queries = [q for m in memes for q in m.get('captions', []) + [" ".join(m.get('tags', []))] if q]
+    rng = random.Random(0)
+    queries = []
+    for i in range(count):
+        if rng.random() < fallback_ratio:
+            # Letters only, so nothing in the vault clears the similarity threshold
+            query = "".join(rng.choice('bcdfghjklmnpqrstvwxz') for _ in range(12))
+            kind = 'fallback'
+        else:
+            query = rng.choice(vault_queries)
+            kind = 'vault'
+        queries.append((f"{query} {i}" if unique else query, kind))
+    return queries
+
+
+async def load_level(client, url, queries, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    samples = {'vault': [], 'fallback': []}
+    statuses = {}
+    fallback_served = 0
+
+    async def one(query, kind):
+        nonlocal fallback_served
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                response = await client.get(f"{url}/get-meme", params={"query": query})
+                status = response.status_code
+                if status == 200 and response.json().get('fallback'):
+                    fallback_served += 1
+            except Exception as e:
+                status = type(e).__name__
+            samples[kind].append((time.perf_counter() - start) * 1000)
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(query, kind) for query, kind in queries))
+    wall = time.perf_counter() - start
+    return {
+        "concurrency": concurrency,
+        "requests": len(queries),
+        "rps": round(len(queries) / wall, 2),
+        "errors": sum(count for status, count in statuses.items() if status != '200'),
+        "statuses": statuses,
+        "fallback_served": fallback_served,
+        "all": percentiles(samples['vault'] + samples['fallback']),
+        "vault": percentiles(samples['vault']),
+        "fallback": percentiles(samples['fallback'])
+    }
+
+
+async def bench_http_async(args, url, process=None):
+    import httpx
+    limits = httpx.Limits(max_connections=max(args.concurrency), max_keepalive_connections=max(args.concurrency))
+    async with httpx.AsyncClient(timeout=60, limits=limits) as client:
+        ready_s = await wait_ready(client, url, process)
+        print(f"Server ready after {ready_s:.2f}s")
+        # Warm the connection pool, model and catalogue before timing anything
+        await load_level(client, url, make_queries(20, args.fallback_ratio, True), 4)
+
+        levels = []
+        for concurrency in args.concurrency:
+            queries = make_queries(args.requests, args.fallback_ratio, args.unique_queries)
+            level = await load_level(client, url, queries, concurrency)
+            print(f"c={concurrency}: {level['rps']} req/s | p50 {level['all'].get('p50_ms')}ms "
+                  f"p99 {level['all'].get('p99_ms')}ms | errors {level['errors']} | fallback {level['fallback_served']}")
+            levels.append(level)
+        return {"server_ready_s": round(ready_s, 3), "levels": levels}
+
+
+def bench_http(args):
+    if args.url:
+        print(f"\n== Load test against {args.url} ==")
+        return {"url": args.url, **asyncio.run(bench_http_async(args, args.url.rstrip('/')))}
+
+    work_dir = tempfile.mkdtemp(prefix='memedock_bench_http_')
+    stub, stub_thread, stub_url = start_stub(args.stub_delay_ms / 1000)
+    process, url = start_server(stub_url, work_dir)
+    print(f"\n== Load test: local server {url}, stubbed fallback at {stub_url} ({args.stub_delay_ms}ms) ==")
+    try:
+        result = asyncio.run(bench_http_async(args, url, process))
+        return {"stub_delay_ms": args.stub_delay_ms, "fallback_ratio": args.fallback_ratio, **result}
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+        stub.should_exit = True
+        stub_thread.join(timeout=10)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+# ------------------------------------------------------------------- compare
+
+def flatten(results, prefix=''):
+    # {"index.100000.flat.p50_ms": 1.2, ...} for every numeric leaf
+    flat = {}
+    if isinstance(results, dict):
+        items = results.items()
+    elif isinstance(results, list):
+        # Lists of runs are keyed by their size / concurrency so reordering doesn't matter
+        items = ((str(r.get('size', r.get('concurrency', i))), r) for i, r in enumerate(results))
+    else:
+        return {prefix[:-1]: results} if isinstance(results, (int, float)) and not isinstance(results, bool) else {}
+    for key, value in items:
+        if key in ('environment', 'args', 'statuses', 'generate_s'):
+            continue
+        flat.update(flatten(value, f"{prefix}{key}."))
+    return flat
+
+
+def compare(current, previous, tolerance):
+    now, before = flatten(current), flatten(previous)
+    regressions = []
+    for key in sorted(set(now) & set(before)):
+        if not (key.endswith(('_ms', '_s')) or key.endswith(HIGHER_IS_BETTER)) or before[key] == 0:
+            continue
+        change = (now[key] - before[key]) / abs(before[key])
+        worse = change < -tolerance if key.endswith(HIGHER_IS_BETTER) else change > tolerance
+        better = change > tolerance if key.endswith(HIGHER_IS_BETTER) else change < -tolerance
+        if worse or better:
+            print(f"{'REGRESSION' if worse else 'improved  '} {key}: {before[key]} -> {now[key]} ({change:+.1%})")
+        if worse:
+            regressions.append(key)
+    return regressions
+
+
+def main():
+    args = parse_args()
+    results = {"environment": environment(), "args": vars(args)}
+
+    if args.suite in ('index', 'all'):
+        results["index"] = bench_index(args)
+    if args.suite in ('http', 'all'):
+        results["http"] = bench_http(args)
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to {args.output}.")
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            previous = json.load(f)
+        print(f"\n== Compared with {args.compare} (tolerance {args.tolerance:.0%}) ==")
+        regressions = compare(results, previous, args.tolerance)
+        print(f"{len(regressions)} regressions.")
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
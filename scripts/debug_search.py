@@ -1,49 +1,57 @@
+import argparse
 import json
 import os
-import numpy as np
-from sentence_transformers import SentenceTransformer
+import sys
+import time
+
+base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(base_dir, 'backend'))
+
+from embedding_store import EmbeddingStore
+from vector_index import FlatIndex
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run one query against the embedding store and show the top matches.")
+    parser.add_argument('query', nargs='?', default="When the code compiles but the output is cursed")
+    parser.add_argument('--metadata-dir', default=os.path.join(base_dir, 'metadata'))
+    parser.add_argument('-k', type=int, default=5)
+    return parser.parse_args()
+
 
 def main():
-    base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    metadata_path = os.path.join(base_dir, 'metadata', 'meme_metadata.json')
-    embeddings_path = os.path.join(base_dir, 'metadata', 'meme_embeddings.json')
+    args = parse_args()
+    metadata_path = os.path.join(args.metadata_dir, 'meme_metadata.json')
 
     # Load metadata
     with open(metadata_path, 'r') as f:
         metadata = json.load(f)['memes']
-    
-    # Load embeddings
-    with open(embeddings_path, 'r') as f:
-        embeddings_data = json.load(f)
-        
+
+    # Load embeddings (memory-mapped binary store, imported from JSON if needed)
+    start = time.perf_counter()
+    image_names, matrix = EmbeddingStore(args.metadata_dir).load_or_import()
+    load_ms = (time.perf_counter() - start) * 1000
+
     print(f"Metadata count: {len(metadata)}")
-    print(f"Embeddings count: {len(embeddings_data)}")
-    
+    print(f"Embeddings count: {len(image_names)} ({matrix.dtype}, loaded in {load_ms:.1f}ms)")
+
     # Check if captions are in metadata
     first_meme = metadata[0]
     print(f"First meme captions: {first_meme.get('captions')}")
-    
+
     # Load model
-    model = SentenceTransformer('all-MiniLM-L6-v2')
-    
-    # Test query
-    query = "When the code compiles but the output is cursed"
-    query_embedding = model.encode(query)
-    
-    # Find best match manually
-    best_score = -1
-    best_name = ""
-    
-    for item in embeddings_data:
-        embedding = np.array(item['embedding'])
-        score = np.dot(embedding, query_embedding)
-        if score > best_score:
-            best_score = score
-            best_name = item['image_name']
-            
-    print(f"Query: '{query}'")
-    print(f"Best match: {best_name}")
-    print(f"Score: {best_score}")
+    from encoder import Encoder
+    encoder = Encoder()
+    query_embedding = encoder.encode_query(args.query)
+
+    # One matrix-vector product over the whole store, same as the server's flat index
+    start = time.perf_counter()
+    ids, scores = FlatIndex(matrix).search(query_embedding, args.k)
+    search_ms = (time.perf_counter() - start) * 1000
+
+    print(f"Query: '{args.query}' ({search_ms:.2f}ms)")
+    for rank, (i, score) in enumerate(zip(ids, scores), start=1):
+        print(f"{rank}. {image_names[i]}  score={score:.4f}")
 
 if __name__ == "__main__":
     main()
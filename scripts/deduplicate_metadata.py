@@ -1,10 +1,56 @@
+import argparse
 import json
 import os
+import sys
+import time
+
+import numpy as np
+
+base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(base_dir, 'backend'))
+
+from dedup import HASH_DISTANCE, TEXT_SIMILARITY, clusters, hash_images, hash_pairs, load_hashes, save_hashes, similarity_pairs
+from embedding_store import EmbeddingStore
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Remove duplicate memes and find near-duplicates in the vault.")
+    # The served vault: DuplicateChecker reads image_hashes.json from there
+    parser.add_argument('--metadata-dir', default=os.path.join(base_dir, 'backend', 'metadata'),
+                        help="Directory holding meme_metadata.json, the embedding store and image_hashes.json")
+    parser.add_argument('--images-dir', default=os.path.join(base_dir, 'backend', 'images'),
+                        help="Directory with the meme image files")
+    parser.add_argument('--hash-distance', type=int, default=HASH_DISTANCE,
+                        help="Max differing dHash bits for two files to count as the same image")
+    parser.add_argument('--similarity', type=float, default=TEXT_SIMILARITY,
+                        help="Min embedding cosine for two memes to count as saying the same thing")
+    parser.add_argument('--block-size', type=int, default=2048,
+                        help="Rows per block in the pairwise comparisons (bounds memory)")
+    parser.add_argument('--merge', action='store_true',
+                        help="Merge same-image clusters into their first meme (tags/captions are combined)")
+    parser.add_argument('--merge-text', action='store_true',
+                        help="Also merge clusters that only match on text similarity")
+    parser.add_argument('--report', help="Write the near-duplicate clusters to this JSON file")
+    return parser.parse_args()
+
+
+def unique(values):
+    return list(dict.fromkeys(values))
+
+
+def merge_cluster(memes, members):
+    # The first meme keeps its place and absorbs the others' tags and captions
+    keeper = dict(memes[members[0]])
+    for i in members[1:]:
+        keeper['tags'] = unique(keeper.get('tags', []) + memes[i].get('tags', []))
+        keeper['captions'] = unique(keeper.get('captions', []) + memes[i].get('captions', []))
+    keeper['aliases'] = unique(keeper.get('aliases', []) + [memes[i]['image_name'] for i in members[1:]])
+    return keeper
+
 
 def main():
-    # Paths
-    base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    metadata_path = os.path.join(base_dir, 'metadata', 'meme_metadata.json')
+    args = parse_args()
+    metadata_path = os.path.join(args.metadata_dir, 'meme_metadata.json')
 
     # Load metadata
     with open(metadata_path, 'r') as f:
@@ -12,18 +58,78 @@ def main():
 
     memes = data['memes']
     unique_memes = {}
-    
+
     # Keep the first occurrence of each image_name
     for meme in memes:
         image_name = meme['image_name']
         if image_name not in unique_memes:
             unique_memes[image_name] = meme
-    
+
     cleaned_memes = list(unique_memes.values())
-    
+
     print(f"Original count: {len(memes)}")
     print(f"Cleaned count: {len(cleaned_memes)}")
 
+    names = [m['image_name'] for m in cleaned_memes]
+    position = {name: i for i, name in enumerate(names)}
+    rows, cols, kinds = [], [], []
+
+    # Same picture under different names: perceptual hashes of the image files
+    start = time.perf_counter()
+    hashes = hash_images(args.images_dir, names, known=load_hashes(args.metadata_dir))
+    save_hashes(args.metadata_dir, hashes)
+    hashed = list(hashes)
+    i, j, distances = hash_pairs([int(hashes[n]['dhash'], 16) for n in hashed], args.hash_distance, args.block_size)
+    rows += [position[hashed[a]] for a in i]
+    cols += [position[hashed[b]] for b in j]
+    kinds += ['image'] * len(i)
+    print(f"Hashed {len(hashed)} images, {len(i)} same-image pairs ({time.perf_counter() - start:.2f}s).")
+
+    # Same meaning: blocked cosine similarity over the embedding store
+    store = EmbeddingStore(args.metadata_dir)
+    if store.exists():
+        start = time.perf_counter()
+        image_names, matrix = store.load(mmap=True)
+        i, j, similarities = similarity_pairs(matrix, args.similarity, args.block_size)
+        pairs = [(image_names[a], image_names[b]) for a, b in zip(i, j)]
+        pairs = [(a, b) for a, b in pairs if a in position and b in position]
+        rows += [position[a] for a, _ in pairs]
+        cols += [position[b] for _, b in pairs]
+        kinds += ['text'] * len(pairs)
+        print(f"Compared {len(image_names)} embeddings, {len(pairs)} similar-text pairs ({time.perf_counter() - start:.2f}s).")
+    else:
+        print(f"No embedding store in {args.metadata_dir}, skipping text similarity.")
+
+    rows, cols, kinds = np.array(rows, dtype=np.int64), np.array(cols, dtype=np.int64), np.array(kinds)
+    found = clusters(len(cleaned_memes), rows, cols)
+    image_only = clusters(len(cleaned_memes), rows[kinds == 'image'], cols[kinds == 'image'])
+    print(f"Near-duplicate clusters: {len(found)} ({len(image_only)} of the same image).")
+    for members in found:
+        print(f"  {', '.join(names[m] for m in members)}")
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump({
+                "clusters": [[names[m] for m in members] for members in found],
+                "image_clusters": [[names[m] for m in members] for members in image_only]
+            }, f, indent=2)
+        print(f"Report written to {args.report}.")
+
+    if args.merge or args.merge_text:
+        to_merge = found if args.merge_text else image_only
+        removed = set()
+        for members in to_merge:
+            cleaned_memes[members[0]] = merge_cluster(cleaned_memes, members)
+            removed.update(members[1:])
+        cleaned_memes = [m for i, m in enumerate(cleaned_memes) if i not in removed]
+        print(f"Merged {len(removed)} memes into {len(to_merge)} clusters, {len(cleaned_memes)} remain.")
+        if removed:
+            print(f"Run python scripts/generate_embeddings.py --metadata-dir {args.metadata_dir} "
+                  f"to drop their vectors (only merged memes are re-embedded).")
+
+    if len(cleaned_memes) == len(memes):
+        return
+
     # Save cleaned metadata
     with open(metadata_path, 'w') as f:
         json.dump({"memes": cleaned_memes}, f, indent=2)
@@ -0,0 +1,140 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(base_dir, 'backend'))
+
+from embedding_store import EmbeddingStore, meme_text
+from encoder import MODEL_NAME
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Export all-MiniLM-L6-v2 to a dynamically quantized (int8) ONNX model and check it against the vault."
+    )
+    parser.add_argument('--model', default=f"sentence-transformers/{MODEL_NAME}")
+    parser.add_argument('--output-dir', default=os.path.join(base_dir, 'backend', 'models', f'{MODEL_NAME}-onnx'),
+                        help="Where model_int8.onnx and tokenizer.json are written (MEMEDOCK_ONNX_MODEL_DIR)")
+    parser.add_argument('--opset', type=int, default=17)
+    parser.add_argument('--keep-fp32', action='store_true', help="Keep the unquantized model.onnx next to the int8 one")
+    parser.add_argument('--check-only', action='store_true', help="Skip the export, only run the parity check")
+    parser.add_argument('--metadata-dir', default=os.path.join(base_dir, 'metadata'),
+                        help="Vault whose stored (torch) embeddings the export is checked against")
+    parser.add_argument('--min-cosine', type=float, default=0.98,
+                        help="Fail if the mean cosine to the stored embeddings is below this")
+    parser.add_argument('--threads', type=int, default=None, help="onnxruntime intra-op threads for the check")
+    return parser.parse_args()
+
+
+def export(args):
+    # Needs torch and transformers, but only here: serving the result needs neither
+    import torch
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    from transformers import AutoModel, AutoTokenizer
+    from onnx_encoder import ONNX_MODEL_FILENAME
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(args.model)
+    model = AutoModel.from_pretrained(args.model)
+    model.eval()
+
+    fp32_path = os.path.join(args.output_dir, 'model.onnx')
+    int8_path = os.path.join(args.output_dir, ONNX_MODEL_FILENAME)
+    sample = tokenizer(["export the meme encoder"], return_tensors='pt')
+    inputs = ('input_ids', 'attention_mask', 'token_type_ids')
+
+    print(f"Exporting {args.model} to {fp32_path} (opset {args.opset})...")
+    start = time.perf_counter()
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            tuple(sample[name] for name in inputs),
+            fp32_path,
+            input_names=list(inputs),
+            output_names=['last_hidden_state'],
+            dynamic_axes={name: {0: 'batch', 1: 'sequence'} for name in inputs + ('last_hidden_state',)},
+            opset_version=args.opset,
+            dynamo=False
+        )
+
+    print(f"Quantizing weights to int8 -> {int8_path}...")
+    quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+    tokenizer.save_pretrained(args.output_dir)  # writes tokenizer.json for the tokenizers library
+    print(f"Exported in {time.perf_counter() - start:.1f}s: fp32 {os.path.getsize(fp32_path) / 1e6:.1f} MB, "
+          f"int8 {os.path.getsize(int8_path) / 1e6:.1f} MB.")
+
+    if not args.keep_fp32:
+        os.remove(fp32_path)
+    # The server only reads the int8 model and tokenizer.json
+    for name in ('tokenizer_config.json', 'special_tokens_map.json', 'vocab.txt'):
+        path = os.path.join(args.output_dir, name)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def parity_check(args):
+    """
+    Re-embed every vault meme with the ONNX model and compare to the stored
+    embeddings, which generate_embeddings.py produced with torch. Reports the
+    cosine distribution, how often a meme's ONNX vector still finds its own
+    stored vector first, and single-query encode latency.
+    """
+    from onnx_encoder import OnnxEncoder
+
+    with open(os.path.join(args.metadata_dir, 'meme_metadata.json'), 'r') as f:
+        meme_map = {m['image_name']: m for m in json.load(f)['memes']}
+    image_names, matrix = EmbeddingStore(args.metadata_dir).load(mmap=True)
+    rows = [i for i, name in enumerate(image_names) if name in meme_map and meme_text(meme_map[name])]
+    texts = [meme_text(meme_map[image_names[i]]) for i in rows]
+    stored = np.asarray(matrix[rows], dtype=np.float32)
+
+    start = time.perf_counter()
+    encoder = OnnxEncoder(args.output_dir, threads=args.threads)
+    load_s = time.perf_counter() - start
+    encoded = encoder.encode(texts, batch_size=64)
+
+    cosine = np.sum(encoded * stored, axis=1)
+    self_top1 = np.mean(np.argmax(encoded @ stored.T, axis=1) == np.arange(len(rows)))
+
+    latencies = []
+    for text in texts[:200]:
+        start = time.perf_counter()
+        encoder.encode(text)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    report = {
+        "memes": len(rows),
+        "load_s": round(load_s, 3),
+        "cosine_mean": round(float(cosine.mean()), 5),
+        "cosine_min": round(float(cosine.min()), 5),
+        "cosine_p1": round(float(np.percentile(cosine, 1)), 5),
+        "self_top1": round(float(self_top1), 4),
+        "encode_p50_ms": round(float(np.percentile(latencies, 50)), 3),
+        "encode_p99_ms": round(float(np.percentile(latencies, 99)), 3)
+    }
+    print(json.dumps(report, indent=2))
+    worst = np.argsort(cosine)[:3]
+    for i in worst:
+        print(f"  lowest: {image_names[rows[i]]} cosine={cosine[i]:.4f}")
+    return report
+
+
+def main():
+    args = parse_args()
+    if not args.check_only:
+        export(args)
+
+    report = parity_check(args)
+    if report["cosine_mean"] < args.min_cosine:
+        print(f"Parity check FAILED: mean cosine {report['cosine_mean']} < {args.min_cosine}")
+        sys.exit(1)
+    print(f"Parity check passed. Serve it with MEMEDOCK_ENCODER_BACKEND=onnx"
+          f" MEMEDOCK_ONNX_MODEL_DIR={args.output_dir}")
+
+if __name__ == "__main__":
+    main()
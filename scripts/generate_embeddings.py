@@ -1,47 +1,146 @@
+import argparse
 import json
 import os
-from sentence_transformers import SentenceTransformer
+import sys
+import time
+
+import numpy as np
+
+base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(base_dir, 'backend'))
+
+from embedding_store import EmbeddingStore, SUPPORTED_DTYPES, meme_text, text_hash
+from vector_index import IVFIndex, IVF_INDEX_FILENAME, INDEX_KINDS
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Generate the binary meme embedding store.")
+    # The served vault, which the backend's hot reload watches
+    parser.add_argument('--metadata-dir', default=os.path.join(base_dir, 'backend', 'metadata'),
+                        help="Directory holding meme_metadata.json and the embedding store")
+    parser.add_argument('--dtype', choices=SUPPORTED_DTYPES, default='float32',
+                        help="Storage precision for the vectors (float16 halves the file size)")
+    parser.add_argument('--import-json', action='store_true',
+                        help="Convert an existing meme_embeddings.json instead of re-encoding")
+    parser.add_argument('--export-json', action='store_true',
+                        help="Also write meme_embeddings.json for tools that still read it")
+    parser.add_argument('--full', action='store_true',
+                        help="Re-embed every meme instead of only new or changed ones")
+    parser.add_argument('--batch-size', type=int, default=256,
+                        help="Texts per model.encode call")
+    parser.add_argument('--index', choices=INDEX_KINDS, default='flat',
+                        help="Also build an ANN index (serve it with MEMEDOCK_INDEX=ivf)")
+    parser.add_argument('--nlist', type=int, default=None,
+                        help="IVF list count (default 4*sqrt(N)); more lists means faster, lower-recall probes")
+    parser.add_argument('--iterations', type=int, default=20,
+                        help="k-means iterations when training the IVF index")
+    return parser.parse_args()
+
+
+def build_index(args, store):
+    if args.index != 'ivf':
+        return
+
+    _, matrix = store.load(mmap=True)
+    print(f"Building IVF index over {matrix.shape[0]} embeddings...")
+    index = IVFIndex.build(matrix, nlist=args.nlist, iterations=args.iterations)
+    index_path = os.path.join(args.metadata_dir, IVF_INDEX_FILENAME)
+    index.save(index_path)
+    print(f"Saved IVF index with {index.nlist} lists to {index_path}.")
+
 
 def main():
-    # Paths
-    base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    metadata_path = os.path.join(base_dir, 'metadata', 'meme_metadata.json')
-    embeddings_path = os.path.join(base_dir, 'metadata', 'meme_embeddings.json')
+    args = parse_args()
+    metadata_path = os.path.join(args.metadata_dir, 'meme_metadata.json')
+    store = EmbeddingStore(args.metadata_dir)
+
+    if args.import_json:
+        print(f"Importing {store.json_path}...")
+        image_names, _ = store.import_json(dtype=args.dtype)
+        print(f"Successfully imported embeddings for {len(image_names)} memes into {store.vectors_path}.")
+        build_index(args, store)
+        return
 
     # Load metadata
     print(f"Loading metadata from {metadata_path}...")
     with open(metadata_path, 'r') as f:
         data = json.load(f)
 
-    # Initialize model
-    print("Loading SentenceTransformer model...")
-    model = SentenceTransformer('all-MiniLM-L6-v2')
+    from encoder import MODEL_NAME
 
-    embeddings_data = []
-
-    print("Generating embeddings...")
+    wanted = []  # (image_name, text, hash) in metadata order
     for meme in data['memes']:
-        # Construct text for embedding: tags + prompt + captions
-        tags_text = " ".join(meme.get('tags', []))
-        prompt_text = meme.get('prompt', "")
-        captions_text = " ".join(meme.get('captions', []))
-        
-        text = f"{tags_text} {prompt_text} {captions_text}".strip()
-        
+        text = meme_text(meme)
         if text:
-            embedding = model.encode(text).tolist()
-            
-            embeddings_data.append({
-                "image_name": meme['image_name'],
-                "embedding": embedding
-            })
+            wanted.append((meme['image_name'], text, text_hash(text, MODEL_NAME)))
+    if not wanted:
+        print("No memes with text to embed, leaving the embedding store as it is.")
+        return
+
+    # Rows we can keep: same image and same text hash as the existing store
+    existing = {}
+    old_dtype = None
+    if store.exists() and not args.full:
+        sidecar = store.read_sidecar()
+        old_dtype = sidecar.get('dtype', 'float32')
+        old_names, old_matrix = store.load(mmap=True)
+        old_hashes = sidecar.get('text_hashes') or [None] * len(old_names)
+        existing = {name: (row, h) for row, (name, h) in enumerate(zip(old_names, old_hashes)) if h}
+
+    reused = [i for i, (name, _, h) in enumerate(wanted) if existing.get(name, (None, None))[1] == h]
+    reused_set = set(reused)
+    changed = [i for i in range(len(wanted)) if i not in reused_set]
+    removed = len(set(existing) - {name for name, _, _ in wanted})
+    print(f"{len(wanted)} memes: {len(reused)} unchanged, {len(changed)} new or changed, {removed} removed.")
+
+    image_names = [name for name, _, _ in wanted]
+    hashes = [h for _, _, h in wanted]
+    if not changed and not removed and existing and image_names == old_names:
+        if old_dtype == args.dtype:
+            print("Embeddings are up to date.")
+            build_index(args, store)
+            return
+        # Same vectors, only the storage dtype changes: rewrite without encoding anything
+        print(f"Embeddings are up to date but stored as {old_dtype}, converting to {args.dtype}.")
+
+    matrix = None
+    if reused:
+        dim = old_matrix.shape[1]
+        matrix = np.empty((len(wanted), dim), dtype=np.float32)
+        matrix[reused] = old_matrix[[existing[wanted[i][0]][0] for i in reused]]
+
+    if changed:
+        # Initialize model
+        print("Loading SentenceTransformer model...")
+        from sentence_transformers import SentenceTransformer
+        model = SentenceTransformer(MODEL_NAME)
+
+        print(f"Generating embeddings in batches of {args.batch_size}...")
+        start = time.perf_counter()
+        encoded = model.encode(
+            [wanted[i][1] for i in changed],
+            batch_size=args.batch_size,
+            convert_to_numpy=True,
+            show_progress_bar=len(changed) > args.batch_size
+        )
+        elapsed = time.perf_counter() - start
+        print(f"Encoded {len(changed)} memes in {elapsed:.2f}s ({len(changed) / elapsed:.1f} memes/s).")
+
+        if matrix is None:
+            matrix = np.empty((len(wanted), encoded.shape[1]), dtype=np.float32)
+        matrix[changed] = encoded
 
     # Save embeddings
-    print(f"Saving embeddings to {embeddings_path}...")
-    with open(embeddings_path, 'w') as f:
-        json.dump(embeddings_data, f, indent=2) # Saving as a list of objects
+    print(f"Saving embeddings to {store.vectors_path} ({args.dtype})...")
+    store.save(image_names, matrix, dtype=args.dtype, text_hashes=hashes)
+
+    if args.export_json:
+        print(f"Exporting embeddings to {store.json_path}...")
+        store.export_json()
+
+    build_index(args, store)
 
-    print(f"Successfully generated embeddings for {len(embeddings_data)} memes.")
+    print(f"Successfully generated embeddings for {len(image_names)} memes.")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,144 @@
+import argparse
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image, ImageOps, features
+
+base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_WIDTHS = (320, 640)
+VARIANTS_URL = '/images/variants'
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Generate resized WebP/AVIF variants of the vault images.")
+    parser.add_argument('--images-dir', default=os.path.join(base_dir, 'backend', 'images'),
+                        help="Directory with the original meme images")
+    parser.add_argument('--manifest', default=os.path.join(base_dir, 'backend', 'metadata', 'image_variants.json'),
+                        help="Where to write the image_name -> variants manifest")
+    parser.add_argument('--widths', type=int, nargs='+', default=list(DEFAULT_WIDTHS),
+                        help="Target widths in pixels (images are never upscaled)")
+    parser.add_argument('--formats', nargs='+', default=['webp', 'avif'], choices=['webp', 'avif'],
+                        help="Output formats; avif is skipped if this Pillow build lacks it")
+    parser.add_argument('--quality', type=int, default=75)
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help="Processes in the pool (default: one per core)")
+    return parser.parse_args()
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+
+def process_image(path, out_dir, widths, formats, quality):
+    # Runs in a worker process: returns the manifest entry for one image
+    image_name = os.path.basename(path)
+    stem = os.path.splitext(image_name)[0]
+    content_hash = file_hash(path)
+
+    with Image.open(path) as im:
+        animated = getattr(im, 'is_animated', False)
+        im.seek(0)  # GIFs become a still of their first frame
+        frame = ImageOps.exif_transpose(im)
+        frame = frame.convert('RGBA' if frame.mode in ('RGBA', 'LA', 'P') else 'RGB')
+        width, height = frame.size
+
+        variants = []
+        for target in sorted({min(w, width) for w in widths}):
+            resized = frame if target == width else frame.resize(
+                (target, max(1, round(height * target / width))), Image.LANCZOS
+            )
+            for fmt in formats:
+                filename = f"{stem}.{content_hash}.{target}.{fmt}"
+                out_path = os.path.join(out_dir, filename)
+                # Content-hash names: an unchanged source never needs re-encoding
+                if not os.path.exists(out_path):
+                    resized.save(out_path, format=fmt.upper(), quality=quality)
+                variants.append({
+                    "width": target,
+                    "height": resized.size[1],
+                    "format": fmt,
+                    "url": f"{VARIANTS_URL}/{filename}",
+                    "bytes": os.path.getsize(out_path)
+                })
+
+    return image_name, {
+        "hash": content_hash,
+        "width": width,
+        "height": height,
+        "animated": animated,
+        "original_bytes": os.path.getsize(path),
+        "variants": variants
+    }
+
+
+def main():
+    args = parse_args()
+    formats = [fmt for fmt in args.formats if features.check(fmt)]
+    skipped = set(args.formats) - set(formats)
+    if skipped:
+        print(f"Pillow has no support for {', '.join(sorted(skipped))}, skipping.")
+
+    out_dir = os.path.join(args.images_dir, 'variants')
+    os.makedirs(out_dir, exist_ok=True)
+
+    images = sorted(
+        os.path.join(args.images_dir, name) for name in os.listdir(args.images_dir)
+        if name.lower().endswith(('.jpg', '.jpeg', '.png', '.gif', '.webp'))
+    )
+
+    previous = {}
+    if os.path.exists(args.manifest):
+        with open(args.manifest, 'r') as f:
+            previous = json.load(f)
+
+    print(f"Generating variants for {len(images)} images with {args.workers} workers...")
+    start = time.perf_counter()
+    manifest = {}
+    failed = 0
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = {
+            path: pool.submit(process_image, path, out_dir, args.widths, formats, args.quality)
+            for path in images
+        }
+        for path, future in futures.items():
+            try:
+                image_name, entry = future.result()
+                manifest[image_name] = entry
+            except Exception as e:
+                failed += 1
+                image_name = os.path.basename(path)
+                if image_name in previous:
+                    # Keep serving what the last run made; a transient error shouldn't remove it
+                    manifest[image_name] = previous[image_name]
+                    print(f"Failed to process {path}, keeping its previous variants: {e}")
+                else:
+                    print(f"Failed to process {path}: {e}")
+
+    # Drop variants whose source changed or disappeared (kept entries of failed images stay live)
+    live = {os.path.basename(v['url']) for entry in manifest.values() for v in entry['variants']}
+    removed = 0
+    for name in os.listdir(out_dir):
+        if name not in live:
+            os.remove(os.path.join(out_dir, name))
+            removed += 1
+
+    with open(args.manifest, 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    elapsed = time.perf_counter() - start
+    original = sum(e['original_bytes'] for e in manifest.values())
+    smallest = sum(min(v['bytes'] for v in e['variants']) for e in manifest.values() if e['variants'])
+    print(f"Processed {len(images) - failed} images in {elapsed:.2f}s ({failed} failed), removed {removed} stale variants.")
+    print(f"Originals: {original / 1024:.0f} KB, smallest variants: {smallest / 1024:.0f} KB.")
+    print(f"Manifest written to {args.manifest}.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+backend_dir = os.path.join(base_dir, 'backend')
+
+from benchmark import free_port, write_synthetic_vault
+
+MODES = ('preload', 'per-worker')
+QUERIES = ["monday mood", "when the code finally compiles", "cat", "surprised pikachu", "this is fine"]
+
+# --encoder stub: a sentence_transformers stand-in put first on the servers' path.
+# It returns hashed word vectors, loads no weights and never imports torch, so the
+# numbers cover the app and the vault only.
+STUB_ENCODER = """
+import zlib
+import numpy as np
+
+
+class SentenceTransformer:
+    def __init__(self, model_name, **kwargs):
+        self.model_name = model_name
+
+    def _encode_one(self, text):
+        vector = np.zeros(384, dtype=np.float32)
+        for word in text.lower().split() or ['']:
+            vector += np.random.default_rng(zlib.crc32(word.encode())).standard_normal(384).astype(np.float32)
+        return vector / np.linalg.norm(vector)
+
+    def encode(self, texts, **kwargs):
+        if isinstance(texts, str):
+            return self._encode_one(texts)
+        return np.array([self._encode_one(text) for text in texts], dtype=np.float32).reshape(len(texts), 384)
+"""
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Start gunicorn with and without --preload and report the memory each process really uses (Linux)."
+    )
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--encoder', choices=('model', 'stub'), default='model',
+                        help="model: the real encoder (MEMEDOCK_ENCODER_BACKEND, weights included in the numbers). "
+                             "stub: hashed word vectors, no weights or torch, to measure the app and vault alone")
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES))
+    parser.add_argument('--synthetic', type=int, default=None,
+                        help="Serve a synthetic vault of this many memes instead of backend/metadata")
+    parser.add_argument('--requests', type=int, default=200,
+                        help="Searches sent before measuring, so every worker has touched the index")
+    parser.add_argument('--settle', type=float, default=2.0, help="Seconds to wait after the warm-up requests")
+    parser.add_argument('--timeout', type=float, default=600, help="Seconds to wait for the server to become ready")
+    parser.add_argument('--output', help="Also write the measurements to this JSON file")
+    return parser.parse_args()
+
+
+def memory(pid):
+    # smaps_rollup gives RSS plus the split that matters here: PSS charges each
+    # shared page 1/N to each of the N processes mapping it, USS (private pages)
+    # is what the process would free on exit
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup", 'r') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                values[parts[0].rstrip(':')] = int(parts[1]) / 1024
+    return {
+        "rss_mb": round(values.get('Rss', 0), 1),
+        "pss_mb": round(values.get('Pss', 0), 1),
+        "uss_mb": round(values.get('Private_Clean', 0) + values.get('Private_Dirty', 0), 1),
+        "shared_mb": round(values.get('Shared_Clean', 0) + values.get('Shared_Dirty', 0), 1)
+    }
+
+
+def children(pid):
+    found = []
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", 'r') as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # The command name is in parentheses and may contain spaces; ppid follows it
+        if int(stat.rsplit(')', 1)[1].split()[1]) == pid:
+            found.append(int(entry))
+    return sorted(found)
+
+
+def prepare_app_dir(work_dir, synthetic):
+    # A copy of the backend code next to a synthetic vault; the server reads ./metadata
+    app_dir = os.path.join(work_dir, 'app')
+    os.makedirs(os.path.join(app_dir, 'metadata'))
+    os.makedirs(os.path.join(app_dir, 'images'))
+    for name in os.listdir(backend_dir):
+        if name.endswith('.py'):
+            shutil.copy(os.path.join(backend_dir, name), app_dir)
+    print(f"Writing a synthetic vault of {synthetic} memes...")
+    write_synthetic_vault(os.path.join(app_dir, 'metadata'), synthetic, 384, 'float32')
+    return app_dir
+
+
+def prepare_stub_encoder(work_dir):
+    stub_dir = os.path.join(work_dir, 'stub_encoder')
+    os.makedirs(stub_dir)
+    with open(os.path.join(stub_dir, 'sentence_transformers.py'), 'w') as f:
+        f.write(STUB_ENCODER)
+    return stub_dir
+
+
+def start_gunicorn(app_dir, work_dir, mode, workers, stub_dir=None):
+    port = free_port()
+    env = {
+        **os.environ,
+        "MEMEDOCK_PRELOAD": "1" if mode == 'preload' else "0",
+        # Workers only accept requests once their model is loaded
+        "MEMEDOCK_EAGER_WARMUP": "1",
+        "MEMEDOCK_VOTES_DB": os.path.join(work_dir, f'votes-{mode}.db'),
+        "MEMEDOCK_SUBMISSIONS_DB": os.path.join(work_dir, f'submissions-{mode}.db'),
+        "MEMEDOCK_PROXY_CACHE_DIR": os.path.join(work_dir, 'proxy_cache'),
+        # Nothing in this measurement should leave the machine
+        "REDDIT_BASE_URL": "http://127.0.0.1:9",
+        "IMGFLIP_API_URL": "http://127.0.0.1:9/get_memes",
+        "MEMEDOCK_EXTERNAL_SOURCE_TIMEOUT": "0.2",
+    }
+    if stub_dir:
+        env["MEMEDOCK_ENCODER_BACKEND"] = "torch"
+        env["PYTHONPATH"] = os.pathsep.join(filter(None, [stub_dir, os.environ.get('PYTHONPATH')]))
+    env.pop('REDDIT_CLIENT_ID', None)
+    env.pop('REDDIT_CLIENT_SECRET', None)
+    log_path = os.path.join(work_dir, f'gunicorn-{mode}.log')
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', os.path.join(backend_dir, 'gunicorn.conf.py'),
+         '--chdir', app_dir, '--bind', f'127.0.0.1:{port}', '--workers', str(workers), 'main:app'],
+        env=env, stdout=open(log_path, 'w'), stderr=subprocess.STDOUT
+    )
+    return process, f"http://127.0.0.1:{port}", log_path
+
+
+def wait_until_serving(process, url, workers, timeout):
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        if process.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with code {process.returncode}")
+        try:
+            if len(children(process.pid)) >= workers and httpx.get(f"{url}/ready", timeout=5).status_code == 200:
+                return time.perf_counter() - start
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    raise TimeoutError(f"{url} was not ready after {timeout}s")
+
+
+def warm_up(url, count):
+    # Separate connections land on different workers, so each one scans the index
+    for i in range(count):
+        with httpx.Client(timeout=30) as client:
+            client.get(f"{url}/search", params={"query": f"{QUERIES[i % len(QUERIES)]} {i}"})
+
+
+def measure_mode(args, app_dir, work_dir, mode, stub_dir=None):
+    process, url, log_path = start_gunicorn(app_dir, work_dir, mode, args.workers, stub_dir)
+    try:
+        try:
+            ready_s = wait_until_serving(process, url, args.workers, args.timeout)
+        except Exception:
+            print(f"gunicorn log: {log_path}")
+            raise
+        warm_up(url, args.requests)
+        time.sleep(args.settle)
+
+        master = {"pid": process.pid, **memory(process.pid)}
+        workers = [{"pid": pid, **memory(pid)} for pid in children(process.pid)]
+    finally:
+        process.terminate()
+        process.wait(timeout=60)
+
+    def mean(key):
+        return round(sum(w[key] for w in workers) / len(workers), 1)
+
+    return {
+        "ready_s": round(ready_s, 2),
+        "master": master,
+        "workers": workers,
+        # What the whole server costs the machine, shared pages counted once
+        "total_pss_mb": round(master['pss_mb'] + sum(w['pss_mb'] for w in workers), 1),
+        "worker_rss_mean_mb": mean('rss_mb'),
+        # What one more worker adds
+        "worker_uss_mean_mb": mean('uss_mb')
+    }
+
+
+def main():
+    args = parse_args()
+    work_dir = tempfile.mkdtemp(prefix='memedock-memory-')
+    app_dir = prepare_app_dir(work_dir, args.synthetic) if args.synthetic else backend_dir
+    stub_dir = prepare_stub_encoder(work_dir) if args.encoder == 'stub' else None
+
+    results = {"workers": args.workers, "synthetic": args.synthetic, "encoder": args.encoder, "modes": {}}
+    for mode in args.modes:
+        print(f"Measuring {mode} with {args.workers} workers and the {args.encoder} encoder...")
+        result = results["modes"][mode] = measure_mode(args, app_dir, work_dir, mode, stub_dir)
+        print(f"  ready in {result['ready_s']}s, master {result['master']['pss_mb']} MB PSS")
+        for worker in result['workers']:
+            print(f"  worker {worker['pid']}: rss {worker['rss_mb']} MB, pss {worker['pss_mb']} MB, "
+                  f"uss {worker['uss_mb']} MB, shared {worker['shared_mb']} MB")
+        print(f"  total PSS {result['total_pss_mb']} MB, per worker: rss {result['worker_rss_mean_mb']} MB, "
+              f"uss {result['worker_uss_mean_mb']} MB")
+
+    print(f"\n{'mode':<12}{'total PSS MB':>14}{'worker RSS MB':>15}{'worker USS MB':>15}")
+    for mode, result in results["modes"].items():
+        print(f"{mode:<12}{result['total_pss_mb']:>14}{result['worker_rss_mean_mb']:>15}{result['worker_uss_mean_mb']:>15}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}.")
+    shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+from cache import LRUCache, normalize_query
+from fallback import ExternalMemeFetcher
+
+BUDGET = 0.5
+SLOW_SECONDS = 3
+
+
+class WordEncoder:
+    # Hashed word vectors instead of the model: texts sharing words are similar
+    def __init__(self):
+        self.query_cache = LRUCache('test_query_embeddings', maxsize=64)
+
+    def _encode_one(self, text):
+        vector = np.zeros(384, dtype=np.float32)
+        for word in text.lower().split() or ['']:
+            vector += np.random.default_rng(zlib.crc32(word.encode())).standard_normal(384).astype(np.float32)
+        return vector / np.linalg.norm(vector)
+
+    def encode(self, texts, **kwargs):
+        if isinstance(texts, str):
+            return self._encode_one(texts)
+        return np.array([self._encode_one(text) for text in texts], dtype=np.float32)
+
+    def encode_query(self, query):
+        return self._encode_one(query)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # r/memes is slower than the whole budget, imgflip errors, r/dankmemes answers
+    def do_GET(self):
+        if self.path.startswith('/r/memes/'):
+            time.sleep(SLOW_SECONDS)
+            self._json(200, {"data": {"children": []}})
+        elif self.path.startswith('/r/dankmemes/'):
+            post = {"url": "https://i.example.com/pikachu.jpg", "title": "surprised pikachu face", "score": 42}
+            self._json(200, {"data": {"children": [{"data": post}]}})
+        else:
+            self._json(500, {"error": "upstream broke"})
+
+    def _json(self, status, body):
+        payload = json.dumps(body).encode()
+        try:
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+        except OSError:
+            # The client gave up on the slow route
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_url():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def fetcher(stub_url, monkeypatch):
+    monkeypatch.delenv('REDDIT_CLIENT_ID', raising=False)
+    monkeypatch.delenv('REDDIT_CLIENT_SECRET', raising=False)
+    monkeypatch.setenv('REDDIT_BASE_URL', stub_url)
+    monkeypatch.setenv('IMGFLIP_API_URL', f"{stub_url}/imgflip")
+    # The per-source deadline is longer than the budget, so only the budget can stop r/memes
+    monkeypatch.setenv('MEMEDOCK_EXTERNAL_SOURCE_TIMEOUT', str(SLOW_SECONDS * 2))
+    monkeypatch.setenv('MEMEDOCK_EXTERNAL_BUDGET', str(BUDGET))
+    monkeypatch.setenv('MEMEDOCK_BREAKER_FAILURES', '1')
+    monkeypatch.setenv('MEMEDOCK_BREAKER_BACKOFF', '60')
+    return ExternalMemeFetcher(encoder=WordEncoder())
+
+
+def lookup(fetcher, query):
+    async def run():
+        try:
+            start = time.perf_counter()
+            result = await fetcher.search_external(query)
+            return result, time.perf_counter() - start
+        finally:
+            await fetcher.aclose()
+    return asyncio.run(run())
+
+
+def test_fallback_stays_within_budget(fetcher):
+    _, elapsed = lookup(fetcher, "surprised pikachu")
+    assert elapsed < BUDGET + 0.5
+
+
+def test_fallback_returns_partial_results_flagged_degraded(fetcher):
+    result, _ = lookup(fetcher, "surprised pikachu")
+    assert result is not None
+    assert result['source'] == 'reddit/dankmemes'
+    assert result['caption'] == "surprised pikachu face"
+    assert result['degraded'] is True
+    # A partial answer is not cached, the next lookup asks every source again
+    assert fetcher.result_cache.get(normalize_query("surprised pikachu")) is None
+
+
+def test_failing_sources_are_reported_and_skipped(fetcher):
+    lookup(fetcher, "surprised pikachu")
+    assert sorted(fetcher.unavailable_sources()) == ['imgflip', 'reddit/memes']
+
+    # Their circuits are open: the next lookup only asks r/dankmemes and doesn't wait for the budget
+    result, elapsed = lookup(fetcher, "pikachu")
+    assert result['source'] == 'reddit/dankmemes'
+    assert result['degraded'] is True
+    assert elapsed < BUDGET